@@ -7,6 +7,7 @@ from datetime import datetime, timedelta
 from binance.client import Client
 from HybridAIProcessor import HybridAIProcessor
 from indicators import compute_indicators
+from signal_event_log import signal_event_log
 import time
 from DataManager import DataManager
 from BTCAnalyzer import BTCAnalyzer
@@ -162,6 +163,7 @@ class ComprehensiveAnalyzer:
             latest, analysis, full_df = compute_indicators(df, btc_df)
             
             if latest is not None and analysis is not None:
+                signal_event_log.record_live(symbol, tf, analysis)
                 latest_dict = self._serialize_latest_data(latest)
                 serialized_analysis = self.data_serializer.serialize_analysis_data(analysis)
                 
@@ -198,6 +200,7 @@ class ComprehensiveAnalyzer:
             latest, analysis, full_df = compute_indicators(df)
             
             if latest is not None and analysis is not None:
+                signal_event_log.record_live(symbol, tf, analysis)
                 latest_dict = self._serialize_latest_data(latest)
                 serialized_analysis = self.data_serializer.serialize_analysis_data(analysis)
                 
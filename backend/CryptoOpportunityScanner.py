@@ -1,6 +1,10 @@
 # crypto_scanner.py - Crypto Opportunity Scanner using Binance API
 from flask import Flask, jsonify, request
 from indicators import compute_indicators
+from signal_event_log import signal_event_log
+from kline_cache import kline_cache
+from kline_downloader import kline_downloader
+from kline_store import records_to_frame
 import pandas as pd
 import requests
 import logging
@@ -49,39 +53,14 @@ class CryptoOpportunityScanner:
     def get_binance_klines(self, symbol, timeframe, limit=500):
         """Fetch kline data from Binance API"""
         try:
-            url = f"{self.base_url}/klines"
-            params = {
-                'symbol': symbol,
-                'interval': self.timeframe_map.get(timeframe, '1h'),
-                'limit': limit
-            }
-            
-            response = self.session.get(url, params=params, timeout=10)
-            response.raise_for_status()
-            
-            data = response.json()
+            # Served from the shared kline cache; after a candle closes only
+            # the new candles (and the forming one) are requested
+            records = kline_cache.recent(kline_downloader, symbol, self.timeframe_map.get(timeframe, '1h'), limit)
             
-            if not data:
+            if len(records) == 0:
                 return None
             
-            # Convert to DataFrame
-            df = pd.DataFrame(data, columns=[
-                'timestamp', 'open', 'high', 'low', 'close', 'volume',
-                'close_time', 'quote_asset_volume', 'number_of_trades',
-                'taker_buy_base_asset_volume', 'taker_buy_quote_asset_volume', 'ignore'
-            ])
-            
-            # Convert data types
-            numeric_columns = ['open', 'high', 'low', 'close', 'volume']
-            for col in numeric_columns:
-                df[col] = pd.to_numeric(df[col])
-            
-            # Convert timestamp
-            df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
-            df.set_index('timestamp', inplace=True)
-            
-            # Keep only required columns
-            df = df[numeric_columns]
+            df = records_to_frame(records)
             
             return df
             
@@ -117,6 +96,9 @@ class CryptoOpportunityScanner:
                     'error': 'Technical analysis failed'
                 }
             
+            # Keep a history of which strategies fired on each closed candle
+            signal_event_log.record_live(symbol, timeframe, analysis)
+            
             # Extract key metrics
             current_price = float(latest['close'])
             signal_data = analysis['overall_signal']
@@ -1,6 +1,8 @@
 import os
 from binance.client import Client
-import pandas as pd
+
+from kline_cache import kline_cache
+from kline_store import records_to_frame
 
 BINANCE_API_KEY = os.getenv("BINANCE_API_KEY")
 BINANCE_API_SECRET = os.getenv("BINANCE_API_SECRET")
@@ -45,30 +47,13 @@ class DataManager:
         try:
             binance_interval = self.timeframe_map.get(interval, Client.KLINE_INTERVAL_1HOUR)
             
-            klines = self.client.get_klines(
-                symbol=symbol, 
-                interval=binance_interval, 
-                limit=limit
-            )
+            # Shared cache: only candles closed since the last call are fetched
+            records = kline_cache.recent(self.client, symbol, binance_interval, limit)
             
-            if not klines:
+            if len(records) == 0:
                 return None
             
-            df = pd.DataFrame(klines, columns=[
-                'timestamp', 'open', 'high', 'low', 'close', 'volume',
-                'close_time', 'quote_asset_volume', 'number_of_trades',
-                'taker_buy_base_asset_volume', 'taker_buy_quote_asset_volume', 'ignore'
-            ])
-            
-            df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
-            
-            price_columns = ['open', 'high', 'low', 'close', 'volume']
-            for col in price_columns:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-            
-            df = df.sort_values('timestamp').reset_index(drop=True)
-            df.set_index('timestamp', inplace=True)
-            df = df[price_columns]
+            df = records_to_frame(records)
             
             return df
             
@@ -17,6 +17,7 @@ from blueprints.referral import referral_bp
 from blueprints.reports import reports_bp
 from blueprints.payments import payments_bp
 from blueprints.billing import billing_bp
+from blueprints.backtester import backtest_bp
 import pytz
 from models import db
 from celery import Celery
@@ -93,6 +94,7 @@ app.register_blueprint(referral_bp, url_prefix='/api')
 app.register_blueprint(reports_bp)
 app.register_blueprint(payments_bp)
 app.register_blueprint(billing_bp)
+app.register_blueprint(backtest_bp, url_prefix='/api')
 
 def register_comprehensive_analysis_bp():
     from blueprints.comprehensive_analysis import comprehensive_analysis_bp
@@ -0,0 +1,219 @@
+# backtest_benchmark.py - Reproducible throughput benchmark of the backtest path
+#
+# Runs the stages of Backtester.run_backtest on synthetic (or fixture) klines
+# of several lengths and reports, per stage, the wall time, bars/second and
+# the peak memory allocated while the stage ran:
+#   indicators   compute_indicators
+#   strategies   TradingStrategies.run_all_strategies
+#   simulation   simulation_inputs + simulator run (as simulate_trades)
+#   metrics      performance_metrics
+# Results can be written as a JSON baseline and later runs compared to it,
+# so speedup claims for any stage can be checked on the same machine.
+#
+#   python backtest_benchmark.py --sizes 10000 100000 1000000 --output baseline.json
+#   python backtest_benchmark.py --compare baseline.json
+import argparse
+import json
+import os
+import platform
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from backtester import performance_metrics, periods_per_year, simulation_frame, simulation_inputs
+from indicators import compute_indicators
+from kline_store import DEFAULT_STORE_DIR, INTERVAL_MS, records_to_frame
+from simulation_engine import SimulationParams, make_simulator
+from strategies import TradingStrategies
+
+BENCHMARK_SIZES = [10_000, 100_000, 1_000_000]
+STAGES = ['indicators', 'strategies', 'simulation', 'metrics']
+
+DEFAULT_BASELINE_PATH = os.path.join(os.path.dirname(DEFAULT_STORE_DIR), 'benchmarks', 'backtest_baseline.json')
+
+
+def synthetic_klines(n_bars, timeframe='15m', seed=0, start='2020-01-01'):
+    """
+    Deterministic OHLCV frame of n_bars candles: a random walk with slow
+    volatility regimes and trends, so strategies produce a realistic mix of
+    signals and trades.
+    """
+    rng = np.random.default_rng(seed)
+    regime = 1 + 0.5 * np.sin(np.arange(n_bars) / 2_000)
+    returns = rng.normal(0, 0.004, n_bars) * regime + 0.0004 * np.sin(np.arange(n_bars) / 700)
+    close = 100 * np.exp(np.cumsum(returns))
+    open_ = np.concatenate([[close[0]], close[:-1]])
+    spread = np.abs(rng.normal(0, 0.002, n_bars)) * close
+    index = pd.date_range(start, periods=n_bars, freq=pd.Timedelta(milliseconds=INTERVAL_MS[timeframe]))
+    index.name = 'timestamp'
+    return pd.DataFrame({
+        'open': open_,
+        'high': np.maximum(open_, close) + spread,
+        'low': np.minimum(open_, close) - spread,
+        'close': close,
+        'volume': rng.lognormal(8, 0.6, n_bars)
+    }, index=index)
+
+
+def fixture_klines(path, n_bars):
+    """First n_bars candles of a KlineStore .npy file (KLINE_DTYPE) as an OHLCV frame"""
+    records = np.load(path, mmap_mode='r')
+    if len(records) < n_bars:
+        raise ValueError(f"{path} has {len(records)} candles, {n_bars} requested")
+    return records_to_frame(np.array(records[:n_bars]))
+
+
+def _stages(df, params, timeframe):
+    """The benchmarked stages as (name, callable(state)) in pipeline order"""
+    def indicators(state):
+        _, _, state['indicators_df'] = compute_indicators(df, None)
+
+    def strategies(state):
+        results = TradingStrategies(df, state['indicators_df']).run_all_strategies()
+        state['signals_df'] = results['signals_df']
+
+    def simulation(state):
+        signals_df = state['signals_df']
+        index, arrays = simulation_inputs(simulation_frame(df, state['indicators_df'], signals_df),
+                                          signals_df.columns)
+        simulator = make_simulator(params)
+        equity = simulator.run(**arrays)
+        state['records'] = simulator.ledger.records
+        state['equity'] = np.concatenate([[params.initial_capital], equity])
+
+    def metrics(state):
+        state['metrics'] = performance_metrics(state['records'], state['equity'], params.initial_capital,
+                                               periods_per_year(timeframe))
+
+    return [('indicators', indicators), ('strategies', strategies), ('simulation', simulation),
+            ('metrics', metrics)]
+
+
+def benchmark_size(df, params=None, timeframe='15m', repeats=3, measure_memory=True):
+    """
+    Time every stage on one frame: best of `repeats` wall times, then one
+    more pass under tracemalloc for the peak memory of each stage (tracing
+    slows allocation, so it is kept out of the timed passes).
+    """
+    params = params or SimulationParams()
+    n_bars = len(df)
+    stages = _stages(df, params, timeframe)
+    seconds = {name: float('inf') for name in STAGES}
+    for _ in range(max(1, repeats)):
+        state = {}
+        for name, stage in stages:
+            started = time.perf_counter()
+            stage(state)
+            seconds[name] = min(seconds[name], time.perf_counter() - started)
+
+    peak_mb = {}
+    if measure_memory:
+        state = {}
+        tracemalloc.start()
+        try:
+            for name, stage in stages:
+                tracemalloc.reset_peak()
+                base = tracemalloc.get_traced_memory()[0]
+                stage(state)
+                peak_mb[name] = (tracemalloc.get_traced_memory()[1] - base) / 2**20
+        finally:
+            tracemalloc.stop()
+
+    result = {'bars': n_bars, 'trades': int(len(state['records'])), 'stages': {}}
+    for name in STAGES:
+        result['stages'][name] = {
+            'seconds': seconds[name],
+            'bars_per_second': n_bars / seconds[name] if seconds[name] > 0 else None,
+            'peak_mb': peak_mb.get(name)
+        }
+    result['total_seconds'] = sum(seconds.values())
+    result['bars_per_second'] = n_bars / result['total_seconds']
+    return result
+
+
+def run_benchmark(sizes=None, timeframe='15m', repeats=3, measure_memory=True, fixture=None, seed=0,
+                  params=None):
+    """
+    Benchmark every size (synthetic klines, or the first bars of a KlineStore
+    .npy fixture). Returns {'environment', 'timeframe', 'results': [...]}.
+    """
+    results = []
+    for n_bars in sizes or BENCHMARK_SIZES:
+        df = fixture_klines(fixture, n_bars) if fixture else synthetic_klines(n_bars, timeframe, seed)
+        print(f"Benchmarking {n_bars} bars")
+        results.append(benchmark_size(df, params, timeframe, repeats, measure_memory))
+    return {
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count()
+        },
+        'timeframe': timeframe,
+        'source': fixture or f'synthetic (seed {seed})',
+        'repeats': repeats,
+        'results': results
+    }
+
+
+def write_baseline(report, path=DEFAULT_BASELINE_PATH):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    return path
+
+
+def compare_to_baseline(report, path=DEFAULT_BASELINE_PATH):
+    """
+    Speedup of each (size, stage) against a baseline file: baseline seconds /
+    current seconds, so > 1 is faster. Sizes missing from either side are skipped.
+    """
+    with open(path) as f:
+        baseline = json.load(f)
+    before = {r['bars']: r for r in baseline['results']}
+    speedups = {}
+    for result in report['results']:
+        old = before.get(result['bars'])
+        if old is None:
+            continue
+        speedups[result['bars']] = {
+            name: old['stages'][name]['seconds'] / result['stages'][name]['seconds']
+            for name in STAGES if result['stages'][name]['seconds'] > 0
+        }
+        speedups[result['bars']]['total'] = old['total_seconds'] / result['total_seconds']
+    return speedups
+
+
+def format_report(report):
+    lines = [f"{'bars':>9}  {'stage':<11}{'seconds':>10}{'bars/s':>14}{'peak MB':>10}"]
+    for result in report['results']:
+        for name in STAGES:
+            stage = result['stages'][name]
+            peak = f"{stage['peak_mb']:.1f}" if stage['peak_mb'] is not None else '-'
+            lines.append(f"{result['bars']:>9}  {name:<11}{stage['seconds']:>10.3f}"
+                         f"{stage['bars_per_second'] or 0:>14,.0f}{peak:>10}")
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark backtest throughput per stage')
+    parser.add_argument('--sizes', type=int, nargs='+', default=BENCHMARK_SIZES)
+    parser.add_argument('--timeframe', default='15m')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--fixture', help='KlineStore .npy file to use instead of synthetic klines')
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc pass')
+    parser.add_argument('--output', help=f'write the report as a baseline (e.g. {DEFAULT_BASELINE_PATH})')
+    parser.add_argument('--compare', help='baseline file to compare against')
+    args = parser.parse_args()
+
+    report = run_benchmark(args.sizes, args.timeframe, args.repeats, not args.no_memory, args.fixture)
+    print(format_report(report))
+    if args.output:
+        print(f"Baseline written to {write_baseline(report, args.output)}")
+    if args.compare:
+        for bars, speedups in compare_to_baseline(report, args.compare).items():
+            print(f"{bars:>9}  " + '  '.join(f"{name} x{value:.2f}" for name, value in speedups.items()))
@@ -0,0 +1,126 @@
+# backtest_cache.py - Cache of backtest results keyed by data and parameters
+#
+# A result is stored under a hash of everything that determines it: symbol,
+# timeframe, resolved candle range, a fingerprint of the price data used
+# (including BTC), the strategy set, every simulation parameter and the
+# simulation engine version. Entries are gzip-compressed JSON files; the
+# least recently used ones are evicted once the directory exceeds max_bytes.
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+
+from simulation_engine import ENGINE_VERSION
+
+DEFAULT_CACHE_DIR = os.getenv(
+    'BACKTEST_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'backtest_cache')
+)
+DEFAULT_MAX_BYTES = int(os.getenv('BACKTEST_CACHE_MAX_MB', '256')) * 1024 * 1024
+
+_SUFFIX = '.json.gz'
+
+
+def frame_fingerprint(df):
+    """sha256 of an OHLCV frame's open times and prices"""
+    if df is None:
+        return None
+    digest = hashlib.sha256()
+    digest.update(df.index.values.astype('datetime64[ms]').astype('<i8').tobytes())
+    digest.update(np.ascontiguousarray(
+        df[['open', 'high', 'low', 'close', 'volume']].to_numpy(dtype='<f8')).tobytes())
+    return digest.hexdigest()
+
+
+def backtest_key(**parts):
+    """Stable hash of the parts that determine a backtest result (plus ENGINE_VERSION)"""
+    parts['engine_version'] = ENGINE_VERSION
+    encoded = json.dumps(parts, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+class BacktestCache:
+    """Size-bounded on-disk LRU of backtest results"""
+
+    def __init__(self, base_dir=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.base_dir = base_dir or DEFAULT_CACHE_DIR
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.base_dir, f"{key}{_SUFFIX}")
+
+    def get(self, key):
+        """Cached payload for key, or None"""
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                payload = json.load(f)
+            os.utime(path)  # mark as recently used
+            return payload
+        except Exception as e:
+            logging.error(f"Dropping unreadable backtest cache entry {key}: {e}")
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+    def put(self, key, payload):
+        """Store a JSON-serializable payload and evict old entries over the size limit"""
+        os.makedirs(self.base_dir, exist_ok=True)
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with gzip.open(tmp_path, 'wt', encoding='utf-8', compresslevel=6) as f:
+            json.dump(payload, f, separators=(',', ':'), default=_json_default)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes"""
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.base_dir):
+                if not name.endswith(_SUFFIX):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(self.base_dir, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+            total = sum(size for _, size, _ in entries)
+            for _, size, name in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.base_dir, name))
+                    total -= size
+                except OSError:
+                    pass
+
+    def clear(self):
+        if not os.path.isdir(self.base_dir):
+            return
+        for name in os.listdir(self.base_dir):
+            if name.endswith(_SUFFIX):
+                os.remove(os.path.join(self.base_dir, name))
+
+
+def _json_default(value):
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return float(value)
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return str(value)
+
+
+# Shared cache used by Backtester.run_backtest
+backtest_cache = BacktestCache()
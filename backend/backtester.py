@@ -6,16 +6,339 @@ from binance.client import Client
 import os
 from indicators import compute_indicators
 from strategies import TradingStrategies
+from backtest_cache import backtest_cache, backtest_key, frame_fingerprint
+from kline_cache import kline_cache
+from kline_downloader import kline_downloader
+from kline_store import INTERVAL_MS, kline_store as shared_kline_store, records_to_frame, resolve_range
+from simulation_engine import (SimulationParams, TradeLedger, EXIT_REASONS, FILL_MODELS,
+                               ORDER_MODELS, TIE_BREAKS, LONG, SHORT, TRADE_DTYPE, make_simulator)
 import traceback
 
+# Strategies that get a higher vote in the combined signal strength
+ENHANCED_STRATEGIES = ['scalping_ema', 'rsi_mean_rev', 'momentum_break', 'stoch_div',
+                       'multi_rsi', 'wr_pullback', 'adaptive_bb', 'macd_hist', 'vpa']
+ENHANCED_WEIGHT = 1.5
+# Normalizer for summed strategy weights (max possible is around 15 for enhanced strategies)
+SIGNAL_NORMALIZER = 15
+
+# Metrics evaluate_weight_vectors can rank by (all higher-is-better)
+WEIGHT_RANKING_METRICS = ['sharpe_ratio', 'total_return', 'avg_return', 'win_rate', 'profit_factor']
+
+
+def strategy_signal_matrix(signals_df):
+    """Split a signal frame into aligned (bars x strategies) buy and sell matrices"""
+    strategies = [col[:-len('_buy')] for col in signals_df.columns if col.endswith('_buy')]
+    buy = signals_df[[f'{name}_buy' for name in strategies]].to_numpy(dtype=bool)
+    sell = np.zeros_like(buy)
+    for i, name in enumerate(strategies):
+        if f'{name}_sell' in signals_df.columns:
+            sell[:, i] = signals_df[f'{name}_sell'].to_numpy(dtype=bool)
+    return strategies, buy, sell
+
+
+def signal_strengths(signals_df, weights=None, normalizer=SIGNAL_NORMALIZER):
+    """
+    Vectorized get_signal_strength for every row of a signal frame.
+    
+    weights: one weight per strategy (ordered as strategy_signal_matrix), or a
+    (K x strategies) matrix to get K strength columns at once.
+    Returns (buy_strength, sell_strength) arrays shaped (bars,) or (bars, K).
+    """
+    strategies, buy, sell = strategy_signal_matrix(signals_df)
+    if weights is None:
+        weights = default_strategy_weights(strategies)
+    weights = np.asarray(weights, dtype=float)
+    
+    buy_strength = np.minimum(buy.astype(float) @ weights.T / normalizer, 1.0)
+    sell_strength = np.minimum(sell.astype(float) @ weights.T / normalizer, 1.0)
+    return buy_strength, sell_strength
+
+
+def default_strategy_weights(strategies):
+    """Weight vector used by the live backtest: enhanced strategies count 1.5x"""
+    return np.array([
+        ENHANCED_WEIGHT if any(enhanced in name for enhanced in ENHANCED_STRATEGIES) else 1.0
+        for name in strategies
+    ])
+
+
+class BacktestCancelled(Exception):
+    """Raised by a progress callback to stop a running backtest"""
+
+
+class EquityStats:
+    """
+    Max drawdown and per-bar return moments of an equity curve, accumulated
+    online so a curve can be fed in consecutive pieces (chunked backtests)
+    and never has to be held in memory as a whole.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0  # sum of squared deviations from the mean
+        self.last = None
+        self.peak = None
+        self.max_drawdown = 0.0
+
+    def update(self, equity):
+        """Append the next piece of the curve"""
+        equity = np.asarray(equity, dtype=float)
+        if len(equity) == 0:
+            return self
+        # The first bar of the whole curve has a zero return
+        previous = np.concatenate([[equity[0] if self.last is None else self.last], equity[:-1]])
+        returns = equity / previous - 1
+
+        # Merge the piece's moments into the running ones (Chan et al.)
+        n = len(returns)
+        mean = returns.mean()
+        total = self.count + n
+        delta = mean - self.mean
+        self.m2 += ((returns - mean) ** 2).sum() + delta ** 2 * self.count * n / total
+        self.mean += delta * n / total
+        self.count = total
+
+        peak = np.maximum.accumulate(equity)
+        if self.peak is not None:
+            peak = np.maximum(peak, self.peak)
+        self.max_drawdown = min(self.max_drawdown, float(((equity - peak) / peak).min()))
+        self.peak = peak[-1]
+        self.last = equity[-1]
+        return self
+
+    def sharpe_ratio(self, periods_per_year):
+        returns_std = np.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0
+        if returns_std != 0:
+            return float(self.mean / returns_std * np.sqrt(periods_per_year))
+        return 0
+
+
+def position_records(records):
+    """
+    Ledger records with the take-profit legs of each position merged into one
+    record (ladder order model), in ledger order of their first leg: profits
+    and quantities summed, the quantity-weighted exit price, the last exit bar
+    and the exit reason of the last leg. Records of single-exit positions are
+    returned as they are.
+    """
+    if len(records) < 2:
+        return records
+    # Ledgers stitched from several runs (walk-forward windows) restart seq, so the entry bar is part of the key
+    keys = np.stack([records['symbol'].astype(np.int64), records['seq'], records['entry_idx']], axis=1)
+    _, first, groups = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    if len(first) == len(records):
+        return records
+    rank = np.empty(len(first), dtype=np.int64)
+    rank[np.argsort(first)] = np.arange(len(first))
+    groups = rank[groups.ravel()]
+
+    positions = records[np.sort(first)].copy()
+    quantity = np.bincount(groups, weights=records['quantity'])
+    exit_value = np.bincount(groups, weights=records['quantity'] * records['exit_price'])
+    positions['exit_price'] = np.divide(exit_value, quantity, out=positions['exit_price'].copy(),
+                                        where=quantity > 0)
+    positions['quantity'] = quantity
+    positions['profit'] = np.bincount(groups, weights=records['profit'])
+    np.maximum.at(positions['exit_idx'], groups, records['exit_idx'])
+    last = np.zeros(len(first), dtype=np.int64)
+    np.maximum.at(last, groups, np.arange(len(records)))
+    positions['exit_reason'] = records['exit_reason'][last]
+    return positions
+
+
+def performance_metrics(records, equity, initial_capital, periods_per_year):
+    """
+    Performance metrics from trade ledger records (simulation_engine.TRADE_DTYPE)
+    and the equity curve, without going through a DataFrame. equity is the
+    per-bar curve or an EquityStats fed with it. Trade statistics count
+    positions, so the legs of a laddered exit are one trade.
+    """
+    records = position_records(records)
+    if len(records) == 0:
+        return {
+            'total_profit': 0, 'return_pct': 0, 'win_rate': 0, 
+            'max_drawdown': 0, 'num_trades': 0, 'sharpe_ratio': 0,
+            'avg_win': 0, 'avg_loss': 0, 'profit_factor': 0,
+            'avg_signal_strength': 0, 'best_strategy': 'None'
+        }
+
+    profits = records['profit']
+    
+    # Basic metrics
+    total_profit = float(profits.sum())
+    return_pct = (total_profit / initial_capital) * 100
+    win_rate = float((profits > 0).mean()) * 100
+    num_trades = len(records)
+    
+    # Win/Loss analysis
+    wins = profits[profits > 0]
+    losses = profits[profits < 0]
+    
+    avg_win = float(wins.mean()) if len(wins) > 0 else 0
+    avg_loss = float(losses.mean()) if len(losses) > 0 else 0
+    profit_factor = abs(avg_win / avg_loss) if avg_loss != 0 else float('inf')
+    
+    # Drawdown and Sharpe ratio
+    stats = equity if isinstance(equity, EquityStats) else EquityStats().update(equity)
+    max_drawdown = stats.max_drawdown * 100
+    sharpe_ratio = stats.sharpe_ratio(periods_per_year)
+    
+    # Strategy analysis: profit per (side, strength) label, labels in sorted order
+    avg_signal_strength = float(records['signal_strength'].mean())
+    sides = np.where(records['direction'] == LONG, 'long', 'short')
+    labels = np.array([f'enhanced_{side}_{strength:.2f}'
+                       for side, strength in zip(sides, records['signal_strength'])])
+    names, groups = np.unique(labels, return_inverse=True)
+    strategy_profit = np.bincount(groups, weights=profits, minlength=len(names))
+    best_strategy = str(names[np.argmax(strategy_profit)])
+    
+    return {
+        'total_profit': total_profit,
+        'return_pct': return_pct,
+        'win_rate': win_rate,
+        'max_drawdown': max_drawdown,
+        'num_trades': num_trades,
+        'sharpe_ratio': sharpe_ratio,
+        'avg_win': avg_win,
+        'avg_loss': avg_loss,
+        'profit_factor': profit_factor,
+        'avg_signal_strength': avg_signal_strength,
+        'best_strategy': best_strategy,
+        'strategy_breakdown': {str(name): float(profit) for name, profit in zip(names, strategy_profit)}
+    }
+
+
+def fetch_klines(client, symbol, timeframe, start_date, end_date=None, store=None):
+    """
+    Historical klines as a float OHLCV frame indexed by open time.
+    With a kline_store.KlineStore, closed candles are served from disk and only
+    the missing part of the range is downloaded; without one they go through
+    the shared in-memory kline_cache.
+    """
+    if store is not None and timeframe in INTERVAL_MS:
+        df = store.get_klines(client, symbol, timeframe, start_date, end_date)
+        print(f"Loaded {len(df)} bars for {symbol} {timeframe} from the kline store")
+        return df
+
+    if timeframe in INTERVAL_MS:
+        # Without a store, closed candles come through the shared in-memory cache
+        df = records_to_frame(kline_cache.range(client, symbol, timeframe, start_date, end_date))
+        print(f"Fetched {len(df)} bars for {symbol} {timeframe}")
+        return df
+
+    klines = client.get_historical_klines(symbol, timeframe, start_date, end_date)
+    df = pd.DataFrame(klines, columns=[
+        'timestamp', 'open', 'high', 'low', 'close', 'volume',
+        'close_time', 'quote_asset_volume', 'number_of_trades',
+        'taker_buy_base_asset_volume', 'taker_buy_quote_asset_volume', 'ignore'
+    ])
+    df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
+    df.set_index('timestamp', inplace=True)
+    df = df[['open', 'high', 'low', 'close', 'volume']].astype(float)
+    print(f"Fetched {len(df)} bars for {symbol} {timeframe}")
+    return df
+
+
+def periods_per_year(timeframe):
+    """Bars per year used to annualize Sharpe ratios"""
+    return 365 if 'd' in timeframe else 365 * 24 if 'h' in timeframe else 365 * 24 * 60
+
+
+def compute_signals(df, btc_df=None, custom_strategies=None):
+    """Indicators and strategy results for one OHLCV frame: (indicators_df, results)"""
+    _, _, indicators_df = compute_indicators(df, btc_df)
+    if indicators_df is None:
+        raise ValueError("Failed to compute indicators")
+
+    # Use strategies
+    strategy_system = TradingStrategies(df, indicators_df, custom_strategies=custom_strategies)
+    return indicators_df, strategy_system.run_all_strategies()
+
+
+def simulation_frame(df, indicators_df, signals_df):
+    """Prices, ATR and signals aligned on the bars that have all of them"""
+    sim_df = pd.concat([df, indicators_df['atr_14'], signals_df], axis=1)
+    sim_df.dropna(inplace=True)
+    return sim_df
+
+
+def simulation_inputs(sim_df, signal_columns):
+    """
+    The simulation inputs of a simulation frame as contiguous arrays:
+    (index, {close, atr, buy_strength, sell_strength, high, low}),
+    ready for ArraySimulator.run(**arrays).
+    """
+    buy_strength, sell_strength = signal_strengths(sim_df[list(signal_columns)])
+    arrays = {
+        'close': sim_df['close'].to_numpy(dtype=float),
+        'atr': sim_df['atr_14'].to_numpy(dtype=float),
+        'buy_strength': buy_strength,
+        'sell_strength': sell_strength,
+        'high': sim_df['high'].to_numpy(dtype=float),
+        'low': sim_df['low'].to_numpy(dtype=float),
+    }
+    return sim_df.index, arrays
+
+
+def ledger_trades(records, entry_dates, exit_dates):
+    """Trade dicts for the API from ledger records and their entry/exit bar dates"""
+    trades = []
+    for k, record in enumerate(records):
+        side = 'long' if record['direction'] == LONG else 'short'
+        strength = float(record['signal_strength'])
+        trades.append({
+            'strategy': f'enhanced_{side}_{strength:.2f}',
+            'entry_date': entry_dates[k],
+            'exit_date': exit_dates[k],
+            'entry_price': float(record['entry_price']),
+            'exit_price': float(record['exit_price']),
+            'quantity': float(record['quantity']),
+            'profit': float(record['profit']),
+            'type': f"{side}_{EXIT_REASONS[record['exit_reason']]}",
+            'signal_strength': strength
+        })
+    return trades
+
+
+def serialize_backtest(metrics, trades, portfolio):
+    """JSON-safe run_backtest output (ISO dates) for task results and API responses"""
+    return {
+        'metrics': metrics,
+        'trades': [{**t, 'entry_date': t['entry_date'].isoformat(), 'exit_date': t['exit_date'].isoformat()}
+                   for t in trades],
+        'equity_curve': portfolio['equity'].tolist() if 'equity' in portfolio else [],
+        'equity_dates': [d.isoformat() for d in portfolio.index]
+    }
+
+
 class Backtester:
     def __init__(self, symbol, timeframe, start_date, end_date, initial_capital=10000, 
-                 risk_per_trade=0.02, strategies=None, api_key=None, api_secret=None):
+                 risk_per_trade=0.02, strategies=None, api_key=None, api_secret=None,
+                 custom_strategies=None, fill_model='close', tie_break='stop_first',
+                 client=None, kline_store=None, order_model='market', downloader=None):
         """
         Enhanced backtester with improved signal processing and risk management.
         
         Parameters:
         - risk_per_trade: Increased default to 2% for more aggressive trading
+        - custom_strategies: list of {'name', 'buy', 'sell'} expression strategies
+          (see strategy_expressions.py) evaluated alongside the built-in ones
+        - fill_model: 'close' checks stops/targets on the bar close, 'intrabar'
+          on the bar high/low; tie_break ('stop_first' or 'target_first') picks
+          the fill when one bar touches both
+        - order_model: 'market' enters on the signal close with one target and
+          a trailing stop; 'ladder' places AISignals-style limit entries with
+          partial take profits (the entry_zone_atr, stop_atr, take_profit_ratios,
+          tp_fractions, entry_expiry_bars and stop_moves attributes, see
+          simulation_engine.LadderSimulator)
+        - client: kline client to use instead of a binance Client built from the
+          API keys (e.g. kline_store.LocalKlineClient for offline runs)
+        - kline_store: KlineStore serving historical klines from disk; defaults
+          to the shared store, False fetches everything from the client
+        - downloader: kline_downloader.KlineDownloader that downloads klines with
+          parallel page requests; defaults to the shared one unless a client is
+          given, in which case the client serves the klines
         - Better signal filtering and position management
         """
         self.symbol = symbol.upper()
@@ -26,52 +349,73 @@ class Backtester:
         self.current_capital = initial_capital
         self.risk_per_trade = risk_per_trade
         self.strategies = strategies or ['all']
-        self.client = Client(api_key or os.getenv('BINANCE_API_KEY'), api_secret or os.getenv('BINANCE_API_SECRET'))
+        self.custom_strategies = custom_strategies or []
+        self.client = client or Client(api_key or os.getenv('BINANCE_API_KEY'), api_secret or os.getenv('BINANCE_API_SECRET'))
+        self.kline_store = shared_kline_store if kline_store is None else (kline_store or None)
+        self.downloader = downloader if downloader is not None else (None if client else kline_downloader)
         self.df = None
+        self.btc_df = None
         self.indicators_df = None
         self.signals_df = None
         self.trades = []
+        self.ledger = TradeLedger()
         self.portfolio = pd.DataFrame()
+        # Optional callable(stage, info_dict), see _report
+        self.progress_callback = None
         
         # Enhanced parameters
         self.min_signal_strength = 0.6  # Minimum signal strength to enter trades
         self.max_positions = 3  # Maximum concurrent positions
         self.trailing_stop_pct = 0.05  # 5% trailing stop
         self.take_profit_ratio = 2.5  # Take profit at 2.5:1 R:R
+        if fill_model not in FILL_MODELS:
+            raise ValueError(f"Unknown fill model '{fill_model}', expected one of {FILL_MODELS}")
+        if tie_break not in TIE_BREAKS:
+            raise ValueError(f"Unknown tie break '{tie_break}', expected one of {TIE_BREAKS}")
+        if order_model not in ORDER_MODELS:
+            raise ValueError(f"Unknown order model '{order_model}', expected one of {ORDER_MODELS}")
+        self.fill_model = fill_model
+        self.tie_break = tie_break
+        self.order_model = order_model
+
+        # Ladder order model
+        self.entry_zone_atr = (0.25, 0.75)  # Limit at 0.25 ATR from the close, zone to 0.75 ATR
+        self.stop_atr = 1.5  # Stop 1.5 ATR beyond the zone
+        self.take_profit_ratios = (1.0, 2.0, 3.0)  # TP1-TP3 in R
+        self.tp_fractions = (1 / 3, 1 / 3, 1 / 3)  # Share of the position closed at each TP
+        self.entry_expiry_bars = 12  # Cancel unfilled limit orders after 12 bars
+        self.stop_moves = True  # Stop to break-even after TP1, to TP1 after TP2
+
+    @property
+    def kline_client(self):
+        """Where historical klines come from: the downloader if there is one, else the client"""
+        return self.downloader if self.downloader is not None else self.client
 
     def fetch_data(self):
         """Fetch historical data from Binance"""
         try:
-            klines = self.client.get_historical_klines(
-                self.symbol,
-                self.timeframe,
-                self.start_date,
-                self.end_date
-            )
-            self.df = pd.DataFrame(klines, columns=[
-                'timestamp', 'open', 'high', 'low', 'close', 'volume',
-                'close_time', 'quote_asset_volume', 'number_of_trades',
-                'taker_buy_base_asset_volume', 'taker_buy_quote_asset_volume', 'ignore'
-            ])
-            self.df['timestamp'] = pd.to_datetime(self.df['timestamp'], unit='ms')
-            self.df.set_index('timestamp', inplace=True)
-            self.df = self.df[['open', 'high', 'low', 'close', 'volume']].astype(float)
-            print(f"Fetched {len(self.df)} bars for {self.symbol} {self.timeframe}")
+            self.df = fetch_klines(self.kline_client, self.symbol, self.timeframe,
+                                   self.start_date, self.end_date, self.kline_store)
         except Exception as e:
             print(f"Error fetching data: {e}")
             traceback.print_exc()
             raise
 
+    def _require_signals(self):
+        """
+        Make sure signals_df is there: a run served from backtest_cache only
+        restores the price frames, so indicators and signals are computed on
+        first use.
+        """
+        if self.signals_df is None and self.df is not None:
+            self.compute_indicators_and_strategies(self.btc_df)
+        if self.signals_df is None:
+            raise ValueError("Signals not computed")
+
     def compute_indicators_and_strategies(self, btc_df=None):
         """Compute indicators and run strategies"""
         try:
-            _, _, self.indicators_df = compute_indicators(self.df, btc_df)
-            if self.indicators_df is None:
-                raise ValueError("Failed to compute indicators")
-
-            # Use strategies
-            strategy_system = TradingStrategies(self.df, self.indicators_df)
-            results = strategy_system.run_all_strategies()
+            self.indicators_df, results = compute_signals(self.df, btc_df, self.custom_strategies)
             self.signals_df = results['signals_df']
             
             # Store strategy results for analysis
@@ -101,42 +445,156 @@ class Backtester:
         buy_cols = [col for col in signals_row.index if '_buy' in col and signals_row[col]]
         sell_cols = [col for col in signals_row.index if '_sell' in col and signals_row[col] and 'exit' not in col]
         
-        # Enhanced strategies get higher weight
-        enhanced_strategies = ['scalping_ema', 'rsi_mean_rev', 'momentum_break', 'stoch_div', 
-                             'multi_rsi', 'wr_pullback', 'adaptive_bb', 'macd_hist', 'vpa']
-        
         buy_strength = 0
         sell_strength = 0
         
+        # Enhanced strategies get higher weight
         for col in buy_cols:
-            weight = 1.5 if any(strategy in col for strategy in enhanced_strategies) else 1.0
+            weight = ENHANCED_WEIGHT if any(strategy in col for strategy in ENHANCED_STRATEGIES) else 1.0
             buy_strength += weight
             
         for col in sell_cols:
-            weight = 1.5 if any(strategy in col for strategy in enhanced_strategies) else 1.0
+            weight = ENHANCED_WEIGHT if any(strategy in col for strategy in ENHANCED_STRATEGIES) else 1.0
             sell_strength += weight
         
-        # Normalize strength (max possible is around 15 for enhanced strategies)
-        max_possible = 15
-        buy_strength = min(buy_strength / max_possible, 1.0)
-        sell_strength = min(sell_strength / max_possible, 1.0)
+        buy_strength = min(buy_strength / SIGNAL_NORMALIZER, 1.0)
+        sell_strength = min(sell_strength / SIGNAL_NORMALIZER, 1.0)
         
         return buy_strength, sell_strength
 
-    def simulate_trades(self):
-        """Enhanced trade simulation with better signal processing"""
+    def compute_signal_strengths(self, weights=None, normalizer=SIGNAL_NORMALIZER):
+        """Vectorized get_signal_strength for every bar (see signal_strengths)"""
+        self._require_signals()
+        return signal_strengths(self.signals_df, weights, normalizer)
+
+    def _periods_per_year(self):
+        return periods_per_year(self.timeframe)
+
+    def evaluate_weight_vectors(self, weights, metric='sharpe_ratio', holding_period=10,
+                                min_signal_strength=None, normalizer=SIGNAL_NORMALIZER):
+        """
+        Evaluate K candidate strategy-weight vectors against the signal matrix at once.
+        
+        weights: (K x strategies) array ordered like strategy_signal_matrix, or a
+        DataFrame whose columns are strategy names (missing strategies get 0).
+        Entry/exit rule: every bar whose weighted strength reaches min_signal_strength
+        opens a trade at the close (long wins ties, as in simulate_trades) that is
+        closed holding_period bars later.
+        
+        Returns a DataFrame with one row per candidate, ranked by `metric`.
+        """
+        self._require_signals()
+        if metric not in WEIGHT_RANKING_METRICS:
+            raise ValueError(f"Unknown metric '{metric}', expected one of {WEIGHT_RANKING_METRICS}")
+        
+        strategies, buy, sell = strategy_signal_matrix(self.signals_df)
+        if isinstance(weights, pd.DataFrame):
+            weights = weights.reindex(columns=strategies, fill_value=0.0).to_numpy(dtype=float)
+        weights = np.atleast_2d(np.asarray(weights, dtype=float))
+        if weights.shape[1] != len(strategies):
+            raise ValueError(f"Expected {len(strategies)} weights per vector, got {weights.shape[1]}")
+        threshold = self.min_signal_strength if min_signal_strength is None else min_signal_strength
+        
+        # (bars x K) strengths from two matrix multiplies
+        buy_strength = np.minimum(buy.astype(float) @ weights.T / normalizer, 1.0)
+        sell_strength = np.minimum(sell.astype(float) @ weights.T / normalizer, 1.0)
+        direction = np.where(buy_strength >= threshold, 1.0,
+                             np.where(sell_strength >= threshold, -1.0, 0.0))
+        
+        # Forward return over the holding period; trades that cannot close are dropped
+        close = self.df['close'].reindex(self.signals_df.index).to_numpy(dtype=float)
+        forward_return = np.full(len(close), np.nan)
+        if len(close) > holding_period:
+            forward_return[:-holding_period] = close[holding_period:] / close[:-holding_period] - 1
+        valid = np.isfinite(forward_return)
+        direction[~valid] = 0.0
+        trade_returns = direction * np.where(valid, forward_return, 0.0)[:, None]
+        
+        is_trade = direction != 0
+        num_trades = is_trade.sum(axis=0)
+        safe_trades = np.maximum(num_trades, 1)
+        total_return = trade_returns.sum(axis=0)
+        avg_return = total_return / safe_trades
+        win_rate = (trade_returns > 0).sum(axis=0) / safe_trades * 100
+        
+        variance = ((trade_returns - avg_return) ** 2 * is_trade).sum(axis=0) / np.maximum(num_trades - 1, 1)
+        std = np.sqrt(variance)
+        trades_per_year = self._periods_per_year() / holding_period
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sharpe_ratio = np.where(std > 0, avg_return / std * np.sqrt(trades_per_year), 0.0)
+            gross_profit = np.where(trade_returns > 0, trade_returns, 0.0).sum(axis=0)
+            gross_loss = -np.where(trade_returns < 0, trade_returns, 0.0).sum(axis=0)
+            profit_factor = np.where(gross_loss > 0, gross_profit / gross_loss,
+                                     np.where(gross_profit > 0, np.inf, 0.0))
+        
+        results = pd.DataFrame({
+            'num_trades': num_trades,
+            'total_return': total_return * 100,
+            'avg_return': avg_return * 100,
+            'win_rate': win_rate,
+            'sharpe_ratio': sharpe_ratio,
+            'profit_factor': profit_factor
+        })
+        results.loc[num_trades == 0, ['avg_return', 'win_rate', 'sharpe_ratio']] = 0.0
+        results.index.name = 'candidate'
+        return results.sort_values(metric, ascending=False, kind='stable')
+
+    def _simulation_frame(self):
+        """Prices, ATR and signals aligned on the bars that have all of them"""
+        return simulation_frame(self.df, self.indicators_df, self.signals_df)
+
+    def simulate_trades(self, engine='array'):
+        """
+        Enhanced trade simulation with better signal processing.
+        
+        engine='array' runs the event-driven simulation_engine over NumPy arrays;
+        engine='iterrows' runs the original bar-by-bar loop (kept as a reference).
+        """
         if self.signals_df is None:
             raise ValueError("Signals not computed")
+        if engine == 'iterrows':
+            if self.fill_model != 'close' or self.order_model != 'market':
+                raise ValueError("The iterrows engine only supports the 'close' fill model and market orders")
+            return self._simulate_trades_iterrows()
+        if engine != 'array':
+            raise ValueError(f"Unknown simulation engine '{engine}'")
+
+        index, arrays = self.simulation_arrays()
+        simulator = make_simulator(SimulationParams.from_backtester(self))
+        progress = None
+        if self.progress_callback is not None:
+            progress = lambda done, total, trades: self._report(
+                'simulating', bars_processed=done, total_bars=total, trades=trades)
+        equity = simulator.run(**arrays, progress=progress)
+        self.current_capital = simulator.capital
+        self.ledger = simulator.ledger
+        self.trades = self._ledger_trades(index)
+
+        self.portfolio = pd.DataFrame(
+            {'equity': np.concatenate([[self.initial_capital], equity])},
+            index=pd.DatetimeIndex([self.df.index[0] - pd.Timedelta(days=1)]).append(index)
+        )
+
+    def simulation_arrays(self):
+        """The simulation inputs as (index, arrays), see simulation_inputs"""
+        self._require_signals()
+        return simulation_inputs(self._simulation_frame(), self.signals_df.columns)
+
+    def _ledger_trades(self, index):
+        """Trade dicts for the API, built from the ledger columns"""
+        records = self.ledger.records
+        return ledger_trades(records, index[records['entry_idx']], index[records['exit_idx']])
 
-        # Merge data
-        sim_df = pd.concat([self.df, self.indicators_df['atr_14'], self.signals_df], axis=1)
-        sim_df.dropna(inplace=True)
+    def _simulate_trades_iterrows(self):
+        """Original bar-by-bar simulation over sim_df.iterrows()"""
+        sim_df = self._simulation_frame()
+        self.ledger = TradeLedger()
 
         positions = {}  # {strategy_id: position_info}
         equity = [self.initial_capital]
         position_counter = 0
 
-        for idx, row in sim_df.iterrows():
+        for i, (idx, row) in enumerate(sim_df.iterrows()):
             current_price = row['close']
             atr = row['atr_14']
             
@@ -182,17 +640,7 @@ class Backtester:
                 
                 if exit_reason:
                     self.current_capital += profit_loss
-                    self.trades.append({
-                        'strategy': pos['strategy'],
-                        'entry_date': pos['entry_date'],
-                        'exit_date': idx,
-                        'entry_price': pos['entry_price'],
-                        'exit_price': exit_price,
-                        'quantity': pos['quantity'],
-                        'profit': profit_loss,
-                        'type': f"{pos['direction']}_{exit_reason}",
-                        'signal_strength': pos['signal_strength']
-                    })
+                    self._record_trade(pos, i, exit_price, profit_loss, exit_reason)
                     positions_to_remove.append(pos_id)
             
             # Remove closed positions
@@ -215,13 +663,13 @@ class Backtester:
                     if quantity > 0:
                         position_counter += 1
                         positions[f'long_{position_counter}'] = {
-                            'strategy': f'enhanced_long_{buy_strength:.2f}',
+                            'seq': position_counter,
                             'entry_price': current_price,
                             'stop_loss': stop_loss,
                             'take_profit': take_profit,
                             'quantity': quantity,
                             'direction': 'long',
-                            'entry_date': idx,
+                            'entry_idx': i,
                             'highest_price': current_price,
                             'signal_strength': buy_strength
                         }
@@ -238,13 +686,13 @@ class Backtester:
                     if quantity > 0:
                         position_counter += 1
                         positions[f'short_{position_counter}'] = {
-                            'strategy': f'enhanced_short_{sell_strength:.2f}',
+                            'seq': position_counter,
                             'entry_price': current_price,
                             'stop_loss': stop_loss,
                             'take_profit': take_profit,
                             'quantity': quantity,
                             'direction': 'short',
-                            'entry_date': idx,
+                            'entry_idx': i,
                             'lowest_price': current_price,
                             'signal_strength': sell_strength
                         }
@@ -257,7 +705,8 @@ class Backtester:
                 else:
                     open_profit += (pos['entry_price'] - current_price) * pos['quantity']
             
-            equity.append(self.current_capital + sum(t['profit'] for t in self.trades) + open_profit)
+            # current_capital already includes realized profits
+            equity.append(self.current_capital + open_profit)
 
         # Close any remaining positions at the end
         if positions:
@@ -269,106 +718,221 @@ class Backtester:
                     profit = (pos['entry_price'] - final_price) * pos['quantity']
                 
                 self.current_capital += profit
-                self.trades.append({
-                    'strategy': pos['strategy'],
-                    'entry_date': pos['entry_date'],
-                    'exit_date': sim_df.index[-1],
-                    'entry_price': pos['entry_price'],
-                    'exit_price': final_price,
-                    'quantity': pos['quantity'],
-                    'profit': profit,
-                    'type': f"{pos['direction']}_final_close",
-                    'signal_strength': pos['signal_strength']
-                })
+                self._record_trade(pos, len(sim_df) - 1, final_price, profit, 'final_close')
 
+        self.trades = self._ledger_trades(sim_df.index)
         self.portfolio = pd.DataFrame({'equity': equity}, 
                                     index=[self.df.index[0] - pd.Timedelta(days=1)] + sim_df.index.tolist())
 
+    def _record_trade(self, pos, exit_idx, exit_price, profit, exit_reason):
+        """Append a closed bar-loop position to the ledger"""
+        self.ledger.append(pos['seq'], LONG if pos['direction'] == 'long' else SHORT,
+                           pos['entry_idx'], exit_idx, pos['entry_price'], exit_price,
+                           pos['quantity'], profit, EXIT_REASONS.index(exit_reason),
+                           pos['signal_strength'])
+
     def get_performance_metrics(self):
-        """Calculate enhanced performance metrics"""
-        if not self.trades:
-            return {
-                'total_profit': 0, 'return_pct': 0, 'win_rate': 0, 
-                'max_drawdown': 0, 'num_trades': 0, 'sharpe_ratio': 0,
-                'avg_win': 0, 'avg_loss': 0, 'profit_factor': 0,
-                'avg_signal_strength': 0, 'best_strategy': 'None'
-            }
-
-        trades_df = pd.DataFrame(self.trades)
-        
-        # Basic metrics
-        total_profit = trades_df['profit'].sum()
-        return_pct = (total_profit / self.initial_capital) * 100
-        win_rate = (trades_df['profit'] > 0).mean() * 100
-        num_trades = len(self.trades)
-        
-        # Win/Loss analysis
-        winning_trades = trades_df[trades_df['profit'] > 0]
-        losing_trades = trades_df[trades_df['profit'] < 0]
-        
-        avg_win = winning_trades['profit'].mean() if len(winning_trades) > 0 else 0
-        avg_loss = losing_trades['profit'].mean() if len(losing_trades) > 0 else 0
-        profit_factor = abs(avg_win / avg_loss) if avg_loss != 0 else float('inf')
-        
-        # Drawdown calculation
-        equity_series = self.portfolio['equity']
-        returns = equity_series.pct_change().fillna(0)
-        cum_returns = (1 + returns).cumprod()
-        peak = cum_returns.cummax()
-        drawdown = (cum_returns - peak) / peak
-        max_drawdown = drawdown.min() * 100
-        
-        # Sharpe ratio
-        if returns.std() != 0:
-            periods_per_year = 365 if 'd' in self.timeframe else 365 * 24 if 'h' in self.timeframe else 365 * 24 * 60
-            sharpe_ratio = (returns.mean() / returns.std()) * np.sqrt(periods_per_year)
-        else:
-            sharpe_ratio = 0
-        
-        # Strategy analysis
-        avg_signal_strength = trades_df['signal_strength'].mean()
-        strategy_performance = trades_df.groupby('strategy')['profit'].sum()
-        best_strategy = strategy_performance.idxmax() if len(strategy_performance) > 0 else 'None'
-        
-        return {
-            'total_profit': total_profit,
-            'return_pct': return_pct,
-            'win_rate': win_rate,
-            'max_drawdown': max_drawdown,
-            'num_trades': num_trades,
-            'sharpe_ratio': sharpe_ratio,
-            'avg_win': avg_win,
-            'avg_loss': avg_loss,
-            'profit_factor': profit_factor,
-            'avg_signal_strength': avg_signal_strength,
-            'best_strategy': best_strategy,
-            'strategy_breakdown': strategy_performance.to_dict()
-        }
+        """Calculate enhanced performance metrics from the trade ledger"""
+        equity = self.portfolio['equity'].to_numpy(dtype=float) if 'equity' in self.portfolio else []
+        return performance_metrics(self.ledger.records, equity, self.initial_capital,
+                                   self._periods_per_year())
 
-    def run_backtest(self, fetch_btc=True):
-        """Run the enhanced backtest"""
-        print(f"Starting enhanced backtest for {self.symbol}")
-        
+    def prepare(self, fetch_btc=True, btc_df=None):
+        """
+        Fetch data and compute indicators and signals, everything before simulate_trades.
+        A BTC frame fetched elsewhere can be passed in as btc_df to skip refetching it.
+        """
+        self._report('fetching')
         self.fetch_data()
         
-        if fetch_btc and self.symbol != 'BTCUSDT':
+        if btc_df is None and fetch_btc and self.symbol != 'BTCUSDT':
             try:
-                btc_tester = Backtester('BTCUSDT', self.timeframe, self.start_date, self.end_date,
-                                              api_key=self.client.api_key, api_secret=self.client.api_secret)
-                btc_tester.fetch_data()
-                btc_df = btc_tester.df
+                btc_df = fetch_klines(self.kline_client, 'BTCUSDT', self.timeframe,
+                                      self.start_date, self.end_date, self.kline_store)
             except Exception as e:
                 print(f"Failed to fetch BTC data: {e}")
                 btc_df = None
-        else:
+        elif self.symbol == 'BTCUSDT':
             btc_df = None
 
+        self.btc_df = btc_df
+        self._report('indicators', total_bars=len(self.df))
         self.compute_indicators_and_strategies(btc_df)
+
+    def _report(self, stage, **info):
+        """Pass progress to progress_callback; the callback may raise BacktestCancelled"""
+        if self.progress_callback is not None:
+            self.progress_callback(stage, info)
+
+    def walk_forward(self, grid, train_days=90, test_days=30, step_days=None,
+                     metric='sharpe_ratio', max_workers=None, fetch_btc=True):
+        """
+        Rolling train/test optimization of the simulation parameters in `grid`
+        (see walk_forward.run_walk_forward). Returns the per-window table, the
+        stitched out-of-sample equity curve and its metrics.
+        """
+        from walk_forward import run_walk_forward
+        return run_walk_forward(self, grid, train_days, test_days, step_days, metric,
+                                max_workers, fetch_btc)
+
+    def compare_timeframes(self, timeframes, max_workers=None, fetch_btc=True):
+        """
+        Backtest these settings on several timeframes from one download of the
+        finest one (see multi_timeframe.compare_timeframes). Returns the
+        side-by-side metrics table and each timeframe's trades and equity.
+        """
+        from multi_timeframe import compare_timeframes
+        return compare_timeframes(self, timeframes, max_workers, fetch_btc)
+
+    def run_monte_carlo(self, n_paths=10000, method='shuffle', skip_prob=0.1, seed=None,
+                        keep_paths=False):
+        """
+        Monte Carlo resampling of the trades of the last run (see
+        monte_carlo.run_monte_carlo): return and drawdown distributions over
+        n_paths shuffled, bootstrapped or trade-skipping sequences.
+        """
+        from monte_carlo import run_monte_carlo
+        return run_monte_carlo(self.ledger.records, self.initial_capital, n_paths, method,
+                               skip_prob, seed, keep_paths)
+
+    def parity_replay(self, window=500, step=1, max_bars=None, fetch_btc=False):
+        """
+        Replay this range candle by candle through the live scanner path and
+        compare it with the batch signals bar by bar (see parity_replay):
+        diverging signals and indicators, entry mismatches and live latency.
+        """
+        from parity_replay import backtester_parity
+        return backtester_parity(self, window, step, max_bars, fetch_btc)
+
+    def screen_strategies(self, horizons=(1, 5, 20)):
+        """
+        Signal-only screen of every strategy (see strategy_screen): hit rate,
+        average signed forward return and t-stat per strategy, side and
+        horizon, without simulating positions.
+        """
+        self._require_signals()
+        from strategy_screen import screen_signals
+        close = self.df['close'].reindex(self.signals_df.index)
+        return screen_signals(self.signals_df, close, horizons)
+
+    def run_chunked(self, chunk_bars=50_000, warmup_bars=1_000, fetch_btc=True, equity_freq='1D',
+                    checkpoint=None):
+        """
+        Memory-bounded backtest for long ranges (see chunked_backtest): data is
+        loaded and simulated in chunks of chunk_bars with warmup_bars of
+        indicator warm-up, metrics are accumulated online and the equity curve
+        is sampled at equity_freq. With a checkpoint path the run saves its
+        state between chunks and resumes from it. Returns (metrics, trades, portfolio).
+        """
+        from chunked_backtest import run_chunked_backtest
+        print(f"Starting chunked backtest for {self.symbol}")
+        metrics, trades, portfolio = run_chunked_backtest(self, chunk_bars, warmup_bars, fetch_btc,
+                                                          equity_freq, checkpoint)
+        print(f"Chunked backtest completed: {metrics['num_trades']} trades, "
+              f"{metrics['return_pct']:.2f}% return, {metrics['win_rate']:.1f}% win rate")
+        return metrics, trades, portfolio
+
+    def run_backtest(self, fetch_btc=True, use_cache=True):
+        """
+        Run the enhanced backtest.
+
+        With use_cache and a kline store, a run whose data is already in the
+        store and whose settings match an earlier run is served from
+        backtest_cache without fetching or computing anything; other runs are
+        cached once done. Without a store a cached result could never be
+        looked up, so nothing is cached.
+        """
+        print(f"Starting enhanced backtest for {self.symbol}")
+
+        data_range = self._resolved_range() if use_cache and self.kline_store is not None else None
+        if data_range is not None:
+            frames = self._stored_frames(fetch_btc, *data_range)
+            if frames is not None:
+                payload = backtest_cache.get(self.cache_key(*frames, *data_range))
+                if payload is not None:
+                    self.df, self.btc_df = frames
+                    metrics = self._restore_cached(payload)
+                    print(f"Enhanced backtest served from cache: {metrics['num_trades']} trades")
+                    return metrics, self.trades, self.portfolio
+        
+        self.prepare(fetch_btc)
         self.simulate_trades()
         
         metrics = self.get_performance_metrics()
         
         print(f"Enhanced backtest completed: {metrics['num_trades']} trades, "
               f"{metrics['return_pct']:.2f}% return, {metrics['win_rate']:.1f}% win rate")
+
+        if data_range is not None:
+            try:
+                backtest_cache.put(self.cache_key(self.df, self.btc_df, *data_range),
+                                   self._cache_payload(metrics))
+            except Exception as e:
+                print(f"Failed to cache backtest result: {e}")
         
-        return metrics, self.trades, self.portfolio
\ No newline at end of file
+        return metrics, self.trades, self.portfolio
+
+    def _resolved_range(self):
+        """
+        Requested range as candle open-time bounds in ms, or None if it cannot
+        be resolved or the timeframe cannot be read from the kline store
+        """
+        if self.timeframe not in INTERVAL_MS:
+            return None
+        try:
+            return resolve_range(self.timeframe, self.start_date, self.end_date)
+        except Exception as e:
+            print(f"Cannot resolve backtest range for caching: {e}")
+            return None
+
+    def _stored_frames(self, fetch_btc, start_ms, end_ms):
+        """(df, btc_df) read from the kline store without network, or None if not all stored"""
+        if self.kline_store is None:
+            return None
+        records = self.kline_store.read(self.symbol, self.timeframe, start_ms, end_ms)
+        if records is None:
+            return None
+        btc_df = None
+        if fetch_btc and self.symbol != 'BTCUSDT':
+            btc_records = self.kline_store.read('BTCUSDT', self.timeframe, start_ms, end_ms)
+            if btc_records is None:
+                return None
+            btc_df = records_to_frame(btc_records)
+        return records_to_frame(records), btc_df
+
+    def cache_key(self, df, btc_df, start_ms, end_ms):
+        """backtest_cache key for this backtest's settings over the given data"""
+        return backtest_key(
+            symbol=self.symbol,
+            timeframe=self.timeframe,
+            start_ms=start_ms,
+            end_ms=end_ms,
+            data=frame_fingerprint(df),
+            btc_data=frame_fingerprint(btc_df),
+            strategies=self.strategies,
+            custom_strategies=self.custom_strategies,
+            params=vars(SimulationParams.from_backtester(self))
+        )
+
+    def _cache_payload(self, metrics):
+        records = self.ledger.records
+        return {
+            'metrics': metrics,
+            'current_capital': self.current_capital,
+            'ledger': {name: records[name].tolist() for name in TRADE_DTYPE.names},
+            'equity': self.portfolio['equity'].tolist(),
+            'equity_index': self.portfolio.index.values.astype('datetime64[ms]').astype(np.int64).tolist()
+        }
+
+    def _restore_cached(self, payload):
+        """Load ledger, trades and equity curve from a cached payload; returns the metrics"""
+        ledger = payload['ledger']
+        records = np.zeros(len(ledger['profit']), dtype=TRADE_DTYPE)
+        for name in TRADE_DTYPE.names:
+            records[name] = ledger[name]
+        self.ledger = TradeLedger.from_records(records)
+        index = pd.to_datetime(payload['equity_index'], unit='ms')
+        self.portfolio = pd.DataFrame({'equity': payload['equity']}, index=index)
+        self.trades = self._ledger_trades(index[1:])
+        self.current_capital = payload['current_capital']
+        return payload['metrics']
\ No newline at end of file
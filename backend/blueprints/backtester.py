@@ -1,49 +1,219 @@
-import os
 from flask import Blueprint, request, jsonify
-from backtester import Backtester
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from celery.result import AsyncResult
+from celery_app import celery
+from strategy_expressions import ExpressionError, compile_expression
+from monte_carlo import MONTE_CARLO_METHODS
+from simulation_engine import FILL_MODELS, ORDER_MODELS, TIE_BREAKS
+from kline_store import INTERVAL_MS
+from tasks import (run_backtest_job, run_timeframe_comparison_job, request_backtest_cancel,
+                   remember_backtest_owner, backtest_owner)
 import traceback
 
 backtest_bp = Blueprint('backtest', __name__)
 
+MAX_MONTE_CARLO_PATHS = 100000
+
+
+def parse_backtest_request(data):
+    """Backtester keyword arguments from a request body; raises ValueError on bad input"""
+    data = data or {}
+    symbol = data.get('symbol')
+    timeframe = data.get('timeframe')
+    fill_model = data.get('fill_model', 'close')  # 'close' or 'intrabar'
+    tie_break = data.get('tie_break', 'stop_first')  # 'stop_first' or 'target_first'
+    order_model = data.get('order_model', 'market')  # 'market' or 'ladder'
+
+    if not symbol or not timeframe:
+        raise ValueError('Missing symbol or timeframe')
+    if fill_model not in FILL_MODELS or tie_break not in TIE_BREAKS:
+        raise ValueError(f'fill_model must be one of {FILL_MODELS}, tie_break one of {TIE_BREAKS}')
+    if order_model not in ORDER_MODELS:
+        raise ValueError(f'order_model must be one of {ORDER_MODELS}')
+
+    config = {
+        'symbol': symbol,
+        'timeframe': timeframe,
+        'start_date': data.get('start_date', '1 year ago UTC'),  # Default to Binance format
+        'end_date': data.get('end_date', None),
+        'initial_capital': data.get('capital', 10000),
+        'risk_per_trade': data.get('risk_per_trade', 0.01),
+        'strategies': data.get('strategies', None),  # List or None
+        'custom_strategies': data.get('custom_strategies', None),  # [{'name', 'buy', 'sell'}]
+        'fill_model': fill_model,
+        'tie_break': tie_break,
+        'order_model': order_model
+    }
+    # Only validated here: the chunked mode is a job option, not a Backtester argument
+    parse_chunk_bars(data, config)
+    return config
+
+
+def parse_chunk_bars(data, config):
+    """Optional 'chunk_bars' of a chunked backtest as a positive int, or None; raises ValueError"""
+    if data.get('chunk_bars') is None:
+        return None
+    chunk_bars = _integer_option(data, 'chunk_bars', None)
+    if chunk_bars < 1:
+        raise ValueError('chunk_bars must be a positive integer')
+    if config['timeframe'] not in INTERVAL_MS:
+        raise ValueError(f"Chunked backtests need a fixed-length timeframe, got '{config['timeframe']}'")
+    if config['order_model'] != 'market':
+        raise ValueError('Chunked backtests only support market orders')
+    return chunk_bars
+
+
+@backtest_bp.route('/backtest/compare-timeframes', methods=['POST'])
+@jwt_required()
+def compare_backtest_timeframes():
+    """
+    Queue the same settings on several timeframes, e.g. {"timeframes": ["15m", "1h", "4h"], ...};
+    poll GET /backtest/jobs/<job_id> for the result
+    """
+    try:
+        data = request.get_json() or {}
+        timeframes = data.get('timeframes') or []
+        if not isinstance(timeframes, list) or not timeframes:
+            return jsonify({'error': 'timeframes must be a non-empty list'}), 400
+        unknown = [tf for tf in timeframes if tf not in INTERVAL_MS]
+        if unknown:
+            return jsonify({'error': f'Unsupported timeframes {unknown}'}), 400
+        config = parse_backtest_request({**data, 'timeframe': timeframes[0]})
+        validate_custom_strategies(config)
+    except (ValueError, TypeError, AttributeError) as e:
+        message = f'Invalid custom strategy: {e}' if isinstance(e, ExpressionError) else str(e)
+        return jsonify({'error': message}), 400
+
+    try:
+        job = run_timeframe_comparison_job.apply_async(args=[config, timeframes])
+        remember_backtest_owner(job.id, get_jwt_identity())
+        return jsonify({'job_id': job.id, 'status': 'PENDING'}), 202
+    except Exception as e:
+        print(f"Timeframe comparison submission error: {e}")
+        traceback.print_exc()
+        return jsonify({'error': 'Could not queue timeframe comparison'}), 500
+
+
+def validate_custom_strategies(config):
+    """Reject bad expressions now instead of failing inside the worker (raises ExpressionError)"""
+    for strategy in config['custom_strategies'] or []:
+        for side in ('buy', 'sell'):
+            if strategy.get(side):
+                compile_expression(strategy[side])
+
+
+def _integer_option(options, name, default):
+    """options[name] as an int (integral floats and digit strings accepted); raises ValueError"""
+    value = options.get(name, default)
+    if value is None or isinstance(value, bool):
+        raise ValueError(f'{name} must be an integer')
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{name} must be an integer')
+    if not number.is_integer():
+        raise ValueError(f'{name} must be an integer')
+    return int(number)
+
+
+def parse_monte_carlo_request(data):
+    """
+    run_monte_carlo keyword arguments from the optional 'monte_carlo' request
+    field, or None; raises ValueError on bad options.
+    """
+    monte_carlo = data.get('monte_carlo')
+    if not monte_carlo:
+        return None
+    if monte_carlo is not True and not isinstance(monte_carlo, dict):
+        raise ValueError('Invalid monte_carlo options: expected true or an object')
+    options = monte_carlo if isinstance(monte_carlo, dict) else {}
+    try:
+        n_paths = _integer_option(options, 'n_paths', 10000)
+        if n_paths < 1:
+            raise ValueError('n_paths must be positive')
+        method = options.get('method', 'shuffle')
+        if method not in MONTE_CARLO_METHODS:
+            raise ValueError(f'method must be one of {MONTE_CARLO_METHODS}')
+        try:
+            skip_prob = float(options.get('skip_prob', 0.1))
+        except (TypeError, ValueError):
+            raise ValueError('skip_prob must be a number')
+        if not 0 <= skip_prob < 1:
+            raise ValueError('skip_prob must be in [0, 1)')
+        seed = None
+        if options.get('seed') is not None:
+            seed = _integer_option(options, 'seed', None)
+            if seed < 0:
+                raise ValueError('seed must be a non-negative integer')
+    except ValueError as e:
+        raise ValueError(f'Invalid monte_carlo options: {e}')
+    return {
+        'n_paths': min(n_paths, MAX_MONTE_CARLO_PATHS),
+        'method': method,
+        'skip_prob': skip_prob,
+        'seed': seed
+    }
+
+
 @backtest_bp.route('/backtest', methods=['POST'])
-def run_backtest():
+@backtest_bp.route('/backtest/jobs', methods=['POST'])
+@jwt_required()
+def submit_backtest_job():
+    """
+    Queue a backtest on the Celery workers; poll GET /backtest/jobs/<job_id> for progress.
+
+    Optional robustness check run in the same job after the backtest:
+    {"monte_carlo": {"n_paths": 10000, "method": "shuffle"}}
+    """
     try:
-        data = request.json
-        symbol = data.get('symbol')
-        timeframe = data.get('timeframe')
-        start_date = data.get('start_date', '1 year ago UTC')  # Default to Binance format
-        end_date = data.get('end_date', None)
-        capital = data.get('capital', 10000)
-        strategies = data.get('strategies', None)  # List or None
-        risk_per_trade = data.get('risk_per_trade', 0.01)
-
-        if not symbol or not timeframe:
-            return jsonify({'error': 'Missing symbol or timeframe'}), 400
-        
-        BINANCE_API_KEY = os.getenv("BINANCE_API_KEY")
-        BINANCE_API_SECRET = os.getenv("BINANCE_API_SECRET")
-
-        tester = Backtester(
-            symbol=symbol,
-            timeframe=timeframe,
-            start_date=start_date,
-            end_date=end_date,
-            initial_capital=capital,
-            risk_per_trade=risk_per_trade,
-            strategies=strategies,
-            api_key=BINANCE_API_KEY,
-            api_secret=BINANCE_API_SECRET
-        )
-
-        metrics, trades, portfolio = tester.run_backtest()
-
-        return jsonify({
-            'metrics': metrics,
-            'trades': trades,  # List of dicts
-            'equity_curve': portfolio['equity'].to_list()  # For charting
-        })
+        data = request.get_json()
+        config = parse_backtest_request(data)
+        validate_custom_strategies(config)
+        # Optional chunked mode for multi-year ranges on small timeframes
+        config['chunk_bars'] = parse_chunk_bars(data, config)
+        config['monte_carlo'] = parse_monte_carlo_request(data)
+    except (ValueError, TypeError, AttributeError) as e:
+        message = f'Invalid custom strategy: {e}' if isinstance(e, ExpressionError) else str(e)
+        return jsonify({'error': message}), 400
 
+    try:
+        config['use_cache'] = data.get('use_cache', True)
+        job = run_backtest_job.apply_async(args=[config])
+        remember_backtest_owner(job.id, get_jwt_identity())
+        return jsonify({'job_id': job.id, 'status': 'PENDING'}), 202
     except Exception as e:
-        print(f"Backtest error: {e}")
+        print(f"Backtest job submission error: {e}")
         traceback.print_exc()
-        return jsonify({'error': str(e)}), 500
\ No newline at end of file
+        return jsonify({'error': 'Could not queue backtest'}), 500
+
+
+@backtest_bp.route('/backtest/jobs/<job_id>', methods=['GET'])
+@jwt_required()
+def get_backtest_job(job_id):
+    """Job state, progress while running, and the result once finished"""
+    if backtest_owner(job_id) != str(get_jwt_identity()):
+        return jsonify({'error': 'Backtest job not found'}), 404
+
+    job = AsyncResult(job_id, app=celery)
+    response = {'job_id': job_id, 'status': job.state}
+    if job.state == 'PROGRESS':
+        response['progress'] = job.info
+    elif job.state == 'SUCCESS':
+        response['result'] = job.result
+    elif job.state == 'FAILURE':
+        response['error'] = str(job.result)
+    return jsonify(response)
+
+
+@backtest_bp.route('/backtest/jobs/<job_id>', methods=['DELETE'])
+@jwt_required()
+def cancel_backtest_job(job_id):
+    """Cancel a queued or running backtest"""
+    if backtest_owner(job_id) != str(get_jwt_identity()):
+        return jsonify({'error': 'Backtest job not found'}), 404
+
+    job = AsyncResult(job_id, app=celery)
+    if job.state in ('SUCCESS', 'FAILURE', 'CANCELLED'):
+        return jsonify({'job_id': job_id, 'status': job.state}), 409
+    request_backtest_cancel(job_id)
+    return jsonify({'job_id': job_id, 'status': 'CANCELLING'}), 202
@@ -5,8 +5,11 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 from sqlalchemy import func, and_, or_, desc, asc
 from collections import defaultdict
 import pytz
+import pandas as pd
+from kline_downloader import kline_downloader
 
 from models import db, AISignals, User
+from signal_replay import replay_signals, summarize_replay
 
 lebanon_tz = pytz.timezone("Asia/Beirut")
 reports_bp = Blueprint('reports', __name__, url_prefix='/api/reports')
@@ -516,4 +519,72 @@ def get_daily_activity():
     except Exception as e:
         print(f"Error in daily activity: {e}")
         print(traceback.format_exc())
-        return jsonify({'error': str(e), 'success': False}), 500
\ No newline at end of file
+        return jsonify({'error': str(e), 'success': False}), 500
+@reports_bp.route('/signal-replay', methods=['GET'])
+@jwt_required()
+def get_signal_replay():
+    """Replay the user's signals against historical klines for their actual outcomes"""
+    try:
+        user_id = get_jwt_identity()
+
+        days = request.args.get('days', 30, type=int)
+        symbol = request.args.get('symbol', '').upper()
+        interval = request.args.get('interval', '5m')
+        horizon_days = request.args.get('horizon_days', 14, type=int)
+        group_by = request.args.get('group_by', 'symbol')
+        if group_by not in ('symbol', 'timeframe', 'side', 'none'):
+            return jsonify({'error': 'group_by must be symbol, timeframe, side or none', 'success': False}), 400
+
+        start_date = datetime.now() - timedelta(days=days)
+        query = AISignals.query.filter(
+            and_(
+                AISignals.created_at >= start_date,
+                AISignals.user_id == user_id
+            )
+        )
+        if symbol:
+            query = query.filter(AISignals.symbol == symbol)
+        signals = query.all()
+
+        if not signals:
+            return jsonify({
+                'success': True,
+                'data': {'message': 'No signals found for the specified criteria'},
+                'filters': {'days': days, 'symbol': symbol}
+            })
+
+        outcomes = replay_signals(signals, interval=interval, horizon_days=horizon_days,
+                                  client=kline_downloader)
+
+        signal_outcomes = []
+        for row in outcomes.itertuples(index=False):
+            signal_outcomes.append({
+                'id': int(row.id),
+                'symbol': row.symbol,
+                'status': row.status,
+                'result': row.result,
+                'hit_tp_level': None if pd.isna(row.hit_tp_level) else int(row.hit_tp_level),
+                'first_hit': row.first_hit,
+                'fill_time': None if pd.isna(row.fill_time) else row.fill_time.isoformat(),
+                'exit_time': None if pd.isna(row.exit_time) else row.exit_time.isoformat(),
+                'r_multiple': None if pd.isna(row.r_multiple) else round(float(row.r_multiple), 3),
+                'mfe_r': None if pd.isna(row.mfe_r) else round(float(row.mfe_r), 3),
+                'mae_r': None if pd.isna(row.mae_r) else round(float(row.mae_r), 3)
+            })
+
+        return jsonify({
+            'success': True,
+            'data': {
+                'summary': summarize_replay(outcomes),
+                'breakdown': summarize_replay(outcomes, by=group_by) if group_by != 'none' else None,
+                'signals': signal_outcomes
+            },
+            'filters': {'days': days, 'symbol': symbol, 'interval': interval, 'horizon_days': horizon_days}
+        })
+
+    except ValueError as e:
+        return jsonify({'error': str(e), 'success': False}), 400
+    except Exception as e:
+        print(f"Error in signal replay: {e}")
+        print(traceback.format_exc())
+        return jsonify({'error': str(e), 'success': False}), 500
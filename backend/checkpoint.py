@@ -0,0 +1,71 @@
+# checkpoint.py - Compact on-disk checkpoints for long backtests and sweeps
+#
+# A checkpoint is one compressed .npz file: named NumPy arrays (position
+# slots, ledger records, completed sweep results...) plus a JSON metadata
+# entry. Files are written to a temporary name and renamed into place, so a
+# worker killed mid-write leaves the previous checkpoint intact.
+import hashlib
+import json
+import os
+
+import numpy as np
+
+DEFAULT_CHECKPOINT_DIR = os.getenv(
+    'CHECKPOINT_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'checkpoints')
+)
+
+# Minimum seconds between two checkpoints of the same run
+CHECKPOINT_INTERVAL = 30
+
+_META_KEY = '__meta__'
+
+
+def checkpoint_path(kind, key, base_dir=None):
+    """Checkpoint file for one run, e.g. checkpoint_path('backtest', job_id)"""
+    return os.path.join(base_dir or DEFAULT_CHECKPOINT_DIR, f"{kind}_{key}.npz")
+
+
+def save_checkpoint(path, arrays, meta):
+    """Atomically write `arrays` ({name: ndarray}) and JSON-serializable `meta`"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp.npz"
+    np.savez_compressed(tmp_path, **arrays, **{_META_KEY: np.array(json.dumps(meta))})
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path, fingerprint=None):
+    """
+    (arrays, meta) of a checkpoint, or None when there is none, it cannot be
+    read, or its meta['fingerprint'] differs from `fingerprint` (a checkpoint
+    of a different run).
+    """
+    if path is None or not os.path.exists(path):
+        return None
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            arrays = {name: data[name] for name in data.files if name != _META_KEY}
+            meta = json.loads(str(data[_META_KEY]))
+    except Exception as e:
+        print(f"Ignoring unreadable checkpoint {path}: {e}")
+        return None
+    if fingerprint is not None and meta.get('fingerprint') != fingerprint:
+        print(f"Ignoring checkpoint {path} of a different run")
+        return None
+    return arrays, meta
+
+
+def remove_checkpoint(path):
+    if path is not None and os.path.exists(path):
+        os.remove(path)
+
+
+def fingerprint(*parts):
+    """Short digest of arrays and JSON-serializable values identifying a run"""
+    digest = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            digest.update(np.ascontiguousarray(part).tobytes())
+        else:
+            digest.update(json.dumps(part, sort_keys=True, default=str).encode())
+    return digest.hexdigest()[:16]
@@ -0,0 +1,194 @@
+# chunked_backtest.py - Memory-bounded backtests over long ranges
+#
+# Multi-year 1m ranges do not fit in one indicator frame, so the range is
+# processed in chunks of `chunk_bars` candles. Each chunk is loaded with
+# `warmup_bars` extra candles in front, so indicators (the longest is a 200
+# period EMA) have settled by the chunk's first bar, and only the chunk's own
+# bars are simulated. The ArraySimulator carries capital, open positions and
+# their trailing stops from one chunk to the next, the equity curve is fed to
+# an online EquityStats and kept only as a downsampled series, so peak memory
+# depends on chunk_bars, not on the length of the range. With a checkpoint
+# file the carried state is saved between chunks, so a run interrupted by a
+# worker restart resumes after the last saved chunk.
+import time
+
+import numpy as np
+import pandas as pd
+
+from backtester import (EquityStats, compute_signals, fetch_klines, ledger_trades,
+                        performance_metrics, simulation_frame, simulation_inputs)
+from checkpoint import CHECKPOINT_INTERVAL, fingerprint, load_checkpoint, remove_checkpoint, save_checkpoint
+from kline_store import INTERVAL_MS, resolve_range
+from simulation_engine import ENGINE_VERSION, ArraySimulator, SimulationParams
+
+DEFAULT_CHUNK_BARS = 50_000
+DEFAULT_WARMUP_BARS = 1_000
+
+
+def chunk_inputs(backtester, start_ms, end_ms, warmup_ms, fetch_btc=True):
+    """Simulation (index, arrays) for the bars in [start_ms, end_ms], computed with warm-up"""
+    bt = backtester
+    df = fetch_klines(bt.kline_client, bt.symbol, bt.timeframe, start_ms - warmup_ms, end_ms, bt.kline_store)
+    btc_df = None
+    if fetch_btc and bt.symbol != 'BTCUSDT':
+        try:
+            btc_df = fetch_klines(bt.kline_client, 'BTCUSDT', bt.timeframe, start_ms - warmup_ms, end_ms,
+                                  bt.kline_store)
+        except Exception as e:
+            print(f"Failed to fetch BTC data: {e}")
+    if len(df) == 0:
+        return df.index, None
+
+    indicators_df, results = compute_signals(df, btc_df, bt.custom_strategies)
+    signals_df = results['signals_df']
+    sim_df = simulation_frame(df, indicators_df, signals_df)
+    sim_df = sim_df[sim_df.index >= pd.Timestamp(start_ms, unit='ms')]
+    return simulation_inputs(sim_df, signals_df.columns)
+
+
+def run_chunked_backtest(backtester, chunk_bars=DEFAULT_CHUNK_BARS, warmup_bars=DEFAULT_WARMUP_BARS,
+                         fetch_btc=True, equity_freq='1D', checkpoint=None,
+                         checkpoint_interval=CHECKPOINT_INTERVAL):
+    """
+    Backtest the backtester's range chunk by chunk.
+
+    Sets backtester.ledger, trades, portfolio and current_capital like
+    run_backtest and returns (metrics, trades, portfolio). The portfolio
+    equity is sampled at the last bar of every `equity_freq` period (pandas
+    offset alias; None keeps every bar). Metrics are computed from every bar.
+
+    checkpoint: file path; the state after a chunk is saved there at most
+    every checkpoint_interval seconds, and a run with the same settings
+    resumes after the last saved chunk with the same results. The file is
+    removed when the run completes.
+    """
+    bt = backtester
+    if bt.timeframe not in INTERVAL_MS:
+        raise ValueError(f"Chunked backtests need a fixed-length timeframe, got '{bt.timeframe}'")
+    if getattr(bt, 'order_model', 'market') != 'market':
+        raise ValueError("Chunked backtests only support market orders")
+    if chunk_bars < 1 or warmup_bars < 0:
+        raise ValueError("chunk_bars must be positive and warmup_bars non-negative")
+    step = INTERVAL_MS[bt.timeframe]
+    start_ms, end_ms = resolve_range(bt.timeframe, bt.start_date, bt.end_date)
+    total_bars = max(0, (end_ms - start_ms) // step + 1)
+
+    params = SimulationParams.from_backtester(bt)
+    simulator = ArraySimulator(params)
+    stats = EquityStats().update([bt.initial_capital])
+    equity_parts = []
+    trades = []
+    entry_dates = {}  # seq -> entry date of positions still open at a chunk end
+    offset = 0
+    first_lo = start_ms
+    last_bar = last_close = None
+
+    run_id = fingerprint(bt.symbol, bt.timeframe, start_ms, end_ms, chunk_bars, warmup_bars, fetch_btc,
+                         equity_freq, vars(params), bt.custom_strategies, ENGINE_VERSION)
+    saved = load_checkpoint(checkpoint, run_id) if checkpoint else None
+    if saved is not None:
+        first_lo, offset, last_bar, last_close = _restore_state(saved, simulator, stats, equity_parts,
+                                                                trades, entry_dates)
+        print(f"Resuming chunked backtest at bar {offset} from {checkpoint}")
+    last_saved = time.monotonic()
+
+    for lo in range(first_lo, end_ms + 1, chunk_bars * step):
+        hi = min(lo + (chunk_bars - 1) * step, end_ms)
+        chunk_index, arrays = chunk_inputs(bt, lo, hi, warmup_bars * step, fetch_btc)
+        if arrays is not None and len(chunk_index) > 0:
+            index = chunk_index
+            closed_before = len(simulator.ledger)
+            equity = simulator.run(**arrays, offset=offset, final=False)
+            stats.update(equity)
+            series = pd.Series(equity, index=index)
+            equity_parts.append(series.resample(equity_freq).last().dropna() if equity_freq else series)
+            trades.extend(_closed_trades(simulator, closed_before, index, entry_dates))
+
+            # Remember entry dates of positions that stay open into the next chunk
+            s = simulator.slots
+            for slot in s.ordered(s.entry_idx >= offset):
+                entry_dates[int(s.seq[slot])] = index[s.entry_idx[slot] - offset]
+
+            offset += len(index)
+            last_bar, last_close = index[-1], float(arrays['close'][-1])
+            bt._report('simulating', bars_processed=int((hi - start_ms) // step + 1),
+                       total_bars=int(total_bars), trades=len(simulator.ledger))
+
+        if checkpoint and hi < end_ms and time.monotonic() - last_saved >= checkpoint_interval:
+            _save_state(checkpoint, run_id, hi + step, offset, last_bar, last_close, simulator, stats,
+                        equity_parts, trades, entry_dates)
+            last_saved = time.monotonic()
+
+    if last_bar is None:
+        raise ValueError("No data for the requested range")
+
+    # Final close at the last bar (global index offset - 1)
+    closed_before = len(simulator.ledger)
+    simulator.offset = offset - 1
+    simulator.close_open_positions(0, last_close)
+    trades.extend(_closed_trades(simulator, closed_before, pd.DatetimeIndex([last_bar]), entry_dates))
+
+    equity = pd.concat(equity_parts)
+    equity = equity.groupby(level=0).last()  # periods split across two chunks
+    first_bar = pd.Timestamp(start_ms, unit='ms')
+    bt.ledger = simulator.ledger
+    bt.current_capital = simulator.capital
+    bt.trades = trades
+    bt.portfolio = pd.DataFrame(
+        {'equity': np.concatenate([[bt.initial_capital], equity.to_numpy()])},
+        index=pd.DatetimeIndex([first_bar - pd.Timedelta(days=1)]).append(equity.index)
+    )
+    metrics = performance_metrics(bt.ledger.records, stats, bt.initial_capital, bt._periods_per_year())
+    remove_checkpoint(checkpoint)
+    return metrics, bt.trades, bt.portfolio
+
+
+def _epoch_ms(dates):
+    return pd.DatetimeIndex(dates).values.astype('datetime64[ms]').astype(np.int64)
+
+
+def _save_state(path, run_id, next_lo, offset, last_bar, last_close, simulator, stats, equity_parts,
+                trades, entry_dates):
+    """Checkpoint everything the chunk loop carries from one chunk to the next"""
+    arrays, scalars = simulator.state()
+    equity = pd.concat(equity_parts) if equity_parts else pd.Series([], dtype=float)
+    arrays.update({
+        'equity_ms': _epoch_ms(equity.index),
+        'equity': equity.to_numpy(dtype=float),
+        'trade_entry_ms': _epoch_ms([t['entry_date'] for t in trades]),
+        'trade_exit_ms': _epoch_ms([t['exit_date'] for t in trades]),
+        'open_seq': np.array(list(entry_dates), dtype=np.int64),
+        'open_entry_ms': _epoch_ms(list(entry_dates.values()))
+    })
+    save_checkpoint(path, arrays, {
+        'fingerprint': run_id,
+        'next_lo': int(next_lo),
+        'offset': int(offset),
+        'last_bar_ms': int(_epoch_ms([last_bar])[0]) if last_bar is not None else None,
+        'last_close': last_close,
+        'simulator': scalars,
+        'stats': {name: getattr(stats, name) for name in ['count', 'mean', 'm2', 'last', 'peak', 'max_drawdown']}
+    })
+
+
+def _restore_state(saved, simulator, stats, equity_parts, trades, entry_dates):
+    """Load a _save_state checkpoint into the loop state; returns (next_lo, offset, last_bar, last_close)"""
+    arrays, meta = saved
+    simulator.restore(arrays, meta['simulator'])
+    for name, value in meta['stats'].items():
+        setattr(stats, name, value)
+    equity_parts.append(pd.Series(arrays['equity'], index=pd.to_datetime(arrays['equity_ms'], unit='ms')))
+    trades.extend(ledger_trades(simulator.ledger.records, pd.to_datetime(arrays['trade_entry_ms'], unit='ms'),
+                                pd.to_datetime(arrays['trade_exit_ms'], unit='ms')))
+    entry_dates.update(zip(arrays['open_seq'].tolist(), pd.to_datetime(arrays['open_entry_ms'], unit='ms')))
+    last_bar = pd.Timestamp(meta['last_bar_ms'], unit='ms') if meta['last_bar_ms'] is not None else None
+    return meta['next_lo'], meta['offset'], last_bar, meta['last_close']
+
+
+def _closed_trades(simulator, closed_before, index, entry_dates):
+    """Trade dicts of the ledger records closed during the current chunk"""
+    records = simulator.ledger.records[closed_before:]
+    offset = simulator.offset
+    entries = [index[r['entry_idx'] - offset] if r['entry_idx'] >= offset
+               else entry_dates.pop(int(r['seq'])) for r in records]
+    return ledger_trades(records, entries, index[records['exit_idx'] - offset])
@@ -0,0 +1,291 @@
+# kline_cache.py - Shared in-process (and optional Redis) cache of recent klines
+#
+# The scanner, DataManager/BTCAnalyzer, the signal scheduler and backtests
+# without a kline store all ask the exchange for the latest 200-1000 candles
+# of the same symbols, often seconds apart. The cache keeps one contiguous
+# series of closed candles per (symbol, interval) and works out what is
+# missing from the closed-candle boundary (open time of the newest candle
+# that has closed): within one candle period a request is served without any
+# call, and after a candle closes only the new candles are fetched and merged
+# into the series. A range ending before the newest closed candle (a
+# backtest period) is kept as its own series keyed by its start, so it does
+# not evict the live series of the same symbol; a range longer than max_bars
+# is fetched without the cache.
+#
+# Tiers:
+#   LRU      per process, bounded by max_bytes, least recently used series evicted
+#   Redis    optional (KLINE_CACHE_REDIS_URL), shares series between the web,
+#            scheduler and Celery processes; unreachable Redis is skipped
+# The still-forming candle is never cached beyond open_ttl seconds.
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from kline_store import INTERVAL_MS, KLINE_DTYPE, klines_to_records, to_milliseconds
+
+# Largest page of one klines request
+PAGE_LIMIT = 1000
+
+DEFAULT_MAX_BYTES = int(os.getenv('KLINE_CACHE_MAX_MB', '64')) * 1024 * 1024
+# Candles kept per series (older ones are dropped when a series grows past it)
+DEFAULT_MAX_BARS = 50_000
+# Seconds the forming candle is reused before it is fetched again
+DEFAULT_OPEN_TTL = 5
+REDIS_URL = os.getenv('KLINE_CACHE_REDIS_URL')
+REDIS_TTL = 24 * 3600
+REDIS_KEY = 'klines:{}'
+
+
+def merge_records(old, new):
+    """Union of two KLINE_DTYPE arrays sorted by open time; `new` wins duplicate candles"""
+    if len(old) == 0:
+        return np.array(new)
+    merged = np.concatenate([old, new])
+    # Keep the latest copy of a candle fetched twice
+    _, last_idx = np.unique(merged['open_time'][::-1], return_index=True)
+    return merged[::-1][last_idx]
+
+
+def redis_key(key):
+    """Redis key of a cache key tuple: klines:SYMBOL:interval[:range:start_ms]"""
+    return REDIS_KEY.format(':'.join(str(part) for part in key))
+
+
+def records_to_klines(records, interval):
+    """KLINE_DTYPE array -> Binance-style rows [open_time, open, high, low, close, volume, close_time]"""
+    step = INTERVAL_MS.get(interval, 0)
+    return [[int(r['open_time']), float(r['open']), float(r['high']), float(r['low']), float(r['close']),
+             float(r['volume']), int(r['open_time']) + step - 1] for r in records]
+
+
+class KlineCache:
+    """Per-(symbol, interval) series of closed candles with incremental top-up"""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, max_bars=DEFAULT_MAX_BARS, redis_url=REDIS_URL,
+                 redis_ttl=REDIS_TTL, open_ttl=DEFAULT_OPEN_TTL, clock=time.time):
+        self.max_bytes = max_bytes
+        self.max_bars = max_bars
+        self.redis_url = redis_url
+        self.redis_ttl = redis_ttl
+        self.open_ttl = open_ttl
+        self.clock = clock
+        self._series = OrderedDict()  # key -> (records, requested_from)
+        self._open = {}               # key -> (forming candle, boundary, fetched at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._redis = None
+        self.stats = {'hits': 0, 'partial': 0, 'misses': 0, 'redis_hits': 0, 'candles_fetched': 0}
+
+    # -- tiers -----------------------------------------------------------------
+
+    def _redis_client(self):
+        if self.redis_url is None:
+            return None
+        if self._redis is None:
+            import redis
+            self._redis = redis.StrictRedis.from_url(self.redis_url)
+        return self._redis
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self.stats[name] += n
+
+    def _forget(self, key):
+        """Drop a series with its forming candle and (unless held) its key lock; caller holds _lock"""
+        self._bytes -= self._series.pop(key)[0].nbytes
+        self._open.pop(key, None)
+        lock = self._key_locks.get(key)
+        if lock is not None and not lock.locked():
+            del self._key_locks[key]
+
+    def _lookup(self, key):
+        """(records, requested_from) of a series from the LRU, else from Redis, else None"""
+        with self._lock:
+            if key in self._series:
+                self._series.move_to_end(key)
+                return self._series[key]
+        try:
+            client = self._redis_client()
+            payload = client.get(redis_key(key)) if client is not None else None
+        except Exception as e:
+            logging.warning(f"Kline cache Redis read failed: {e}")
+            return None
+        if not payload:
+            return None
+        requested_from = int(np.frombuffer(payload[:8], dtype='<i8')[0])
+        entry = (np.frombuffer(payload[8:], dtype=KLINE_DTYPE).copy(), requested_from)
+        self._count('redis_hits')
+        self._remember(key, entry)
+        return entry
+
+    def _remember(self, key, entry):
+        with self._lock:
+            if key in self._series:
+                self._bytes -= self._series[key][0].nbytes
+            self._series[key] = entry
+            self._series.move_to_end(key)
+            self._bytes += entry[0].nbytes
+            while self._bytes > self.max_bytes and len(self._series) > 1:
+                self._forget(next(iter(self._series)))
+
+    def _save(self, key, records, requested_from):
+        """Cache a series, keeping only its newest max_bars candles"""
+        if len(records) > self.max_bars:
+            records = records[-self.max_bars:]
+            requested_from = int(records['open_time'][0])
+        entry = (records, requested_from)
+        self._remember(key, entry)
+        try:
+            client = self._redis_client()
+            if client is not None:
+                payload = np.array([requested_from], dtype='<i8').tobytes() + records.tobytes()
+                client.setex(redis_key(key), self.redis_ttl, payload)
+        except Exception as e:
+            logging.warning(f"Kline cache Redis write failed: {e}")
+        return entry
+
+    def invalidate(self, symbol=None, interval=None):
+        """Forget cached series (all of them, or those of a symbol and/or interval)"""
+        with self._lock:
+            for key in list(self._series):
+                if (symbol is None or key[0] == symbol.upper()) and (interval is None or key[1] == interval):
+                    self._forget(key)
+
+    # -- fetching ----------------------------------------------------------------
+
+    def _boundary(self, step):
+        """Open time of the newest closed candle"""
+        now_ms = int(self.clock() * 1000)
+        return (now_ms // step) * step - step
+
+    def _fetch(self, client, symbol, interval, start_ms, end_ms):
+        """Candles with open time in [start_ms, end_ms]: one request when they fit a page"""
+        if end_ms < start_ms:
+            return np.empty(0, dtype=KLINE_DTYPE)
+        bars = (end_ms - start_ms) // INTERVAL_MS[interval] + 1
+        if bars <= PAGE_LIMIT:
+            klines = client.get_klines(symbol=symbol, interval=interval, limit=int(bars),
+                                       startTime=int(start_ms), endTime=int(end_ms))
+        else:
+            klines = client.get_historical_klines(symbol, interval, int(start_ms), int(end_ms))
+        records = klines_to_records(klines)
+        self._count('candles_fetched', len(records))
+        return records
+
+    def _update(self, client, key, start_ms, closed_end, want_open):
+        """
+        Make the series cover [start_ms, closed_end] and return it with the
+        forming candle (or None). Only the missing head/tail is fetched; a
+        series that neither overlaps nor adjoins the range is replaced. The
+        whole merged series is returned even where the cached copy is trimmed.
+        """
+        symbol, interval = key[:2]
+        step = INTERVAL_MS[interval]
+        entry = self._lookup(key)
+        forming, open_fresh = None, False
+        if want_open:
+            # (forming candle or None when the exchange had none, boundary, fetched at)
+            cached = self._open.get(key)
+            if cached is not None and cached[1] == closed_end and self.clock() - cached[2] < self.open_ttl:
+                forming, open_fresh = cached[0], True
+
+        parts = []
+        if entry is not None and len(entry[0]) and entry[0]['open_time'][0] <= closed_end + step \
+                and entry[0]['open_time'][-1] >= start_ms - step:
+            records, requested_from = entry
+            if start_ms < requested_from:
+                parts.append(self._fetch(client, symbol, interval, start_ms, requested_from - step))
+                requested_from = start_ms
+            tail_from = int(records['open_time'][-1]) + step
+        else:
+            records, requested_from, tail_from = np.empty(0, dtype=KLINE_DTYPE), start_ms, start_ms
+
+        tail_to = closed_end + step if want_open and not open_fresh else closed_end
+        if tail_from <= tail_to:
+            parts.append(self._fetch(client, symbol, interval, tail_from, tail_to))
+
+        if entry is None or not parts:
+            self._count('misses' if entry is None else 'hits')
+        else:
+            self._count('partial')
+        if parts:
+            fetched = np.concatenate(parts)
+            closed = fetched[fetched['open_time'] <= closed_end]
+            if want_open and not open_fresh:
+                if len(fetched) and fetched['open_time'][-1] > closed_end:
+                    forming = fetched[-1]
+                self._open[key] = (forming, closed_end, self.clock())
+            if len(closed) or entry is None or requested_from != entry[1]:
+                records = merge_records(records, closed)
+                self._save(key, records, requested_from)
+        return records, forming
+
+    @staticmethod
+    def _result(records, start_ms, end_ms, forming):
+        lo = int(np.searchsorted(records['open_time'], start_ms, side='left'))
+        hi = int(np.searchsorted(records['open_time'], end_ms, side='right'))
+        result = np.array(records[lo:hi])
+        if forming is not None:
+            result = np.concatenate([result, np.array([forming], dtype=KLINE_DTYPE)])
+        return result
+
+    def recent(self, client, symbol, interval, limit=500, include_open=True):
+        """
+        The latest `limit` candles as KLINE_DTYPE records, like
+        client.get_klines(symbol, interval, limit=limit): with include_open the
+        last one is the candle still forming, otherwise all are closed.
+        `client` is anything with Client-style get_klines/get_historical_klines.
+        """
+        symbol = symbol.upper()
+        if interval not in INTERVAL_MS:
+            return klines_to_records(client.get_klines(symbol=symbol, interval=interval, limit=limit))
+        step = INTERVAL_MS[interval]
+        key = (symbol, interval)
+        with self._key_lock(key):
+            boundary = self._boundary(step)
+            closed_needed = max(limit - 1, 0) if include_open else limit
+            start_ms = boundary - (closed_needed - 1) * step
+            records, forming = self._update(client, key, start_ms, boundary, include_open)
+            return self._result(records, start_ms, boundary, forming)
+
+    def range(self, client, symbol, interval, start, end=None, include_open=False):
+        """
+        Candles with open time in [start, end] (epoch ms, datetimes or date
+        strings; end defaults to now), like client.get_historical_klines. The
+        forming candle is only included with include_open and a range reaching it.
+        """
+        symbol = symbol.upper()
+        if interval not in INTERVAL_MS:
+            return klines_to_records(client.get_historical_klines(symbol, interval, start, end))
+        step = INTERVAL_MS[interval]
+        boundary = self._boundary(step)
+        start_ms = -(-to_milliseconds(start) // step) * step
+        end_ms = to_milliseconds(end) if end is not None else boundary + step
+        closed_end = min((end_ms // step) * step, boundary)
+        want_open = include_open and end_ms > boundary
+
+        if (closed_end - start_ms) // step + 1 > self.max_bars:
+            # Longer than a cached series may be: fetch it without the cache
+            fetched = self._fetch(client, symbol, interval, start_ms, closed_end + step if want_open else closed_end)
+            forming = fetched[-1] if want_open and len(fetched) and fetched['open_time'][-1] > closed_end else None
+            self._count('misses')
+            return self._result(fetched, start_ms, closed_end, forming)
+
+        # Historical ranges get their own series instead of replacing the live one
+        key = (symbol, interval) if closed_end == boundary else (symbol, interval, 'range', start_ms)
+        with self._key_lock(key):
+            records, forming = self._update(client, key, start_ms, closed_end, want_open)
+            return self._result(records, start_ms, closed_end, forming)
+
+
+# Shared cache used by every kline fetch path
+kline_cache = KlineCache()
@@ -0,0 +1,361 @@
+# kline_downloader.py - Parallel historical kline downloads
+#
+# client.get_historical_klines walks a long range one 1000-candle page at a
+# time. KlineDownloader splits the range into page-aligned chunks up front,
+# fetches them concurrently from the REST endpoint while staying inside the
+# exchange's per-minute request weight, and stitches the pages back together,
+# dropping duplicate candles and reporting gaps in the open-time grid.
+#
+# It has the kline methods of binance.client.Client, so it can be passed
+# wherever a client is only used for klines (Backtester, KlineStore.top_up).
+# LocalKlineServer serves LocalKlineClient candles over HTTP so downloads can
+# be exercised without network access.
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+from kline_store import INTERVAL_MS, LocalKlineClient, kline_store, resolve_range, to_milliseconds
+
+BINANCE_API_URL = 'https://api.binance.com'
+KLINES_PATH = '/api/v3/klines'
+
+# Candles per request (the endpoint maximum) and the request weight of one page
+PAGE_LIMIT = 1000
+PAGE_WEIGHT = 2
+
+# Exchange limit is 6000 weight per minute per IP; leave room for the
+# scanner, the scheduler and live requests running on the same host
+DEFAULT_WEIGHT_BUDGET = 2400
+DEFAULT_WORKERS = 8
+# Retries of one request after connection errors, 5xx or rate limiting (429/418)
+MAX_RETRIES = 3
+# Longest Retry-After (seconds) waited out; a longer one (an IP ban) raises instead
+MAX_RETRY_AFTER = int(os.getenv('KLINE_MAX_RETRY_AFTER', '120'))
+
+
+class WeightBudget:
+    """
+    Request weight spent in the current exchange minute, shared by all threads.
+
+    acquire() blocks until the request fits in the budget, or raises
+    requests.HTTPError when a back-off has longer than max_block seconds
+    left; observe() syncs the count with the X-MBX-USED-WEIGHT-1M header,
+    which also includes weight used by other clients on the same IP.
+    """
+
+    def __init__(self, limit=DEFAULT_WEIGHT_BUDGET):
+        self.limit = limit
+        self.used = 0
+        self.window = None
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _roll(self, now):
+        window = int(now // 60)
+        if window != self.window:
+            self.window, self.used = window, 0
+
+    def acquire(self, weight=PAGE_WEIGHT, max_block=None):
+        while True:
+            with self._lock:
+                now = time.time()
+                if max_block is not None and self.blocked_until - now > max_block:
+                    raise requests.HTTPError(f"Kline requests blocked by the exchange for "
+                                             f"{self.blocked_until - now:.0f}s")
+                self._roll(now)
+                if now >= self.blocked_until and self.used + weight <= self.limit:
+                    self.used += weight
+                    return
+                wait = max(self.blocked_until - now, (self.window + 1) * 60 - now)
+            time.sleep(min(max(wait, 0.01), 1.0))
+
+    def observe(self, used_weight):
+        with self._lock:
+            self._roll(time.time())
+            self.used = max(self.used, used_weight)
+
+    def back_off(self, seconds):
+        """Stop all requests for `seconds` (429/418 Retry-After)"""
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.time() + seconds)
+
+
+def page_starts(interval, start_ms, end_ms):
+    """Open time of the first candle of every PAGE_LIMIT-candle page in [start_ms, end_ms]"""
+    step = INTERVAL_MS[interval]
+    first = -(-start_ms // step) * step
+    return list(range(first, end_ms + 1, PAGE_LIMIT * step))
+
+
+def stitch_pages(pages, interval, start_ms, end_ms):
+    """
+    Concatenate page results into one list of kline rows sorted by open time.
+
+    Returns (rows, duplicates, gaps); a candle returned twice keeps its last
+    copy, gaps are (first_missing_ms, last_missing_ms) runs of the interval
+    grid between the first and last candle received.
+    """
+    rows = [row for page in pages for row in page if start_ms <= row[0] <= end_ms]
+    if not rows:
+        return [], 0, []
+    open_times = np.array([row[0] for row in rows], dtype=np.int64)
+    # Last copy of each open time, in open-time order
+    _, last_idx = np.unique(open_times[::-1], return_index=True)
+    keep = len(rows) - 1 - last_idx
+    duplicates = len(rows) - len(keep)
+    rows = [rows[i] for i in keep]
+
+    step = INTERVAL_MS[interval]
+    times = open_times[keep]
+    jumps = np.flatnonzero(np.diff(times) != step)
+    gaps = [(int(times[i] + step), int(times[i + 1] - step)) for i in jumps]
+    return rows, duplicates, gaps
+
+
+class KlineDownloader:
+    """
+    Concurrent page-aligned kline downloads from the /api/v3/klines endpoint.
+
+    base_url points at the exchange or a stand-in (LocalKlineServer.url);
+    budget may be shared between downloaders hitting the same IP limit.
+    A request rate limited more than MAX_RETRIES times, or told to retry
+    after more than max_retry_after seconds, raises requests.HTTPError.
+    """
+
+    def __init__(self, base_url=BINANCE_API_URL, max_workers=DEFAULT_WORKERS, budget=None, timeout=10,
+                 max_retry_after=MAX_RETRY_AFTER):
+        self.base_url = base_url.rstrip('/')
+        self.max_workers = max_workers
+        self.budget = budget or WeightBudget()
+        self.timeout = timeout
+        self.max_retry_after = max_retry_after
+        self.session = requests.Session()
+        self.session.mount(self.base_url, HTTPAdapter(pool_maxsize=max_workers))
+        self.session.headers['User-Agent'] = 'Trading-Bot/1.0'
+
+    def get_klines(self, symbol, interval, limit=500, startTime=None, endTime=None, **kwargs):
+        """One request, same arguments and result as Client.get_klines"""
+        params = {'symbol': symbol.upper(), 'interval': interval, 'limit': min(limit, PAGE_LIMIT)}
+        if startTime is not None:
+            params['startTime'] = int(startTime)
+        if endTime is not None:
+            params['endTime'] = int(endTime)
+
+        failures = rate_limited = 0
+        while True:
+            self.budget.acquire(PAGE_WEIGHT, max_block=self.max_retry_after)
+            try:
+                response = self.session.get(self.base_url + KLINES_PATH, params=params, timeout=self.timeout)
+            except requests.RequestException:
+                failures += 1
+                if failures > MAX_RETRIES:
+                    raise
+                time.sleep(2 ** failures)
+                continue
+            used = response.headers.get('X-MBX-USED-WEIGHT-1M')
+            if used is not None:
+                self.budget.observe(int(used))
+            if response.status_code in (418, 429):
+                # Every thread waits as long as the exchange asks (418 is an IP ban)
+                retry_after = int(response.headers.get('Retry-After', 60))
+                self.budget.back_off(retry_after)
+                rate_limited += 1
+                if rate_limited <= MAX_RETRIES and retry_after <= self.max_retry_after:
+                    logging.warning(f"Kline requests rate limited ({response.status_code}), "
+                                    f"backing off {retry_after}s")
+                    continue
+                logging.error(f"Kline requests rate limited ({response.status_code}), "
+                              f"giving up (Retry-After {retry_after}s)")
+            if response.status_code >= 500 and failures < MAX_RETRIES:
+                failures += 1
+                time.sleep(2 ** failures)
+                continue
+            response.raise_for_status()
+            return response.json()
+
+    def fetch(self, symbol, interval, start_ms, end_ms):
+        """
+        All klines with open time in [start_ms, end_ms], pages fetched in parallel.
+
+        Returns (rows, report) with report = {'candles', 'pages', 'duplicates',
+        'gaps', 'seconds'}.
+        """
+        started = time.perf_counter()
+        if interval not in INTERVAL_MS:
+            # No fixed length ('1M'): pages cannot be aligned in advance
+            rows = self._fetch_serial(symbol, interval, start_ms, end_ms)
+            return rows, {'candles': len(rows), 'pages': None, 'duplicates': 0, 'gaps': [],
+                          'seconds': time.perf_counter() - started}
+
+        starts = page_starts(interval, start_ms, end_ms)
+        step = INTERVAL_MS[interval]
+        fetch_page = lambda page_start: self.get_klines(
+            symbol, interval, limit=PAGE_LIMIT, startTime=page_start,
+            endTime=min(page_start + (PAGE_LIMIT - 1) * step, end_ms))
+        workers = min(self.max_workers, len(starts))
+        if workers <= 1:
+            pages = [fetch_page(page_start) for page_start in starts]
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                pages = list(pool.map(fetch_page, starts))
+
+        rows, duplicates, gaps = stitch_pages(pages, interval, start_ms, end_ms)
+        if gaps:
+            logging.warning(f"{symbol} {interval}: {len(gaps)} gaps in downloaded klines, first at {gaps[0][0]}")
+        return rows, {'candles': len(rows), 'pages': len(starts), 'duplicates': duplicates, 'gaps': gaps,
+                      'seconds': time.perf_counter() - started}
+
+    def _fetch_serial(self, symbol, interval, start_ms, end_ms):
+        rows = []
+        while start_ms <= end_ms:
+            page = self.get_klines(symbol, interval, limit=PAGE_LIMIT, startTime=start_ms, endTime=end_ms)
+            if not page:
+                break
+            rows.extend(page)
+            start_ms = page[-1][6] + 1  # close time + 1 ms
+        return rows
+
+    def get_historical_klines(self, symbol, interval, start_str=None, end_str=None, limit=PAGE_LIMIT, **kwargs):
+        """Drop-in for Client.get_historical_klines (start/end: ms, datetimes or date strings)"""
+        start_ms = to_milliseconds(start_str) or 0
+        end_ms = to_milliseconds(end_str) if end_str is not None else int(time.time() * 1000)
+        rows, _ = self.fetch(symbol, interval, start_ms, end_ms)
+        return rows
+
+    def download(self, symbol, interval, start, end=None, store=None):
+        """
+        Download the part of [start, end] missing from the kline store
+        (the shared one by default) and write it there.
+
+        Returns {'candles_added', 'pages', 'duplicates', 'gaps', 'seconds'}.
+        """
+        store = store or kline_store
+        start_ms, end_ms = resolve_range(interval, start, end)
+        reports = []
+
+        def get_historical_klines(symbol, interval, start_str, end_str=None, **kwargs):
+            rows, report = self.fetch(symbol, interval, start_str, end_str)
+            reports.append(report)
+            return rows
+
+        # top_up works out the missing part and merges it into the store
+        added = store.top_up(SimpleNamespace(get_historical_klines=get_historical_klines),
+                             symbol, interval, start_ms, end_ms)
+        return {
+            'candles_added': added,
+            'pages': sum(r['pages'] for r in reports),
+            'duplicates': sum(r['duplicates'] for r in reports),
+            'gaps': [gap for r in reports for gap in r['gaps']],
+            'seconds': sum(r['seconds'] for r in reports)
+        }
+
+
+class LocalKlineServer:
+    """
+    Local HTTP stand-in for the exchange kline endpoint, serving LocalKlineClient candles.
+
+    Reports used weight in X-MBX-USED-WEIGHT-1M and answers 429 with a
+    Retry-After once `weight_limit` is exceeded within a window of
+    `window_seconds` (a minute, like the exchange). `missing` open times are
+    left out of responses to simulate exchange gaps and `duplicate` open
+    times are sent twice.
+
+        with LocalKlineServer() as server:
+            KlineDownloader(base_url=server.url).download('BTCUSDT', '1m', ...)
+    """
+
+    def __init__(self, client=None, weight_limit=6000, missing=(), latency=0.0, window_seconds=60,
+                 duplicate=()):
+        self.client = client or LocalKlineClient()
+        self.weight_limit = weight_limit
+        self.missing = set(missing)
+        self.duplicate = set(duplicate)
+        self.latency = latency
+        self.window_seconds = window_seconds
+        self.requests = 0
+        self.used_weight = 0
+        self.window = None
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                if parsed.path != KLINES_PATH:
+                    self._reply(404, {'code': -1, 'msg': 'Not found'})
+                    return
+                with server._lock:
+                    window = int(time.time() // server.window_seconds)
+                    if window != server.window:
+                        server.window, server.used_weight = window, 0
+                    server.requests += 1
+                    server.used_weight += PAGE_WEIGHT
+                    used = server.used_weight
+                if used > server.weight_limit:
+                    retry_after = int((window + 1) * server.window_seconds - time.time()) + 1
+                    self._reply(429, {'code': -1003, 'msg': 'Too many requests'}, used, retry_after)
+                    return
+                if server.latency:
+                    time.sleep(server.latency)
+                query = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+                klines = server.client.get_klines(
+                    query['symbol'], query['interval'], limit=int(query.get('limit', 500)),
+                    startTime=int(query['startTime']) if 'startTime' in query else None,
+                    endTime=int(query['endTime']) if 'endTime' in query else None)
+                rows = [k for k in klines if k[0] not in server.missing]
+                rows += [k for k in rows if k[0] in server.duplicate]
+                self._reply(200, rows, used)
+
+            def _reply(self, status, body, used=0, retry_after=None):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.send_header('X-MBX-USED-WEIGHT-1M', str(used))
+                if retry_after is not None:
+                    self.send_header('Retry-After', str(retry_after))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+# Shared downloader for the public exchange endpoint
+kline_downloader = KlineDownloader()
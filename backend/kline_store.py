@@ -0,0 +1,286 @@
+# kline_store.py - Local on-disk kline store for backtests
+#
+# One memory-mappable .npy file of closed candles per (symbol, interval):
+#   <SYMBOL>_<interval>.npy   structured array, sorted by open time
+#   <SYMBOL>_<interval>.json  range already requested from the exchange
+# Ranges are served from disk; only the part that is not stored yet (the
+# newest candles, or history before the first stored candle) is downloaded.
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process locking only
+    fcntl = None
+
+KLINE_DTYPE = np.dtype([('open_time', '<i8'), ('open', '<f8'), ('high', '<f8'), ('low', '<f8'),
+                        ('close', '<f8'), ('volume', '<f8')])
+
+# Fixed-length Binance intervals ('1M' has no fixed length and is not stored)
+INTERVAL_MS = {
+    '1m': 60_000, '3m': 180_000, '5m': 300_000, '15m': 900_000, '30m': 1_800_000,
+    '1h': 3_600_000, '2h': 7_200_000, '4h': 14_400_000, '6h': 21_600_000,
+    '8h': 28_800_000, '12h': 43_200_000, '1d': 86_400_000, '3d': 259_200_000,
+    '1w': 604_800_000,
+}
+
+DEFAULT_STORE_DIR = os.getenv(
+    'KLINE_STORE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'klines')
+)
+
+
+def to_milliseconds(value):
+    """Epoch ms from an int, datetime/Timestamp or Binance date string ('1 year ago UTC')"""
+    if value is None:
+        return None
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, str):
+        try:
+            return int(pd.Timestamp(value).value // 10**6)
+        except ValueError:
+            from binance.helpers import date_to_milliseconds
+            return int(date_to_milliseconds(value))
+    return int(pd.Timestamp(value).value // 10**6)
+
+
+def klines_to_records(klines):
+    """Binance kline rows -> KLINE_DTYPE array"""
+    records = np.empty(len(klines), dtype=KLINE_DTYPE)
+    if len(klines):
+        rows = np.array([k[:6] for k in klines], dtype=float)
+        records['open_time'] = rows[:, 0].astype(np.int64)
+        for i, field in enumerate(['open', 'high', 'low', 'close', 'volume'], start=1):
+            records[field] = rows[:, i]
+    return records
+
+
+def records_to_frame(records):
+    """KLINE_DTYPE array -> OHLCV frame in Backtester.fetch_data format"""
+    df = pd.DataFrame({field: records[field].astype(float)
+                       for field in ['open', 'high', 'low', 'close', 'volume']},
+                      index=pd.to_datetime(records['open_time'], unit='ms'))
+    df.index.name = 'timestamp'
+    return df
+
+
+def resolve_range(interval, start, end=None):
+    """
+    (start_ms, end_ms) open-time bounds of the closed candles in [start, end]:
+    start rounded up to the interval grid, end capped at the newest closed candle.
+    """
+    if interval not in INTERVAL_MS:
+        raise ValueError(f"Unsupported interval '{interval}' for the kline store")
+    step = INTERVAL_MS[interval]
+    now_ms = int(time.time() * 1000)
+    start_ms = -(-to_milliseconds(start) // step) * step
+    end_ms = min(to_milliseconds(end) if end is not None else now_ms, now_ms)
+    # Only closed candles are stored: the newest one must have closed by now
+    last_closed = (now_ms // step) * step - step
+    return start_ms, min((end_ms // step) * step, last_closed)
+
+
+class KlineStore:
+    """Per-(symbol, interval) store of closed candles with incremental top-up"""
+
+    def __init__(self, base_dir=None):
+        self.base_dir = base_dir or DEFAULT_STORE_DIR
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def _key_lock(self, symbol, interval):
+        """Lock serializing top-ups of one (symbol, interval) within this process"""
+        with self._lock:
+            return self._key_locks.setdefault((symbol.upper(), interval), threading.Lock())
+
+    def _paths(self, symbol, interval):
+        name = f"{symbol.upper()}_{interval}"
+        return (os.path.join(self.base_dir, f"{name}.npy"),
+                os.path.join(self.base_dir, f"{name}.json"),
+                os.path.join(self.base_dir, f"{name}.lock"))
+
+    def load(self, symbol, interval):
+        """All stored candles as a read-only memory map (empty array when nothing is stored)"""
+        data_path, _, _ = self._paths(symbol, interval)
+        if not os.path.exists(data_path):
+            return np.empty(0, dtype=KLINE_DTYPE)
+        return np.load(data_path, mmap_mode='r')
+
+    def _read_meta(self, meta_path):
+        if not os.path.exists(meta_path):
+            return {'requested_from': None}
+        with open(meta_path) as f:
+            return json.load(f)
+
+    def _write_meta(self, meta_path, meta):
+        with open(f"{meta_path}.tmp", 'w') as f:
+            json.dump(meta, f)
+        os.replace(f"{meta_path}.tmp", meta_path)
+
+    def _write(self, data_path, meta_path, records, meta):
+        tmp_path = f"{data_path}.tmp.npy"
+        np.save(tmp_path, records)
+        os.replace(tmp_path, data_path)
+        self._write_meta(meta_path, meta)
+
+    def get_klines(self, client, symbol, interval, start, end=None):
+        """
+        Closed candles with open time in [start, end] as an OHLCV frame.
+
+        start/end: epoch ms, datetimes or Binance date strings; end defaults to now.
+        Missing candles are downloaded with client.get_historical_klines and
+        stored before the range is served from disk.
+        """
+        records = self.get_records(client, symbol, interval, start, end)
+        return records_to_frame(records)
+
+    def get_records(self, client, symbol, interval, start, end=None):
+        """Same as get_klines, returning the KLINE_DTYPE records"""
+        start_ms, end_ms = resolve_range(interval, start, end)
+        self.top_up(client, symbol, interval, start_ms, end_ms)
+        return self._slice(self.load(symbol, interval), start_ms, end_ms)
+
+    def read(self, symbol, interval, start, end=None):
+        """
+        Stored candles for [start, end] without any download, or None when the
+        store does not cover the whole range yet.
+        """
+        start_ms, end_ms = resolve_range(interval, start, end)
+        stored = self.load(symbol, interval)
+        if len(stored) == 0 or stored['open_time'][-1] < end_ms:
+            return None
+        _, meta_path, _ = self._paths(symbol, interval)
+        requested_from = self._read_meta(meta_path)['requested_from']
+        if start_ms < (requested_from if requested_from is not None else stored['open_time'][0]):
+            return None
+        return self._slice(stored, start_ms, end_ms)
+
+    @staticmethod
+    def _slice(stored, start_ms, end_ms):
+        lo = int(np.searchsorted(stored['open_time'], start_ms, side='left'))
+        hi = int(np.searchsorted(stored['open_time'], end_ms, side='right'))
+        return np.array(stored[lo:hi])
+
+    def top_up(self, client, symbol, interval, start_ms, end_ms):
+        """Download whatever part of [start_ms, end_ms] is not stored yet; returns candles added"""
+        step = INTERVAL_MS[interval]
+        os.makedirs(self.base_dir, exist_ok=True)
+        data_path, meta_path, lock_path = self._paths(symbol, interval)
+
+        # Other processes are kept out by the file lock
+        with self._key_lock(symbol, interval), open(lock_path, 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+            stored = np.array(self.load(symbol, interval))
+            meta = self._read_meta(meta_path)
+            parts = []
+            if len(stored) == 0:
+                parts.append(self._download(client, symbol, interval, start_ms, end_ms))
+            else:
+                first, last = int(stored['open_time'][0]), int(stored['open_time'][-1])
+                requested_from = meta['requested_from'] if meta['requested_from'] is not None else first
+                # History before the first stored candle, unless already asked for
+                if start_ms < requested_from:
+                    parts.append(self._download(client, symbol, interval, start_ms, first - step))
+                # The newest candles
+                if end_ms > last:
+                    parts.append(self._download(client, symbol, interval, last + step, end_ms))
+            if meta['requested_from'] is None or start_ms < meta['requested_from']:
+                meta['requested_from'] = start_ms
+
+            new = np.concatenate(parts) if parts else np.empty(0, dtype=KLINE_DTYPE)
+            new = new[new['open_time'] <= end_ms]
+            if len(new) == 0:
+                self._write_meta(meta_path, meta)
+                return 0
+
+            merged = np.concatenate([stored, new])
+            # Keep the latest copy of a candle downloaded twice
+            _, last_idx = np.unique(merged['open_time'][::-1], return_index=True)
+            merged = merged[::-1][last_idx]
+            self._write(data_path, meta_path, merged, meta)
+            return len(merged) - len(stored)
+
+    def _download(self, client, symbol, interval, start_ms, end_ms):
+        if end_ms < start_ms:
+            return np.empty(0, dtype=KLINE_DTYPE)
+        klines = client.get_historical_klines(symbol, interval, start_ms, end_ms)
+        return klines_to_records(klines)
+
+
+class LocalKlineClient:
+    """
+    Offline stand-in for binance.client.Client's kline endpoints.
+
+    Generates a deterministic random walk per symbol on the interval grid, so
+    the store, the backtester and the downloaders can run without network
+    access. Only candles that have closed by `now_ms` are returned, and
+    `requests` counts calls like a real client would count API requests.
+    """
+
+    def __init__(self, now_ms=None, start_price=100.0, volatility=0.002, api_key=None, api_secret=None):
+        self.now_ms = now_ms
+        self.start_price = start_price
+        self.volatility = volatility
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.requests = 0
+
+    def _now(self):
+        return self.now_ms if self.now_ms is not None else int(time.time() * 1000)
+
+    def _candles(self, symbol, interval, start_ms, end_ms, limit=None):
+        step = INTERVAL_MS[interval]
+        first = -(-start_ms // step) * step
+        last = min(end_ms, (self._now() // step) * step - step)
+        open_times = np.arange(first, last + 1, step, dtype=np.int64)
+        if limit is not None:
+            open_times = open_times[:limit]
+        if len(open_times) == 0:
+            return []
+
+        # Prices depend only on (symbol, open time), so overlapping requests agree
+        seed = sum(map(ord, symbol.upper()))
+        bar = open_times // step
+        noise = np.sin(bar * 12.9898 + seed * 78.233) * 43758.5453
+        returns = (noise - np.floor(noise) - 0.5) * 2 * self.volatility
+        close = self.start_price * (1 + seed % 7 / 10) * np.exp(np.sin(bar / 500.0) * 0.2 + returns)
+        open_ = close * (1 - returns / 2)
+        high = np.maximum(open_, close) * (1 + self.volatility / 2)
+        low = np.minimum(open_, close) * (1 - self.volatility / 2)
+        volume = 1000 + (noise - np.floor(noise)) * 100
+
+        return [[int(t), f"{o:.8f}", f"{h:.8f}", f"{l:.8f}", f"{c:.8f}", f"{v:.8f}", int(t + step - 1),
+                 "0", 0, "0", "0", "0"]
+                for t, o, h, l, c, v in zip(open_times, open_, high, low, close, volume)]
+
+    def get_klines(self, symbol, interval, limit=500, startTime=None, endTime=None, **kwargs):
+        self.requests += 1
+        step = INTERVAL_MS[interval]
+        end_ms = endTime if endTime is not None else self._now()
+        start_ms = startTime if startTime is not None else end_ms - limit * step
+        return self._candles(symbol, interval, start_ms, end_ms, limit=min(limit, 1000))
+
+    def get_historical_klines(self, symbol, interval, start_str=None, end_str=None, limit=1000, **kwargs):
+        start_ms = to_milliseconds(start_str) or 0
+        end_ms = to_milliseconds(end_str) if end_str is not None else self._now()
+        klines = []
+        # Paginate like the real client: 1000 candles per request
+        while start_ms <= end_ms:
+            page = self.get_klines(symbol, interval, limit=limit, startTime=start_ms, endTime=end_ms)
+            if not page:
+                break
+            klines.extend(page)
+            start_ms = page[-1][0] + INTERVAL_MS[interval]
+        return klines
+
+
+# Shared store used by backtests
+kline_store = KlineStore()
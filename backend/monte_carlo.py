@@ -0,0 +1,110 @@
+# monte_carlo.py - Monte Carlo robustness analysis of backtest trades
+#
+# Resamples the realized trades of a backtest into thousands of alternative
+# trade sequences and reports the distribution of final return and maximum
+# drawdown:
+#   shuffle    same trades in random order (drawdown depends on the order)
+#   bootstrap  trades drawn with replacement (return and drawdown both vary)
+#   skip       each trade dropped with probability skip_prob (missed signals)
+# Position sizes are a fraction of capital, so each trade is resampled as its
+# return on the realized capital before it closed and paths compound those
+# returns.
+# All paths are one (paths x trades) array; cumprod/maximum.accumulate over
+# axis 1 give every equity path and its drawdown at once.
+import numpy as np
+
+MONTE_CARLO_METHODS = ['shuffle', 'bootstrap', 'skip']
+PERCENTILES = [5, 25, 50, 75, 95]
+
+# Paths are processed in blocks of at most this many (path, trade) cells to
+# bound memory for long trade lists
+MAX_BLOCK_CELLS = 4_000_000
+
+
+def trade_returns(records, initial_capital):
+    """
+    Return of each ledger record (simulation_engine.TRADE_DTYPE) on the
+    realized capital before it closed, in the order trades were realized.
+    Compounding these returns from initial_capital reproduces the realized equity.
+    """
+    order = np.lexsort((records['seq'], records['exit_idx']))
+    profits = records['profit'][order].astype(float)
+    capital = initial_capital + np.concatenate([[0.0], np.cumsum(profits)[:-1]])
+    return profits / capital
+
+
+def resample_returns(returns, n_paths, method='shuffle', skip_prob=0.1, rng=None):
+    """(n_paths, len(returns)) matrix of resampled trade returns"""
+    rng = rng if rng is not None else np.random.default_rng()
+    n = len(returns)
+    if method == 'shuffle':
+        return rng.permuted(np.broadcast_to(returns, (n_paths, n)), axis=1)
+    if method == 'bootstrap':
+        return returns[rng.integers(0, n, size=(n_paths, n))]
+    if method == 'skip':
+        return np.where(rng.random((n_paths, n)) < skip_prob, 0.0, returns)
+    raise ValueError(f"Unknown Monte Carlo method '{method}', expected one of {MONTE_CARLO_METHODS}")
+
+
+def path_statistics(returns):
+    """Final return % and max drawdown % (negative, like performance_metrics) of each row of returns"""
+    growth = np.cumprod(1 + returns, axis=1)
+    peak = np.maximum(np.maximum.accumulate(growth, axis=1), 1.0)
+    max_drawdown = np.minimum(((growth - peak) / peak).min(axis=1), 0.0) * 100
+    return_pct = (growth[:, -1] - 1) * 100
+    return return_pct, max_drawdown
+
+
+def _distribution(values):
+    summary = {'mean': float(values.mean()), 'std': float(values.std())}
+    for p, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+        summary[f'p{p}'] = float(value)
+    return summary
+
+
+def run_monte_carlo(records, initial_capital, n_paths=10000, method='shuffle', skip_prob=0.1,
+                    seed=None, keep_paths=False):
+    """
+    Monte Carlo resampling of a backtest's trade ledger.
+
+    Returns a dict with the observed (trade-by-trade) return and drawdown,
+    percentile summaries of both distributions, the probability of ending
+    with a loss and of a drawdown deeper than the observed one. With
+    keep_paths the per-path return_pct and max_drawdown arrays are included.
+    """
+    if method not in MONTE_CARLO_METHODS:
+        raise ValueError(f"Unknown Monte Carlo method '{method}', expected one of {MONTE_CARLO_METHODS}")
+    if not 0 <= skip_prob < 1:
+        raise ValueError("skip_prob must be in [0, 1)")
+    if n_paths < 1:
+        raise ValueError("n_paths must be positive")
+
+    trade_rets = trade_returns(records, initial_capital)
+    if len(trade_rets) == 0:
+        return {'method': method, 'n_paths': 0, 'num_trades': 0}
+
+    observed_return, observed_drawdown = path_statistics(trade_rets[None, :])
+    rng = np.random.default_rng(seed)
+    block = max(1, MAX_BLOCK_CELLS // len(trade_rets))
+    returns = np.empty(n_paths)
+    drawdowns = np.empty(n_paths)
+    for lo in range(0, n_paths, block):
+        hi = min(lo + block, n_paths)
+        paths = resample_returns(trade_rets, hi - lo, method, skip_prob, rng)
+        returns[lo:hi], drawdowns[lo:hi] = path_statistics(paths)
+
+    result = {
+        'method': method,
+        'n_paths': n_paths,
+        'num_trades': len(trade_rets),
+        'observed': {'return_pct': float(observed_return[0]), 'max_drawdown': float(observed_drawdown[0])},
+        'return_pct': _distribution(returns),
+        'max_drawdown': _distribution(drawdowns),
+        'prob_loss': float((returns < 0).mean()),
+        'prob_worse_drawdown': float((drawdowns < observed_drawdown[0]).mean())
+    }
+    if method == 'skip':
+        result['skip_prob'] = skip_prob
+    if keep_paths:
+        result['paths'] = {'return_pct': returns, 'max_drawdown': drawdowns}
+    return result
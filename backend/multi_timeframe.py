@@ -0,0 +1,146 @@
+# multi_timeframe.py - Compare one strategy setup across several timeframes
+#
+# Instead of one Backtester run (and one kline download) per timeframe, the
+# finest requested interval is loaded once, resampled locally to every other
+# timeframe, and the timeframes are simulated in parallel worker processes
+# (or, in a Celery job, one subtask per timeframe, see tasks.py).
+# The result is a side-by-side metrics table plus each timeframe's trades and
+# equity curve.
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from backtester import (compute_signals, fetch_klines, ledger_trades, performance_metrics,
+                        periods_per_year, simulation_frame, simulation_inputs)
+from kline_store import INTERVAL_MS
+from simulation_engine import SimulationParams, make_simulator
+
+# Metrics shown in the comparison table, in this order
+COMPARISON_METRICS = ['num_trades', 'total_profit', 'return_pct', 'win_rate', 'max_drawdown',
+                      'sharpe_ratio', 'profit_factor', 'avg_win', 'avg_loss', 'avg_signal_strength']
+
+_AGGREGATION = {'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last', 'volume': 'sum'}
+
+
+def resample_klines(df, timeframe, base_timeframe):
+    """
+    OHLCV frame of base_timeframe candles resampled to timeframe, on the same
+    grid as Binance candles (epoch-aligned, weeks open on Monday). Partial
+    candles at either end of the data are dropped.
+    """
+    step, base = INTERVAL_MS[timeframe], INTERVAL_MS[base_timeframe]
+    if step % base:
+        raise ValueError(f"{timeframe} is not a multiple of {base_timeframe}")
+    if step == base:
+        return df
+    if timeframe == '1w':
+        grouped = df.resample('W-MON', label='left', closed='left')
+    else:
+        grouped = df.resample(pd.Timedelta(milliseconds=step), label='left', closed='left', origin='epoch')
+    counts = grouped['close'].count()
+    out = grouped.agg(_AGGREGATION)[counts > 0]
+    complete = (counts[counts > 0] == step // base).to_numpy()
+    if not complete.any():
+        return out.iloc[:0]
+    first, last = complete.argmax(), len(complete) - complete[::-1].argmax()
+    return out.iloc[first:last]
+
+
+def run_timeframe(timeframe, df, btc_df, params, custom_strategies=None):
+    """Signals and simulation for one (already resampled) timeframe; runs in a worker process"""
+    indicators_df, results = compute_signals(df, btc_df, custom_strategies)
+    signals_df = results['signals_df']
+    index, arrays = simulation_inputs(simulation_frame(df, indicators_df, signals_df), signals_df.columns)
+    simulator = make_simulator(params)
+    if len(index) == 0:
+        print(f"Not enough {timeframe} bars to simulate")
+        return {
+            'metrics': performance_metrics(simulator.ledger.records, [], params.initial_capital,
+                                           periods_per_year(timeframe)),
+            'trades': [],
+            'equity': pd.Series([], index=index, name='equity', dtype=float)
+        }
+    equity = simulator.run(**arrays)
+    records = simulator.ledger.records
+    metrics = performance_metrics(records, [params.initial_capital, *equity], params.initial_capital,
+                                  periods_per_year(timeframe))
+    return {
+        'metrics': metrics,
+        'trades': ledger_trades(records, index[records['entry_idx']], index[records['exit_idx']]),
+        'equity': pd.Series(equity, index=index, name='equity')
+    }
+
+
+def timeframe_jobs(backtester, timeframes, fetch_btc=True):
+    """
+    Download the finest of `timeframes` once and resample it to the others.
+    Returns (base_timeframe, [run_timeframe arguments per timeframe]).
+    """
+    timeframes = list(dict.fromkeys(timeframes))
+    unknown = [tf for tf in timeframes if tf not in INTERVAL_MS]
+    if not timeframes or unknown:
+        raise ValueError(f"Unsupported timeframes {unknown}, expected some of {list(INTERVAL_MS)}")
+    bt = backtester
+    base_timeframe = min(timeframes, key=INTERVAL_MS.get)
+
+    df = fetch_klines(bt.kline_client, bt.symbol, base_timeframe, bt.start_date, bt.end_date, bt.kline_store)
+    btc_df = None
+    if fetch_btc and bt.symbol != 'BTCUSDT':
+        try:
+            btc_df = fetch_klines(bt.kline_client, 'BTCUSDT', base_timeframe, bt.start_date, bt.end_date,
+                                  bt.kline_store)
+        except Exception as e:
+            print(f"Failed to fetch BTC data: {e}")
+
+    params = SimulationParams.from_backtester(bt)
+    jobs = [(tf, resample_klines(df, tf, base_timeframe),
+             resample_klines(btc_df, tf, base_timeframe) if btc_df is not None else None,
+             params, bt.custom_strategies)
+            for tf in timeframes]
+    return base_timeframe, jobs
+
+
+def comparison_table(metrics):
+    """COMPARISON_METRICS x timeframes table from {timeframe: metrics}"""
+    return pd.DataFrame({tf: {name: m.get(name, 0) for name in COMPARISON_METRICS} for tf, m in metrics.items()})
+
+
+def frame_payload(df):
+    """JSON-serializable form of an OHLCV frame, for passing it to Celery tasks"""
+    if df is None:
+        return None
+    payload = {column: df[column].tolist() for column in _AGGREGATION}
+    payload['open_time'] = df.index.values.astype('datetime64[ms]').astype('int64').tolist()
+    return payload
+
+
+def payload_frame(payload):
+    """OHLCV frame back from frame_payload"""
+    if payload is None:
+        return None
+    df = pd.DataFrame({column: payload[column] for column in _AGGREGATION},
+                      index=pd.to_datetime(payload['open_time'], unit='ms'), dtype=float)
+    df.index.name = 'timestamp'
+    return df
+
+
+def compare_timeframes(backtester, timeframes, max_workers=None, fetch_btc=True):
+    """
+    Backtest the backtester's symbol, range and settings on every timeframe.
+
+    Returns {'table': DataFrame (COMPARISON_METRICS x timeframes),
+             'results': {timeframe: {'metrics', 'trades', 'equity'}},
+             'base_timeframe': finest timeframe, the only one fetched}.
+    """
+    base_timeframe, jobs = timeframe_jobs(backtester, timeframes, fetch_btc)
+    workers = min(max_workers or os.cpu_count() or 1, len(jobs))
+    if workers <= 1:
+        outputs = [run_timeframe(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            outputs = list(pool.map(run_timeframe, *zip(*jobs)))
+
+    results = {job[0]: output for job, output in zip(jobs, outputs)}
+    table = comparison_table({tf: result['metrics'] for tf, result in results.items()})
+    return {'table': table, 'results': results, 'base_timeframe': base_timeframe}
@@ -0,0 +1,227 @@
+# parameter_sweep.py - Parallel parameter sweeps for the backtester
+#
+# Data, indicators and the signal-strength arrays are prepared once by a
+# Backtester; the simulation inputs are copied into shared memory and every
+# parameter combination runs ArraySimulator in a worker process that maps
+# those arrays instead of receiving a pickled copy. Long sweeps can checkpoint
+# their completed combinations and resume after an interruption.
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from backtester import performance_metrics
+from checkpoint import CHECKPOINT_INTERVAL, fingerprint, load_checkpoint, remove_checkpoint, save_checkpoint
+from simulation_engine import SimulationParams, make_simulator
+
+# Parameters a sweep grid may vary (all SimulationParams fields)
+SWEEP_PARAMETERS = ['min_signal_strength', 'trailing_stop_pct', 'take_profit_ratio',
+                    'risk_per_trade', 'max_positions', 'stop_atr', 'entry_expiry_bars']
+# Swept parameters the simulator uses as counts (grids may give them as floats)
+INTEGER_PARAMETERS = ['max_positions', 'entry_expiry_bars']
+
+# Scalar metrics kept in the results table (all higher-is-better, drawdown is negative)
+SWEEP_METRICS = ['sharpe_ratio', 'return_pct', 'total_profit', 'win_rate', 'max_drawdown',
+                 'profit_factor', 'num_trades', 'avg_win', 'avg_loss', 'avg_signal_strength']
+
+
+class SharedArrays:
+    """A dict of NumPy arrays copied into named shared memory blocks"""
+
+    def __init__(self, arrays):
+        self.blocks = {}
+        self.spec = {}
+        try:
+            for name, array in arrays.items():
+                array = np.ascontiguousarray(array)
+                block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                self.blocks[name] = block
+                np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+                self.spec[name] = (block.name, array.shape, array.dtype.str)
+        except Exception:
+            self.release()
+            raise
+
+    def release(self):
+        for block in self.blocks.values():
+            block.close()
+            block.unlink()
+        self.blocks = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def attach_shared_arrays(spec):
+    """Map arrays described by SharedArrays.spec; returns (arrays, blocks to keep alive)"""
+    arrays, blocks = {}, []
+    for name, (block_name, shape, dtype) in spec.items():
+        # Pool workers share the parent's resource tracker, so only the
+        # parent's SharedArrays.release() unlinks the block
+        block = shared_memory.SharedMemory(name=block_name)
+        blocks.append(block)
+        arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+    return arrays, blocks
+
+
+# Per-worker state set up once by the pool initializer
+_worker_arrays = None
+_worker_blocks = None
+
+
+def _init_worker(spec):
+    global _worker_arrays, _worker_blocks
+    _worker_arrays, _worker_blocks = attach_shared_arrays(spec)
+
+
+def simulate_slice(arrays, params, bounds=None):
+    """
+    Run the params' simulator over arrays[lo:hi] (all bars when bounds is None).
+    Returns (simulator, equity) with the initial capital prepended to equity.
+    """
+    if bounds is not None:
+        lo, hi = bounds
+        arrays = {name: values[lo:hi] for name, values in arrays.items()}
+    simulator = make_simulator(SimulationParams(**params))
+    equity = simulator.run(**arrays)
+    return simulator, np.concatenate([[params['initial_capital']], equity])
+
+
+def run_combo(arrays, params, periods_per_year, bounds=None):
+    """Simulate one parameter combination and return its scalar metrics"""
+    simulator, equity = simulate_slice(arrays, params, bounds)
+    metrics = performance_metrics(simulator.ledger.records, equity, params['initial_capital'],
+                                  periods_per_year)
+    return {name: metrics[name] for name in SWEEP_METRICS}
+
+
+def _run_combo_worker(params, periods_per_year, bounds=None):
+    return run_combo(_worker_arrays, params, periods_per_year, bounds)
+
+
+def parameter_grid(grid):
+    """Expand {parameter: [values]} into a list of combination dicts"""
+    unknown = [name for name in grid if name not in SWEEP_PARAMETERS]
+    if unknown:
+        raise ValueError(f"Cannot sweep {unknown}, expected parameters from {SWEEP_PARAMETERS}")
+    names = list(grid)
+    values = [v if isinstance(v, (list, tuple, np.ndarray)) else [v] for v in grid.values()]
+    return [dict(zip(names, combo)) for combo in itertools.product(*values)]
+
+
+class ParameterSweep:
+    """Run a grid of simulation parameters over one prepared backtest"""
+
+    def __init__(self, backtester, max_workers=None):
+        """
+        backtester: a Backtester; prepare() is called on it if its signals are
+        not computed yet. Parameters not in the grid keep the backtester's values.
+        """
+        self.backtester = backtester
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.index = None
+        self.arrays = None
+
+    def prepare(self, fetch_btc=True):
+        """Fetch data and compute indicators and signal strengths once"""
+        if self.backtester.df is None:
+            self.backtester.prepare(fetch_btc)
+        else:
+            # Klines already loaded (e.g. by a cached run): only signals are missing
+            self.backtester._require_signals()
+        self.index, self.arrays = self.backtester.simulation_arrays()
+        return self
+
+    def base_params(self):
+        return vars(SimulationParams.from_backtester(self.backtester))
+
+    def combination_params(self, combos):
+        """Full SimulationParams dicts for a list of combination dicts, counts cast to int"""
+        base = self.base_params()
+        params = [{**base, **combo} for combo in combos]
+        for p in params:
+            for name in INTEGER_PARAMETERS:
+                p[name] = int(p[name])
+        return params
+
+    def run(self, grid, metric='sharpe_ratio', fetch_btc=True, checkpoint=None,
+            checkpoint_interval=CHECKPOINT_INTERVAL):
+        """
+        grid: {parameter: [values]} over SWEEP_PARAMETERS, or a list of combination dicts.
+        Returns one row per combination, ranked by `metric` (best first).
+
+        checkpoint: file path where completed combinations are saved at most
+        every checkpoint_interval seconds; rerunning the same sweep on the same
+        data only runs the combinations missing from it. Removed when done.
+        """
+        if metric not in SWEEP_METRICS:
+            raise ValueError(f"Unknown metric '{metric}', expected one of {SWEEP_METRICS}")
+        if self.arrays is None:
+            self.prepare(fetch_btc)
+
+        combos = grid if isinstance(grid, list) else parameter_grid(grid)
+        params = self.combination_params(combos)
+        periods_per_year = self.backtester._periods_per_year()
+
+        results = [None] * len(params)
+        run_id = fingerprint(params, periods_per_year, sorted(self.arrays), *self.arrays.values())
+        saved = load_checkpoint(checkpoint, run_id) if checkpoint else None
+        if saved is not None:
+            arrays, _ = saved
+            for i, row in zip(arrays['done'].tolist(), arrays['results']):
+                results[i] = _metrics_row(row)
+            print(f"Resuming sweep: {len(arrays['done'])} of {len(params)} combinations already done")
+
+        pending = [i for i, result in enumerate(results) if result is None]
+        last_saved = time.monotonic()
+        for i, result in zip(pending, self._results([params[i] for i in pending], periods_per_year)):
+            results[i] = result
+            if checkpoint and time.monotonic() - last_saved >= checkpoint_interval:
+                _save_sweep(checkpoint, run_id, results)
+                last_saved = time.monotonic()
+        remove_checkpoint(checkpoint)
+
+        table = pd.concat([pd.DataFrame(combos), pd.DataFrame(results)], axis=1)
+        table.index.name = 'combo'
+        return table.sort_values(metric, ascending=False, kind='stable')
+
+    def _results(self, params, periods_per_year):
+        """Metrics of each parameter dict, yielded in order as they complete"""
+        workers = min(self.max_workers, len(params))
+        if workers <= 1:
+            for p in params:
+                yield run_combo(self.arrays, p, periods_per_year)
+            return
+        with SharedArrays(self.arrays) as shared, ProcessPoolExecutor(
+                max_workers=workers, initializer=_init_worker, initargs=(shared.spec,)) as pool:
+            chunksize = max(1, len(params) // (workers * 4))
+            yield from pool.map(_run_combo_worker, params, itertools.repeat(periods_per_year),
+                                chunksize=chunksize)
+
+
+def _metrics_row(row):
+    """SWEEP_METRICS dict from a checkpointed row of floats"""
+    return {name: int(value) if name == 'num_trades' else float(value) for name, value in zip(SWEEP_METRICS, row)}
+
+
+def _save_sweep(path, run_id, results):
+    """Checkpoint the completed combinations as (indexes, metrics matrix)"""
+    done = [i for i, result in enumerate(results) if result is not None]
+    save_checkpoint(path, {
+        'done': np.array(done, dtype=np.int64),
+        'results': np.array([[results[i][name] for name in SWEEP_METRICS] for i in done],
+                            dtype=float).reshape(len(done), len(SWEEP_METRICS))
+    }, {'fingerprint': run_id, 'metrics': SWEEP_METRICS})
+
+
+def run_parameter_sweep(backtester, grid, metric='sharpe_ratio', max_workers=None, fetch_btc=True,
+                        checkpoint=None):
+    """Convenience wrapper: prepare once, sweep `grid`, return the ranked table"""
+    return ParameterSweep(backtester, max_workers).run(grid, metric, fetch_btc, checkpoint)
@@ -0,0 +1,162 @@
+# parity_replay.py - Live-vs-backtest parity replay
+#
+# The live scanner computes indicators and strategies on the trailing
+# `window` candles it fetched and acts on the last row; the backtester
+# computes them once over the whole history. Indicators that use the whole
+# frame (support/resistance and fib levels broadcast from the full range)
+# make the batch values at bar t depend on later candles, and a different
+# warm-up changes recursive indicators, so the two paths can disagree.
+#
+# replay_live feeds closed candles one at a time through the live path
+# (compute_indicators + strategies on the trailing window, as
+# CryptoOpportunityScanner.analyze_crypto_pair does on candle close), and
+# compare_parity lines its last rows up against the batch signals of
+# compute_signals bar by bar: which strategy signals, combined entry
+# strengths and indicator values diverge, and how long each live bar took.
+import time
+
+import numpy as np
+import pandas as pd
+
+from backtester import compute_signals, fetch_klines, signal_strengths
+from indicators import compute_indicators
+
+# Candles the scanner fetches per analysis (CryptoOpportunityScanner.get_binance_klines)
+LIVE_WINDOW = 500
+# Relative tolerance for indicator values to count as equal
+INDICATOR_RTOL = 1e-6
+
+
+def replay_live(df, window=LIVE_WINDOW, btc_df=None, start=None, step=1, max_bars=None):
+    """
+    Run the live path on every `step`-th closed candle of df, from bar
+    `start` (default: the first bar with a full window).
+
+    Returns (signals, indicators, latency): the last signal row and last
+    indicator row of each live run, indexed by candle open time, and the
+    per-bar wall time in seconds. Bars where the live path failed are NaN.
+    """
+    start = window - 1 if start is None else start
+    positions = range(start, len(df), step)
+    if max_bars is not None:
+        positions = positions[:max_bars]
+
+    signal_rows, indicator_rows, latency = [], [], []
+    for i in positions:
+        window_df = df.iloc[max(0, i + 1 - window):i + 1]
+        btc_window = btc_df.loc[:window_df.index[-1]].iloc[-window:] if btc_df is not None else None
+        started = time.perf_counter()
+        latest, analysis, full_df = compute_indicators(window_df, btc_window)
+        latency.append(time.perf_counter() - started)
+
+        strategies = (analysis or {}).get('strategies') or {}
+        signals_df = strategies.get('signals_df')
+        signal_rows.append(signals_df.iloc[-1] if signals_df is not None and len(signals_df) else pd.Series(dtype=object))
+        indicator_rows.append(full_df.iloc[-1] if full_df is not None and len(full_df) else pd.Series(dtype=float))
+
+    index = df.index[list(positions)]
+    signals = pd.DataFrame(signal_rows, index=index)
+    indicators = pd.DataFrame(indicator_rows, index=index)
+    return signals, indicators, pd.Series(latency, index=index, name='latency')
+
+
+def _divergence(live, batch):
+    """Boolean frame: live and batch disagree (a value missing on one side only counts)"""
+    live_missing, batch_missing = live.isna(), batch.isna()
+    return (live != batch) & ~(live_missing & batch_missing)
+
+
+def compare_parity(live_signals, live_indicators, batch_indicators, batch_signals, latency=None,
+                   min_signal_strength=0.6, rtol=INDICATOR_RTOL):
+    """
+    Bar-by-bar comparison of live rows with the batch frames on the same bars.
+
+    Returns a dict:
+      bars, failed_bars            bars replayed, bars where the live path failed
+      signal_divergence_rate       per strategy signal column, share of bars that differ
+      divergences                  DataFrame (timestamp, column, live, batch), one row per differing signal
+      strength                     max |live - batch| of the combined buy/sell strengths and
+                                   entry_mismatches (bars where an entry decision would differ)
+      indicator_divergence         per indicator: share of bars off by more than rtol and the
+                                   max relative difference, worst first (look-ahead suspects)
+      latency                      live-path seconds per bar: mean, p50, p95, p99, max
+    """
+    index = live_signals.index
+    failed = live_signals.isna().all(axis=1) if len(live_signals.columns) else pd.Series(True, index=index)
+    ok = index[~failed.to_numpy()]
+
+    columns = [c for c in batch_signals.columns if c in live_signals.columns]
+    live = live_signals.loc[ok, columns].astype(float)
+    batch = batch_signals.reindex(ok)[columns].astype(float)
+    differs = _divergence(live, batch)
+    rows, cols = np.nonzero(differs.to_numpy())
+    divergences = pd.DataFrame({
+        'timestamp': ok[rows],
+        'column': np.array(columns, dtype=object)[cols],
+        'live': live.to_numpy()[rows, cols],
+        'batch': batch.to_numpy()[rows, cols]
+    })
+
+    live_buy, live_sell = signal_strengths(live.fillna(0).astype(bool))
+    batch_buy, batch_sell = signal_strengths(batch.fillna(0).astype(bool))
+    entry_mismatches = int(((live_buy >= min_signal_strength) != (batch_buy >= min_signal_strength)).sum() +
+                           ((live_sell >= min_signal_strength) != (batch_sell >= min_signal_strength)).sum())
+
+    numeric = [c for c in live_indicators.columns
+               if c in batch_indicators.columns and pd.api.types.is_numeric_dtype(batch_indicators[c])]
+    live_values = live_indicators.loc[ok, numeric].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+    batch_values = batch_indicators.reindex(ok)[numeric].to_numpy(dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        relative = np.abs(live_values - batch_values) / np.maximum(np.abs(batch_values), 1e-12)
+    relative = np.where(np.isnan(live_values) & np.isnan(batch_values), 0.0, relative)
+    relative = np.where(np.isnan(live_values) ^ np.isnan(batch_values), np.inf, relative)
+    indicator_divergence = pd.DataFrame({
+        'divergence_rate': (relative > rtol).mean(axis=0) if len(ok) else np.zeros(len(numeric)),
+        'max_relative_diff': relative.max(axis=0) if len(ok) else np.zeros(len(numeric))
+    }, index=pd.Index(numeric, name='indicator')).sort_values(['divergence_rate', 'max_relative_diff'],
+                                                              ascending=False)
+
+    result = {
+        'bars': len(index),
+        'failed_bars': int(failed.sum()),
+        'signal_divergence_rate': differs.mean().sort_values(ascending=False) if len(ok) else pd.Series(dtype=float),
+        'divergences': divergences,
+        'strength': {
+            'max_buy_diff': float(np.abs(live_buy - batch_buy).max()) if len(ok) else 0.0,
+            'max_sell_diff': float(np.abs(live_sell - batch_sell).max()) if len(ok) else 0.0,
+            'entry_mismatches': entry_mismatches
+        },
+        'indicator_divergence': indicator_divergence
+    }
+    if latency is not None and len(latency):
+        values = latency.to_numpy()
+        result['latency'] = {'mean': float(values.mean()), 'max': float(values.max()),
+                             **{f'p{p}': float(v) for p, v in zip([50, 95, 99], np.percentile(values, [50, 95, 99]))}}
+    return result
+
+
+def run_parity_replay(df, window=LIVE_WINDOW, btc_df=None, start=None, step=1, max_bars=None,
+                      min_signal_strength=0.6):
+    """Batch signals over all of df, the live replay, and their compare_parity report"""
+    batch_indicators, results = compute_signals(df, btc_df)
+    live_signals, live_indicators, latency = replay_live(df, window, btc_df, start, step, max_bars)
+    print(f"Replayed {len(live_signals)} bars through the live path "
+          f"({latency.mean() * 1000 if len(latency) else 0:.1f} ms/bar)")
+    return compare_parity(live_signals, live_indicators, batch_indicators, results['signals_df'], latency,
+                          min_signal_strength)
+
+
+def backtester_parity(backtester, window=LIVE_WINDOW, step=1, max_bars=None, fetch_btc=False):
+    """
+    Parity replay over a Backtester's klines. The scanner analyses without
+    BTC data, so BTC context is left out unless fetch_btc is set.
+    """
+    bt = backtester
+    if bt.df is None:
+        bt.fetch_data()
+    btc_df = None
+    if fetch_btc and bt.symbol != 'BTCUSDT':
+        btc_df = fetch_klines(bt.kline_client, 'BTCUSDT', bt.timeframe, bt.start_date, bt.end_date,
+                              bt.kline_store)
+    return run_parity_replay(bt.df, window, btc_df, step=step, max_bars=max_bars,
+                             min_signal_strength=bt.min_signal_strength)
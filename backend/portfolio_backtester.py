@@ -0,0 +1,221 @@
+# portfolio_backtester.py - Multi-symbol backtests against a shared capital pool
+#
+# Klines are fetched once per symbol (BTC once for all alts), indicators and
+# signal strengths are computed per symbol in a process pool, and the
+# PortfolioSimulator merges every symbol's entries and exits in time order
+# against one capital balance and a global position limit.
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from binance.client import Client
+
+from backtester import (compute_signals, fetch_klines, performance_metrics, periods_per_year,
+                        simulation_frame, simulation_inputs)
+from kline_store import kline_store as shared_kline_store
+from simulation_engine import (PortfolioSimulator, SimulationParams, EXIT_REASONS, FILL_MODELS,
+                               TIE_BREAKS, LONG)
+
+
+def _index_times(index):
+    return pd.DatetimeIndex(index).values.astype('datetime64[ms]').astype(np.int64)
+
+
+def prepare_symbol(df, btc_df=None, custom_strategies=None):
+    """Indicators, signals and simulation arrays for one symbol (runs in a worker process)"""
+    indicators_df, results = compute_signals(df, btc_df, custom_strategies)
+    signals_df = results['signals_df']
+    index, arrays = simulation_inputs(simulation_frame(df, indicators_df, signals_df),
+                                      signals_df.columns)
+    arrays['times'] = _index_times(index)
+    return arrays
+
+
+class PortfolioBacktester:
+    """Backtest several symbols with shared capital and global position limits"""
+
+    def __init__(self, symbols, timeframe, start_date, end_date, initial_capital=10000,
+                 risk_per_trade=0.02, max_positions=5, max_positions_per_symbol=None,
+                 api_key=None, api_secret=None, custom_strategies=None, fill_model='close',
+                 tie_break='stop_first', max_workers=None, client=None, kline_store=None):
+        """
+        Parameters:
+        - symbols: list of trading pairs sharing the capital pool
+        - max_positions: open positions across all symbols
+        - max_positions_per_symbol: optional cap per symbol (defaults to max_positions)
+        - Remaining settings as in Backtester
+        """
+        if not symbols:
+            raise ValueError("At least one symbol is required")
+        if fill_model not in FILL_MODELS:
+            raise ValueError(f"Unknown fill model '{fill_model}', expected one of {FILL_MODELS}")
+        if tie_break not in TIE_BREAKS:
+            raise ValueError(f"Unknown tie break '{tie_break}', expected one of {TIE_BREAKS}")
+        self.symbols = list(dict.fromkeys(s.upper() for s in symbols))
+        self.timeframe = timeframe
+        self.start_date = start_date
+        self.end_date = end_date
+        self.initial_capital = initial_capital
+        self.current_capital = initial_capital
+        self.risk_per_trade = risk_per_trade
+        self.max_positions = max_positions
+        self.max_positions_per_symbol = max_positions_per_symbol
+        self.custom_strategies = custom_strategies or []
+        self.fill_model = fill_model
+        self.tie_break = tie_break
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.client = client or Client(api_key or os.getenv('BINANCE_API_KEY'), api_secret or os.getenv('BINANCE_API_SECRET'))
+        self.kline_store = shared_kline_store if kline_store is None else (kline_store or None)
+
+        # Same defaults as Backtester
+        self.min_signal_strength = 0.6
+        self.trailing_stop_pct = 0.05
+        self.take_profit_ratio = 2.5
+
+        self.data = {}
+        self.btc_df = None
+        self.arrays = {}
+        self.trades = []
+        self.ledger = None
+        self.portfolio = pd.DataFrame()
+
+    def fetch_data(self, fetch_btc=True):
+        """Fetch every symbol once; BTC is fetched a single time and shared by all alts"""
+        self.data = {}
+        for symbol in self.symbols:
+            try:
+                self.data[symbol] = fetch_klines(self.client, symbol, self.timeframe,
+                                                 self.start_date, self.end_date, self.kline_store)
+            except Exception as e:
+                print(f"Error fetching data for {symbol}: {e}")
+        if not self.data:
+            raise ValueError("No data fetched for any symbol")
+
+        self.btc_df = self.data.get('BTCUSDT')
+        if self.btc_df is None and fetch_btc:
+            try:
+                self.btc_df = fetch_klines(self.client, 'BTCUSDT', self.timeframe,
+                                           self.start_date, self.end_date, self.kline_store)
+            except Exception as e:
+                print(f"Failed to fetch BTC data: {e}")
+
+    def compute_signals(self):
+        """Per-symbol indicators and signal strengths, one process per symbol"""
+        symbols = [s for s in self.symbols if s in self.data]
+        btc_frames = [None if s == 'BTCUSDT' else self.btc_df for s in symbols]
+        frames = [self.data[s] for s in symbols]
+        strategies = [self.custom_strategies] * len(symbols)
+
+        workers = min(self.max_workers, len(symbols))
+        if workers <= 1:
+            results = []
+            for args in zip(frames, btc_frames, strategies):
+                results.append(self._prepare_or_none(*args))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(prepare_symbol, *args)
+                           for args in zip(frames, btc_frames, strategies)]
+                results = []
+                for symbol, future in zip(symbols, futures):
+                    try:
+                        results.append(future.result())
+                    except Exception as e:
+                        print(f"Error computing signals for {symbol}: {e}")
+                        results.append(None)
+
+        self.arrays = {s: a for s, a in zip(symbols, results) if a is not None and len(a['close'])}
+        if not self.arrays:
+            raise ValueError("No symbol produced signals")
+
+    @staticmethod
+    def _prepare_or_none(df, btc_df, custom_strategies):
+        try:
+            return prepare_symbol(df, btc_df, custom_strategies)
+        except Exception as e:
+            print(f"Error computing signals: {e}")
+            traceback.print_exc()
+            return None
+
+    def prepare(self, fetch_btc=True):
+        self.fetch_data(fetch_btc)
+        self.compute_signals()
+
+    def simulation_params(self):
+        return SimulationParams(
+            initial_capital=self.initial_capital,
+            risk_per_trade=self.risk_per_trade,
+            min_signal_strength=self.min_signal_strength,
+            max_positions=self.max_positions,
+            trailing_stop_pct=self.trailing_stop_pct,
+            take_profit_ratio=self.take_profit_ratio,
+            fill_model=self.fill_model,
+            tie_break=self.tie_break
+        )
+
+    def simulate_trades(self):
+        if not self.arrays:
+            raise ValueError("Signals not computed")
+        symbols = list(self.arrays)
+        simulator = PortfolioSimulator(self.simulation_params(), self.max_positions_per_symbol)
+        equity = simulator.run([self.arrays[s] for s in symbols])
+        self.current_capital = simulator.capital
+        self.ledger = simulator.ledger
+
+        index = pd.to_datetime(simulator.times, unit='ms')
+        records = self.ledger.records
+        entry_dates = index[records['entry_idx']]
+        exit_dates = index[records['exit_idx']]
+        self.trades = []
+        for k, record in enumerate(records):
+            side = 'long' if record['direction'] == LONG else 'short'
+            strength = float(record['signal_strength'])
+            self.trades.append({
+                'symbol': symbols[record['symbol']],
+                'strategy': f'enhanced_{side}_{strength:.2f}',
+                'entry_date': entry_dates[k],
+                'exit_date': exit_dates[k],
+                'entry_price': float(record['entry_price']),
+                'exit_price': float(record['exit_price']),
+                'quantity': float(record['quantity']),
+                'profit': float(record['profit']),
+                'type': f"{side}_{EXIT_REASONS[record['exit_reason']]}",
+                'signal_strength': strength
+            })
+
+        self.portfolio = pd.DataFrame(
+            {'equity': np.concatenate([[self.initial_capital], equity])},
+            index=pd.DatetimeIndex([index[0] - pd.Timedelta(days=1)]).append(index)
+        )
+
+    def get_performance_metrics(self):
+        """Backtester metrics for the whole portfolio plus profit and trade count per symbol"""
+        records = self.ledger.records if self.ledger is not None else []
+        equity = self.portfolio['equity'].to_numpy(dtype=float) if 'equity' in self.portfolio else []
+        metrics = performance_metrics(records, equity, self.initial_capital,
+                                      periods_per_year(self.timeframe))
+        symbols = list(self.arrays)
+        profit = np.bincount(records['symbol'], weights=records['profit'], minlength=len(symbols)) \
+            if len(records) else np.zeros(len(symbols))
+        counts = np.bincount(records['symbol'], minlength=len(symbols)) \
+            if len(records) else np.zeros(len(symbols), dtype=int)
+        metrics['symbol_breakdown'] = {
+            symbol: {'profit': float(profit[k]), 'num_trades': int(counts[k])}
+            for k, symbol in enumerate(symbols)
+        }
+        return metrics
+
+    def run_backtest(self, fetch_btc=True):
+        """Run the portfolio backtest"""
+        print(f"Starting portfolio backtest for {', '.join(self.symbols)}")
+
+        self.prepare(fetch_btc)
+        self.simulate_trades()
+
+        metrics = self.get_performance_metrics()
+
+        print(f"Portfolio backtest completed: {metrics['num_trades']} trades over "
+              f"{len(self.arrays)} symbols, {metrics['return_pct']:.2f}% return")
+
+        return metrics, self.trades, self.portfolio
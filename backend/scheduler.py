@@ -8,6 +8,9 @@ import logging
 import time
 import pytz
 
+from kline_cache import kline_cache, records_to_klines
+from kline_downloader import kline_downloader
+
 lebanon_tz = pytz.timezone("Asia/Beirut")
 
 
@@ -119,31 +122,12 @@ class SignalScheduler:
             
             logging.info(f"Fetching data for {symbol} on {binance_interval} from {datetime.fromtimestamp(start_time/1000)} to {datetime.fromtimestamp(end_time/1000)}")
             
-            # Get historical data once for all signals of this symbol+timeframe
-            params = {
-                'symbol': symbol,
-                'interval': binance_interval,
-                'startTime': start_time,
-                'endTime': end_time,
-                'limit': 1000  # Binance limit
-            }
-            
-            klines_response = requests.get(
-                'https://api.binance.com/api/v3/klines',
-                params=params,
-                timeout=10,
-                headers={'User-Agent': 'Trading-Bot/1.0'}
-            )
-            
-            logging.info(f"Binance API response status for {symbol}: {klines_response.status_code}")
-            
-            if klines_response.status_code != 200:
-                logging.error(f"Binance API error for {symbol}: {klines_response.status_code}")
-                logging.error(f"API Response: {klines_response.text}")
-                logging.error(f"Request params: {params}")
-                return
-                
-            klines = klines_response.json()
+            # Get historical data once for all signals of this symbol+timeframe;
+            # the shared kline cache only requests candles closed since the last
+            # check (and the forming one), the downloader pages longer ranges
+            records = kline_cache.range(kline_downloader, symbol, binance_interval, start_time, end_time,
+                                        include_open=True)
+            klines = records_to_klines(records, binance_interval)
             
             if not klines or len(klines) == 0:
                 # Try different approaches if no data
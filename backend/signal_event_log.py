@@ -0,0 +1,169 @@
+# signal_event_log.py - Append-only log of strategy signal transitions
+#
+# One file pair per (symbol, timeframe):
+#   <SYMBOL>_<tf>.events  fixed-size binary records, appended on candle close
+#   <SYMBOL>_<tf>.json    strategy column table, last logged candle and last states
+# Only transitions are stored (a strategy column turning on or off), so a
+# year of 15m candles over ~35 signal columns stays in the kilobytes.
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process locking only
+    fcntl = None
+
+EVENT_DTYPE = np.dtype([('ts', '<i8'), ('strategy', '<u2'), ('state', 'u1')])
+
+DEFAULT_LOG_DIR = os.getenv(
+    'SIGNAL_EVENT_LOG_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'signal_events')
+)
+
+
+def _to_epoch_ms(index):
+    return pd.DatetimeIndex(index).values.astype('datetime64[ms]').astype(np.int64)
+
+
+class SignalEventLog:
+    """Append-only, per-(symbol, timeframe) log of strategy signal transitions"""
+
+    def __init__(self, base_dir=None):
+        self.base_dir = base_dir or DEFAULT_LOG_DIR
+        self._lock = threading.Lock()
+
+    def _paths(self, symbol, timeframe):
+        name = f"{symbol.upper()}_{timeframe}"
+        return (os.path.join(self.base_dir, f"{name}.events"),
+                os.path.join(self.base_dir, f"{name}.json"),
+                os.path.join(self.base_dir, f"{name}.lock"))
+
+    def _read_header(self, header_path):
+        if not os.path.exists(header_path):
+            return {'columns': [], 'state': [], 'last_ts': None}
+        with open(header_path) as f:
+            return json.load(f)
+
+    def _write_header(self, header_path, header):
+        tmp_path = f"{header_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(header, f)
+        os.replace(tmp_path, header_path)
+
+    def record(self, symbol, timeframe, signals_df):
+        """
+        Append transitions for closed candles newer than the last logged one.
+
+        signals_df: boolean strategy columns indexed by candle open time; every
+        row must be a closed candle. Returns the number of events written.
+        """
+        if signals_df is None or len(signals_df) == 0:
+            return 0
+
+        os.makedirs(self.base_dir, exist_ok=True)
+        events_path, header_path, lock_path = self._paths(symbol, timeframe)
+
+        with self._lock, open(lock_path, 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+            header = self._read_header(header_path)
+            timestamps = _to_epoch_ms(signals_df.index)
+            new_rows = timestamps > header['last_ts'] if header['last_ts'] is not None else \
+                np.ones(len(timestamps), dtype=bool)
+            if not new_rows.any():
+                return 0
+
+            # Stable column ids: new strategies are appended to the table
+            for column in signals_df.columns:
+                if column not in header['columns']:
+                    header['columns'].append(column)
+                    header['state'].append(0)
+            column_ids = np.array([header['columns'].index(c) for c in signals_df.columns], dtype=np.uint16)
+
+            states = signals_df.to_numpy(dtype=bool)[new_rows].astype(np.uint8)
+            timestamps = timestamps[new_rows]
+            previous = np.vstack([np.array(header['state'], dtype=np.uint8)[column_ids], states[:-1]])
+            bar_idx, col_idx = np.nonzero(states != previous)
+
+            events = np.empty(len(bar_idx), dtype=EVENT_DTYPE)
+            events['ts'] = timestamps[bar_idx]
+            events['strategy'] = column_ids[col_idx]
+            events['state'] = states[bar_idx, col_idx]
+            with open(events_path, 'ab') as f:
+                f.write(events.tobytes())
+
+            last_state = np.array(header['state'], dtype=np.uint8)
+            last_state[column_ids] = states[-1]
+            header['state'] = last_state.tolist()
+            header['last_ts'] = int(timestamps[-1])
+            self._write_header(header_path, header)
+            return len(events)
+
+    def record_live(self, symbol, timeframe, analysis):
+        """Log the strategy signals of a live analysis, skipping the still-open candle"""
+        try:
+            strategies = (analysis or {}).get('strategies') or {}
+            signals_df = strategies.get('signals_df')
+            if signals_df is None or len(signals_df) < 2:
+                return 0
+            # The last kline returned by Binance is the candle that is still forming
+            return self.record(symbol, timeframe, signals_df.iloc[:-1])
+        except Exception as e:
+            logging.error(f"Error recording signal events for {symbol} {timeframe}: {e}")
+            return 0
+
+    def query(self, symbol, timeframe, start=None, end=None, strategies=None):
+        """
+        Events in [start, end] (datetimes or epoch ms), optionally for some strategy columns.
+
+        Returns a DataFrame with timestamp, strategy and fired (True when the
+        signal turned on, False when it turned off).
+        """
+        events_path, header_path, _ = self._paths(symbol, timeframe)
+        empty = pd.DataFrame({'timestamp': pd.to_datetime([]), 'strategy': [], 'fired': []})
+        if not os.path.exists(events_path) or os.path.getsize(events_path) == 0:
+            return empty
+
+        header = self._read_header(header_path)
+        count = os.path.getsize(events_path) // EVENT_DTYPE.itemsize
+        events = np.memmap(events_path, dtype=EVENT_DTYPE, mode='r', shape=(count,))
+
+        # Events are appended in time order, so the range is two binary searches
+        ts = events['ts']
+        lo = 0 if start is None else int(np.searchsorted(ts, self._as_ms(start), side='left'))
+        hi = count if end is None else int(np.searchsorted(ts, self._as_ms(end), side='right'))
+        selected = np.array(events[lo:hi])
+        del events
+
+        if strategies is not None:
+            wanted = [header['columns'].index(s) for s in strategies if s in header['columns']]
+            selected = selected[np.isin(selected['strategy'], wanted)]
+
+        names = np.array(header['columns'], dtype=object)
+        return pd.DataFrame({
+            'timestamp': pd.to_datetime(selected['ts'], unit='ms'),
+            'strategy': names[selected['strategy']] if len(selected) else [],
+            'fired': selected['state'].astype(bool)
+        })
+
+    def active_strategies(self, symbol, timeframe):
+        """Strategy columns that were on at the last logged candle"""
+        _, header_path, _ = self._paths(symbol, timeframe)
+        header = self._read_header(header_path)
+        return [c for c, s in zip(header['columns'], header['state']) if s]
+
+    @staticmethod
+    def _as_ms(value):
+        if isinstance(value, (int, np.integer)):
+            return int(value)
+        return int(pd.Timestamp(value).value // 10**6)
+
+
+# Shared instance used by the live analysis paths
+signal_event_log = SignalEventLog()
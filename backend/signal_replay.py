@@ -0,0 +1,278 @@
+# signal_replay.py - Vectorized replay of stored AI signals against historical klines
+#
+# The SignalScheduler only learns outcomes by polling prices every 5 minutes,
+# so results of old signals are approximate or missing. This module replays
+# every signal against the kline store: all signals of a symbol are laid out
+# as a (signals x horizon bars) matrix of highs and lows starting at their
+# creation time, and fills, target/stop touches and excursions are found with
+# whole-matrix comparisons and argmax instead of a per-candle loop.
+#
+# Replay rules (checked on each candle's high/low, like _check_signal_against_klines):
+# - a BUY fills once price trades down into the entry zone (at the zone high,
+#   or at the open when the candle opens inside/below it); a SELL mirrors this
+#   at the zone low. A signal whose TP1 trades before the fill is MISSED.
+# - from the fill candle on, the stop and the take profits are checked; when
+#   one candle touches both, tie_break decides (stop first by default).
+# - the position is split equally across the take profits; whatever is left
+#   exits at the stop, or is marked at the last close of the horizon.
+import numpy as np
+import pandas as pd
+import pytz
+
+from kline_store import INTERVAL_MS, KLINE_DTYPE, KlineStore, kline_store as shared_kline_store, \
+    to_milliseconds
+from simulation_engine import LONG, SHORT, TIE_BREAKS
+
+lebanon_tz = pytz.timezone("Asia/Beirut")
+
+SIDES = {'BUY': LONG, 'SELL': SHORT}
+
+# Signals are processed in blocks of at most this many (signal, bar) cells
+MAX_BLOCK_CELLS = 4_000_000
+
+REPLAY_COLUMNS = [
+    'id', 'symbol', 'timeframe', 'side', 'confidence', 'created_at', 'status', 'result',
+    'hit_tp_level', 'first_hit', 'first_hit_time', 'fill_time', 'fill_price', 'exit_time',
+    'exit_price', 'bars_to_fill', 'bars_held', 'mfe_pct', 'mae_pct', 'mfe_r', 'mae_r', 'r_multiple'
+]
+_TIME_COLUMNS = ['first_hit_time', 'fill_time', 'exit_time']
+_NUMERIC_COLUMNS = ['hit_tp_level', 'fill_price', 'exit_price', 'bars_to_fill', 'bars_held',
+                    'mfe_pct', 'mae_pct', 'mfe_r', 'mae_r', 'r_multiple']
+
+
+def _field(signal, name):
+    return signal[name] if isinstance(signal, dict) else getattr(signal, name)
+
+
+def created_ms(created_at):
+    """Epoch ms of a created_at value; naive datetimes are Lebanon time like the AISignals default"""
+    timestamp = pd.Timestamp(created_at)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.tz_localize(lebanon_tz)
+    return to_milliseconds(timestamp.tz_convert('UTC'))
+
+
+def signal_arrays(signals):
+    """Column arrays of AISignals rows (or dicts with the same fields); take profits padded with NaN"""
+    n = len(signals)
+    take_profits = [list(_field(s, 'take_profits') or []) for s in signals]
+    max_tp = max([len(tps) for tps in take_profits] + [1])
+    tps = np.full((n, max_tp), np.nan)
+    for i, levels in enumerate(take_profits):
+        tps[i, :len(levels)] = levels
+    return {
+        'id': np.array([_field(s, 'id') for s in signals]),
+        'symbol': np.array([_field(s, 'symbol').upper() for s in signals]),
+        'timeframe': np.array([_field(s, 'timeframe') for s in signals]),
+        'side': np.array([_field(s, 'primary_signal').upper() for s in signals]),
+        'confidence': np.array([_field(s, 'confidence') if _field(s, 'confidence') is not None else np.nan
+                                for s in signals], dtype=float),
+        'created_ms': np.array([created_ms(_field(s, 'created_at')) for s in signals], dtype=np.int64),
+        'zone_low': np.array([_field(s, 'entry_zone_low') for s in signals], dtype=float),
+        'zone_high': np.array([_field(s, 'entry_zone_high') for s in signals], dtype=float),
+        'stop_loss': np.array([_field(s, 'stop_loss') for s in signals], dtype=float),
+        'take_profits': tps
+    }
+
+
+def _first(mask):
+    """Column of the first True in each row, mask.shape[1] where there is none"""
+    return np.where(mask.any(axis=1), mask.argmax(axis=1), mask.shape[1])
+
+
+def replay_block(records, created, direction, zone_low, zone_high, stop_loss, take_profits,
+                 horizon, tie_break='stop_first'):
+    """
+    Replay signals of one symbol against KLINE_DTYPE records.
+
+    Prices of SELL signals are negated so both sides share the BUY rules.
+    Returns a dict of per-signal arrays; bar positions are columns of the
+    horizon matrix (horizon where an event does not happen).
+    """
+    n = len(records)
+    rows = np.arange(len(created))
+    start = np.searchsorted(records['open_time'], created, side='left')
+    cols = start[:, None] + np.arange(horizon)
+    valid = cols < n
+    cols = np.minimum(cols, max(n - 1, 0))
+    last = np.clip(n - start, 1, horizon) - 1
+
+    d = direction.astype(float)[:, None]
+    long_side = direction == LONG
+    high = np.where(long_side[:, None], records['high'][cols], -records['low'][cols])
+    low = np.where(long_side[:, None], records['low'][cols], -records['high'][cols])
+    open_ = records['open'][cols] * d
+    close = records['close'][cols] * d
+    entry_edge = np.where(long_side, zone_high, -zone_low)
+    stop = stop_loss * direction
+    tps = take_profits * d
+    num_tps = (~np.isnan(take_profits)).sum(axis=1)
+
+    # Fill: first candle trading into the zone; missed when TP1 trades first
+    fill_at = _first((low <= entry_edge[:, None]) & valid)
+    tp1_at = _first((high >= tps[:, :1]) & valid)
+    missed = (tp1_at < fill_at) & (num_tps > 0)
+    filled = (fill_at < horizon) & ~missed
+    fill_col = np.minimum(fill_at, horizon - 1)
+    fill_price = np.minimum(open_[rows, fill_col], entry_edge)
+
+    # Stop and targets from the fill candle on
+    after = (np.arange(horizon) >= fill_at[:, None]) & valid
+    sl_at = _first((low <= stop[:, None]) & after)
+    tp_at = np.stack([_first((high >= tps[:, [j]]) & after) for j in range(tps.shape[1])], axis=1)
+    if tie_break == 'stop_first':
+        hit = tp_at < sl_at[:, None]
+    else:
+        hit = (tp_at <= sl_at[:, None]) & (tp_at < horizon)
+    hit = np.logical_and.accumulate(hit, axis=1)  # targets are taken in order
+    hit_level = hit.sum(axis=1)
+    completed = (num_tps > 0) & (hit_level == num_tps)
+    stopped = ~completed & (sl_at < horizon)
+    final_tp = np.maximum(num_tps - 1, 0)
+    exit_at = np.where(completed, tp_at[rows, final_tp], np.where(stopped, sl_at, last))
+    exit_price = np.where(completed, tps[rows, final_tp],
+                          np.where(stopped, stop, close[rows, np.minimum(exit_at, horizon - 1)]))
+
+    # Equal split across the targets; the rest exits at the stop or the last close
+    shares = np.maximum(num_tps, 1)
+    target_pnl = np.where(hit, tps - fill_price[:, None], 0.0).sum(axis=1) / shares
+    pnl = target_pnl + (1 - hit_level / shares) * (exit_price - fill_price)
+    risk = fill_price - stop
+    with np.errstate(divide='ignore', invalid='ignore'):
+        risk = np.where(risk > 0, risk, np.nan)
+        held = after & (np.arange(horizon) <= exit_at[:, None])
+        mfe = np.where(held, high, -np.inf).max(axis=1) - fill_price
+        mae = fill_price - np.where(held, low, np.inf).min(axis=1)
+        scale = np.abs(fill_price)
+        first_is_stop = sl_at <= tp_at[:, 0] if tie_break == 'stop_first' else sl_at < tp_at[:, 0]
+
+        return {
+            'start': start, 'cols': cols, 'has_data': start < n, 'filled': filled, 'missed': missed,
+            'fill_at': fill_at, 'fill_price': fill_price * direction,
+            'exit_at': exit_at, 'exit_price': exit_price * direction,
+            'hit_level': hit_level, 'completed': completed, 'stopped': stopped,
+            'first_hit': np.where(first_is_stop & (sl_at < horizon), 'SL',
+                                  np.where(tp_at[:, 0] < horizon, 'TP1', None)),
+            'first_hit_at': np.minimum(sl_at, tp_at[:, 0]),
+            'mfe_pct': mfe / scale * 100, 'mae_pct': mae / scale * 100,
+            'mfe_r': mfe / risk, 'mae_r': mae / risk, 'r_multiple': pnl / risk
+        }
+
+
+def replay_signals(signals, interval='5m', horizon_days=14, store=None, client=None,
+                   tie_break='stop_first'):
+    """
+    Replay AISignals rows (or dicts with their fields) on `interval` candles
+    for up to horizon_days after each signal was created.
+
+    Candles come from the kline store; with a client, missing candles are
+    downloaded first, otherwise only what is stored is used. Returns a
+    DataFrame with REPLAY_COLUMNS, one row per signal in input order. status
+    is FILLED, MISSED (TP1 traded before the fill), NOT_FILLED or NO_DATA;
+    result uses the AISignals.result values (ACTIVE when still open).
+    """
+    if interval not in INTERVAL_MS:
+        raise ValueError(f"Unsupported replay interval '{interval}'")
+    if tie_break not in TIE_BREAKS:
+        raise ValueError(f"Unknown tie break '{tie_break}', expected one of {TIE_BREAKS}")
+    store = store or shared_kline_store
+    step = INTERVAL_MS[interval]
+    horizon = max(1, int(horizon_days * 86_400_000 // step))
+    arrays = signal_arrays(signals)
+    n = len(arrays['id'])
+    known = np.isin(arrays['side'], list(SIDES))
+    direction = np.array([SIDES.get(side, LONG) for side in arrays['side']], dtype=np.int8)
+
+    out = {name: np.full(n, None, dtype=object) for name in REPLAY_COLUMNS}
+    out.update({name: np.full(n, np.nan) for name in _NUMERIC_COLUMNS + _TIME_COLUMNS})
+    for name in ['id', 'symbol', 'timeframe', 'side', 'confidence']:
+        out[name] = arrays[name]
+    out['created_at'] = arrays['created_ms']
+    out['status'][:] = 'NO_DATA'
+
+    for symbol in np.unique(arrays['symbol']):
+        idx = np.flatnonzero((arrays['symbol'] == symbol) & known)
+        if len(idx) == 0:
+            continue
+        records = _load_records(store, client, symbol, interval,
+                                arrays['created_ms'][idx].min(),
+                                arrays['created_ms'][idx].max() + horizon * step)
+        if len(records) == 0:
+            continue
+        block = max(1, MAX_BLOCK_CELLS // horizon)
+        for lo in range(0, len(idx), block):
+            k = idx[lo:lo + block]
+            r = replay_block(records, arrays['created_ms'][k], direction[k], arrays['zone_low'][k],
+                             arrays['zone_high'][k], arrays['stop_loss'][k], arrays['take_profits'][k],
+                             horizon, tie_break)
+            _store_outcomes(out, k, r, records['open_time'], horizon)
+
+    outcomes = pd.DataFrame(out, columns=REPLAY_COLUMNS)
+    for name in ['created_at'] + _TIME_COLUMNS:
+        outcomes[name] = pd.to_datetime(outcomes[name], unit='ms')
+    return outcomes
+
+
+def _load_records(store, client, symbol, interval, start_ms, end_ms):
+    """Candles covering [start_ms, end_ms], downloading missing ones when a client is given"""
+    step = INTERVAL_MS[interval]
+    start_ms = (start_ms // step) * step  # the candle open at signal creation
+    try:
+        if client is not None:
+            return store.get_records(client, symbol, interval, start_ms, end_ms)
+        return KlineStore._slice(store.load(symbol, interval), start_ms, end_ms)
+    except Exception as e:
+        print(f"Error loading klines for {symbol} {interval}: {e}")
+        return np.empty(0, dtype=KLINE_DTYPE)
+
+
+def _store_outcomes(out, k, r, open_time, horizon):
+    rows = np.arange(len(k))
+    bar_time = lambda at: np.where(at < horizon, open_time[r['cols'][rows, np.minimum(at, horizon - 1)]], np.nan)
+    filled = r['filled'] & r['has_data']
+
+    status = np.where(~r['has_data'], 'NO_DATA', np.where(r['missed'], 'MISSED',
+                      np.where(filled, 'FILLED', 'NOT_FILLED')))
+    result = np.where(r['completed'], 'COMPLETED', np.where(
+        r['stopped'], 'SL_HIT', np.where(r['hit_level'] > 0,
+                                         np.char.add(np.char.add('TP', r['hit_level'].astype(str)), '_HIT'), 'ACTIVE')))
+    out['status'][k] = status
+    out['result'][k] = np.where(filled, result, None)
+    out['first_hit'][k] = np.where(filled, r['first_hit'], None)
+    values = {
+        'hit_tp_level': r['hit_level'], 'first_hit_time': bar_time(r['first_hit_at']),
+        'fill_time': bar_time(r['fill_at']), 'fill_price': r['fill_price'],
+        'exit_time': bar_time(r['exit_at']), 'exit_price': r['exit_price'],
+        'bars_to_fill': r['fill_at'], 'bars_held': r['exit_at'] - r['fill_at'],
+        **{name: r[name] for name in ['mfe_pct', 'mae_pct', 'mfe_r', 'mae_r', 'r_multiple']}
+    }
+    for name, value in values.items():
+        out[name][k] = np.where(filled, value, np.nan)
+
+
+def summarize_replay(outcomes, by=None):
+    """
+    Fill rate, win rate, average/median R and excursions of replayed signals,
+    overall or per value of the `by` column(s) (e.g. 'symbol', 'timeframe').
+    """
+    def summary(group):
+        filled = group[group['status'] == 'FILLED']
+        r = filled['r_multiple'].astype(float)
+        decided = group['status'].isin(['FILLED', 'MISSED', 'NOT_FILLED']).sum()
+        return {
+            'signals': int(len(group)),
+            'filled': int(len(filled)),
+            'fill_rate': float(len(filled) / decided * 100) if decided else 0.0,
+            'win_rate': float((r > 0).mean() * 100) if r.notna().any() else 0.0,
+            'avg_r': float(r.mean()) if r.notna().any() else 0.0,
+            'median_r': float(r.median()) if r.notna().any() else 0.0,
+            'total_r': float(r.sum()),
+            'avg_mfe_r': float(filled['mfe_r'].astype(float).mean()) if len(filled) else 0.0,
+            'avg_mae_r': float(filled['mae_r'].astype(float).mean()) if len(filled) else 0.0,
+            'results': {str(k): int(v) for k, v in filled['result'].value_counts().items()}
+        }
+
+    if by is None:
+        return summary(outcomes)
+    return {key if not isinstance(key, tuple) else ' / '.join(map(str, key)): summary(group)
+            for key, group in outcomes.groupby(by)}
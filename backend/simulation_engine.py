@@ -0,0 +1,834 @@
+# simulation_engine.py - Array-based trade simulation for the backtester
+#
+# Replaces the per-bar iterrows loop: inputs are contiguous NumPy arrays,
+# open positions live in fixed-capacity slots, and the engine jumps from
+# event to event (entry candidates and exits) instead of visiting every bar.
+# A position's exit only depends on prices after its entry, so it is found
+# with a vectorized scan at entry time.
+import time
+
+import numpy as np
+
+# Seconds between progress callbacks during a run
+PROGRESS_INTERVAL = 0.5
+
+# Initial number of bars scanned for an exit; doubled until one is found
+EXIT_SCAN_WINDOW = 64
+
+EXIT_REASONS = ['stop_loss', 'take_profit', 'final_close']
+STOP_LOSS, TAKE_PROFIT, FINAL_CLOSE = range(3)
+
+LONG, SHORT = 1, -1
+
+# Bump whenever a change alters simulation results (invalidates cached backtests)
+ENGINE_VERSION = 2
+
+# 'close': exits trigger on the bar close; 'intrabar': on the bar high/low
+FILL_MODELS = ['close', 'intrabar']
+# Which level fills when one intrabar range touches both stop and target
+TIE_BREAKS = ['stop_first', 'target_first']
+
+# 'market': enter on the signal close, one target, trailing stop.
+# 'ladder': limit entry in a zone, partial exits at several targets and
+# stop moves, like AISignals (see LadderSimulator)
+ORDER_MODELS = ['market', 'ladder']
+
+# One closed trade per record; bar indexes refer to the simulated price arrays
+TRADE_DTYPE = np.dtype([
+    ('seq', '<i8'), ('direction', 'i1'), ('entry_idx', '<i8'), ('exit_idx', '<i8'),
+    ('entry_price', '<f8'), ('exit_price', '<f8'), ('quantity', '<f8'), ('profit', '<f8'),
+    ('exit_reason', 'i1'), ('signal_strength', '<f8'), ('symbol', '<u2')
+])
+
+# One scheduled exit leg of a laddered position (see ladder_exits)
+EXIT_DTYPE = np.dtype([('idx', '<i8'), ('price', '<f8'), ('quantity', '<f8'), ('reason', 'i1')])
+
+
+# SimulationParams fields that only apply to the ladder order model
+LADDER_PARAMETERS = ['order_model', 'entry_zone_atr', 'stop_atr', 'take_profit_ratios', 'tp_fractions',
+                     'entry_expiry_bars', 'stop_moves']
+
+
+class SimulationParams:
+    """Risk and position management settings for one simulation run"""
+
+    def __init__(self, initial_capital=10000, risk_per_trade=0.02, min_signal_strength=0.6,
+                 max_positions=3, trailing_stop_pct=0.05, take_profit_ratio=2.5,
+                 fill_model='close', tie_break='stop_first', order_model='market',
+                 entry_zone_atr=(0.25, 0.75), stop_atr=1.5, take_profit_ratios=(1.0, 2.0, 3.0),
+                 tp_fractions=(1 / 3, 1 / 3, 1 / 3), entry_expiry_bars=12, stop_moves=True):
+        """
+        Ladder order model settings (order_model='ladder'):
+        - entry_zone_atr: (near, far) edge of the entry zone in ATRs from the
+          signal close; a limit order at the near edge waits entry_expiry_bars
+        - stop_atr: stop distance beyond the far edge of the zone, in ATRs
+        - take_profit_ratios / tp_fractions: targets in R multiples of the
+          fill-to-stop distance and the share of the position closed at each
+        - stop_moves: move the stop to break-even after TP1 and to the
+          previous target after each later one
+        """
+        if fill_model not in FILL_MODELS:
+            raise ValueError(f"Unknown fill model '{fill_model}', expected one of {FILL_MODELS}")
+        if tie_break not in TIE_BREAKS:
+            raise ValueError(f"Unknown tie break '{tie_break}', expected one of {TIE_BREAKS}")
+        if order_model not in ORDER_MODELS:
+            raise ValueError(f"Unknown order model '{order_model}', expected one of {ORDER_MODELS}")
+        if len(take_profit_ratios) != len(tp_fractions) or not take_profit_ratios:
+            raise ValueError("take_profit_ratios and tp_fractions need one entry per target")
+        self.initial_capital = initial_capital
+        self.risk_per_trade = risk_per_trade
+        self.min_signal_strength = min_signal_strength
+        self.max_positions = max_positions
+        self.trailing_stop_pct = trailing_stop_pct
+        self.take_profit_ratio = take_profit_ratio
+        self.fill_model = fill_model
+        self.tie_break = tie_break
+        self.order_model = order_model
+        self.entry_zone_atr = tuple(entry_zone_atr)
+        self.stop_atr = stop_atr
+        self.take_profit_ratios = tuple(take_profit_ratios)
+        self.tp_fractions = tuple(tp_fractions)
+        self.entry_expiry_bars = entry_expiry_bars
+        self.stop_moves = stop_moves
+
+    @classmethod
+    def from_backtester(cls, backtester):
+        return cls(
+            initial_capital=backtester.initial_capital,
+            risk_per_trade=backtester.risk_per_trade,
+            min_signal_strength=backtester.min_signal_strength,
+            max_positions=backtester.max_positions,
+            trailing_stop_pct=backtester.trailing_stop_pct,
+            take_profit_ratio=backtester.take_profit_ratio,
+            fill_model=getattr(backtester, 'fill_model', 'close'),
+            tie_break=getattr(backtester, 'tie_break', 'stop_first'),
+            **{name: getattr(backtester, name) for name in LADDER_PARAMETERS if hasattr(backtester, name)}
+        )
+
+
+class PositionSlots:
+    """Fixed-capacity open positions stored column-wise"""
+
+    FIELDS = ['active', 'seq', 'direction', 'entry_idx', 'entry_price', 'stop_loss', 'take_profit',
+              'quantity', 'extreme', 'signal_strength', 'exit_idx', 'exit_price', 'exit_reason']
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.active = np.zeros(capacity, dtype=bool)
+        self.seq = np.zeros(capacity, dtype=np.int64)
+        self.direction = np.zeros(capacity, dtype=np.int8)
+        self.entry_idx = np.zeros(capacity, dtype=np.int64)
+        self.entry_price = np.zeros(capacity)
+        self.stop_loss = np.zeros(capacity)
+        self.take_profit = np.zeros(capacity)
+        self.quantity = np.zeros(capacity)
+        self.extreme = np.zeros(capacity)  # highest close for longs, lowest for shorts
+        self.signal_strength = np.zeros(capacity)
+        self.exit_idx = np.zeros(capacity, dtype=np.int64)
+        self.exit_price = np.zeros(capacity)
+        self.exit_reason = np.zeros(capacity, dtype=np.int8)
+
+    @property
+    def count(self):
+        return int(self.active.sum())
+
+    def next_exit(self, default):
+        """Earliest pending exit bar, or `default` when nothing exits inside the data"""
+        return int(np.where(self.active, self.exit_idx, default).min())
+
+    def ordered(self, mask=None):
+        """Active slot ids in the order the positions were opened"""
+        mask = self.active if mask is None else self.active & mask
+        slots = np.flatnonzero(mask)
+        return slots[np.argsort(self.seq[slots], kind='stable')]
+
+    def open(self, seq, direction, entry_idx, entry_price, stop_loss, take_profit, quantity,
+             signal_strength):
+        slot = int(np.flatnonzero(~self.active)[0])
+        self.active[slot] = True
+        self.seq[slot] = seq
+        self.direction[slot] = direction
+        self.entry_idx[slot] = entry_idx
+        self.entry_price[slot] = entry_price
+        self.stop_loss[slot] = stop_loss
+        self.take_profit[slot] = take_profit
+        self.quantity[slot] = quantity
+        self.extreme[slot] = entry_price
+        self.signal_strength[slot] = signal_strength
+        return slot
+
+
+class TradeLedger:
+    """
+    Preallocated, column-wise record of closed trades.
+
+    Appends are O(1) amortized (capacity doubles when full).
+    """
+
+    def __init__(self, capacity=256):
+        self._records = np.zeros(max(int(capacity), 1), dtype=TRADE_DTYPE)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    @classmethod
+    def from_records(cls, records):
+        ledger = cls(len(records))
+        ledger._records[:len(records)] = records
+        ledger.count = len(records)
+        return ledger
+
+    @property
+    def records(self):
+        """View of the filled part of the ledger"""
+        return self._records[:self.count]
+
+    def append(self, seq, direction, entry_idx, exit_idx, entry_price, exit_price, quantity,
+               profit, exit_reason, signal_strength, symbol=0):
+        if self.count == len(self._records):
+            grown = np.zeros(len(self._records) * 2, dtype=TRADE_DTYPE)
+            grown[:self.count] = self._records
+            self._records = grown
+        self._records[self.count] = (seq, direction, entry_idx, exit_idx, entry_price,
+                                     exit_price, quantity, profit, exit_reason, signal_strength,
+                                     symbol)
+        self.count += 1
+
+
+def scan_exit(close, start, direction, stop_loss, take_profit, extreme, trailing_stop_pct):
+    """
+    First bar at or after `start` where a position exits on the close.
+
+    Mirrors the bar loop: the trailing stop ratchets from each new extreme close,
+    then the stop is checked before the target. Scans a growing window with
+    cumulative max/min so the cost is proportional to the holding time.
+
+    Returns (exit_idx, exit_price, reason, extreme, stop_loss); exit_idx is
+    len(close) when the position is still open at the end, with the trailing
+    state carried to the last bar.
+    """
+    n = len(close)
+    window = EXIT_SCAN_WINDOW
+    while start < n:
+        end = min(n, start + window)
+        prices = close[start:end]
+        if direction == LONG:
+            running = np.maximum.accumulate(prices)
+            trail = np.where(running > extreme,
+                             np.maximum(stop_loss, running * (1 - trailing_stop_pct)), stop_loss)
+            hit_stop = prices <= trail
+            hit_target = prices >= take_profit
+        else:
+            running = np.minimum.accumulate(prices)
+            trail = np.where(running < extreme,
+                             np.minimum(stop_loss, running * (1 + trailing_stop_pct)), stop_loss)
+            hit_stop = prices >= trail
+            hit_target = prices <= take_profit
+
+        hit = hit_stop | hit_target
+        if hit.any():
+            j = int(np.argmax(hit))
+            if hit_stop[j]:
+                return start + j, trail[j], STOP_LOSS, running[j], trail[j]
+            return start + j, take_profit, TAKE_PROFIT, running[j], trail[j]
+
+        extreme = max(extreme, running[-1]) if direction == LONG else min(extreme, running[-1])
+        stop_loss = trail[-1]
+        start = end
+        window *= 2
+    return n, np.nan, FINAL_CLOSE, extreme, stop_loss
+
+
+def scan_exit_intrabar(high, low, start, direction, stop_loss, take_profit, extreme,
+                       trailing_stop_pct, tie_break='stop_first'):
+    """
+    First bar at or after `start` whose high/low range touches the stop or target.
+
+    The order of prices inside a bar is unknown, so the trailing stop in force
+    during a bar is ratcheted from the extreme reached through the previous bar.
+    The target's first touch is a searchsorted on the running high (low for
+    shorts); the stop's first touch is the first bar whose low (high) reaches
+    that bar's stop. When one bar touches both, `tie_break` decides.
+
+    Returns (exit_idx, exit_price, reason, extreme, stop_loss) like scan_exit.
+    """
+    n = len(high)
+    window = EXIT_SCAN_WINDOW
+    while start < n:
+        end = min(n, start + window)
+        if direction == LONG:
+            running = np.maximum.accumulate(high[start:end])
+            prior = np.maximum(extreme, np.concatenate([[extreme], running[:-1]]))
+            trail = np.where(prior > extreme,
+                             np.maximum(stop_loss, prior * (1 - trailing_stop_pct)), stop_loss)
+            hit_stop = low[start:end] <= trail
+            target_at = int(np.searchsorted(running, take_profit, side='left'))
+        else:
+            running = np.minimum.accumulate(low[start:end])
+            prior = np.minimum(extreme, np.concatenate([[extreme], running[:-1]]))
+            trail = np.where(prior < extreme,
+                             np.minimum(stop_loss, prior * (1 + trailing_stop_pct)), stop_loss)
+            hit_stop = high[start:end] >= trail
+            # Running low is non-increasing: search the negated (ascending) series
+            target_at = int(np.searchsorted(-running, -take_profit, side='left'))
+
+        stop_at = int(np.argmax(hit_stop)) if hit_stop.any() else end - start
+        if stop_at < end - start or target_at < end - start:
+            if stop_at < target_at or (stop_at == target_at and tie_break == 'stop_first'):
+                return start + stop_at, trail[stop_at], STOP_LOSS, prior[stop_at], trail[stop_at]
+            return start + target_at, take_profit, TAKE_PROFIT, prior[target_at], trail[target_at]
+
+        if direction == LONG:
+            new_extreme = max(extreme, running[-1])
+            if new_extreme > extreme:
+                stop_loss = max(stop_loss, new_extreme * (1 - trailing_stop_pct))
+        else:
+            new_extreme = min(extreme, running[-1])
+            if new_extreme < extreme:
+                stop_loss = min(stop_loss, new_extreme * (1 + trailing_stop_pct))
+        extreme = new_extreme
+        start = end
+        window *= 2
+    return n, np.nan, FINAL_CLOSE, extreme, stop_loss
+
+
+def position_size(capital, entry_price, stop_loss, risk_amount):
+    """Same sizing rule as Backtester.calculate_position_size"""
+    if stop_loss == 0 or entry_price == stop_loss:
+        return 0
+    size = risk_amount / abs(entry_price - stop_loss)
+    max_shares = capital * 0.5 / entry_price
+    return min(size, max_shares)
+
+
+def entry_levels(price, atr, direction, take_profit_ratio):
+    """Initial (stop_loss, take_profit) for an entry: 2 ATR stop, target at take_profit_ratio R"""
+    stop_distance = atr * 2
+    if direction == LONG:
+        return price - stop_distance, price + (stop_distance * take_profit_ratio)
+    return price + stop_distance, price - (stop_distance * take_profit_ratio)
+
+
+def find_exit(params, close, high, low, start, direction, stop_loss, take_profit, extreme):
+    """scan_exit or scan_exit_intrabar, depending on the fill model"""
+    if params.fill_model == 'intrabar':
+        return scan_exit_intrabar(high, low, start, direction, stop_loss, take_profit, extreme,
+                                  params.trailing_stop_pct, params.tie_break)
+    return scan_exit(close, start, direction, stop_loss, take_profit, extreme,
+                     params.trailing_stop_pct)
+
+
+class ArraySimulator:
+    """Event-driven position simulation over precomputed price and signal-strength arrays"""
+
+    def __init__(self, params):
+        self.params = params
+        self.capital = params.initial_capital
+        self.slots = PositionSlots(params.max_positions)
+        self.ledger = TradeLedger()
+        self._seq = 0
+        # Global bar index of the first bar of the arrays being run (chunked runs)
+        self.offset = 0
+
+    def position_size(self, entry_price, stop_loss, risk_amount):
+        return position_size(self.capital, entry_price, stop_loss, risk_amount)
+
+    def _close_slot(self, slot, exit_idx, exit_price, reason):
+        s = self.slots
+        if s.direction[slot] == LONG:
+            profit = (exit_price - s.entry_price[slot]) * s.quantity[slot]
+        else:
+            profit = (s.entry_price[slot] - exit_price) * s.quantity[slot]
+        self.capital += profit
+        self.ledger.append(s.seq[slot], s.direction[slot], s.entry_idx[slot], self.offset + exit_idx,
+                           s.entry_price[slot], exit_price, s.quantity[slot], profit, reason,
+                           s.signal_strength[slot])
+        s.active[slot] = False
+
+    def _try_entry(self, t, close, atr, direction, strength, high=None, low=None):
+        p = self.params
+        price = close[t]
+        risk_amount = self.capital * p.risk_per_trade
+        stop_loss, take_profit = entry_levels(price, atr[t], direction, p.take_profit_ratio)
+
+        quantity = self.position_size(price, stop_loss, risk_amount)
+        if not quantity > 0:
+            return
+
+        self._seq += 1
+        slot = self.slots.open(self._seq, direction, self.offset + t, price, stop_loss, take_profit,
+                               quantity, strength)
+        exit_idx, exit_price, reason, extreme, stop = find_exit(
+            p, close, high, low, t + 1, direction, stop_loss, take_profit, price)
+        s = self.slots
+        s.exit_idx[slot], s.exit_price[slot], s.exit_reason[slot] = exit_idx, exit_price, reason
+        s.extreme[slot], s.stop_loss[slot] = extreme, stop
+
+    def run(self, close, atr, buy_strength, sell_strength, high=None, low=None, progress=None,
+            offset=0, final=True):
+        """
+        Simulate all bars. Returns the per-bar equity array; closed trades are in
+        self.ledger, including final closes at the last bar.
+
+        high/low are required by the 'intrabar' fill model. Entries and the
+        equity curve always use the close.
+        progress: optional callable(bars_processed, total_bars, trades), called
+        at most every PROGRESS_INTERVAL seconds; it may raise to abort the run.
+
+        Chunked runs call run once per consecutive chunk of bars: offset is the
+        global index of the chunk's first bar (ledger indexes are global) and
+        final=False keeps positions open at the end of the chunk, with their
+        trailing-stop state, for the next call instead of closing them.
+        """
+        p = self.params
+        n = len(close)
+        if p.fill_model == 'intrabar' and (high is None or low is None):
+            raise ValueError("The intrabar fill model needs high and low arrays")
+        self.offset = offset
+        closed_before = len(self.ledger)
+        start_capital = self.capital
+        s = self.slots
+        # Positions carried over from the previous chunk continue their exit scan
+        for slot in s.ordered():
+            s.exit_idx[slot], s.exit_price[slot], s.exit_reason[slot], s.extreme[slot], s.stop_loss[slot] = \
+                find_exit(p, close, high, low, 0, s.direction[slot], s.stop_loss[slot],
+                          s.take_profit[slot], s.extreme[slot])
+        candidates = np.flatnonzero((buy_strength >= p.min_signal_strength) |
+                                    (sell_strength >= p.min_signal_strength))
+        ci = 0
+        next_report = time.monotonic() + PROGRESS_INTERVAL
+
+        while True:
+            next_candidate = candidates[ci] if ci < len(candidates) else n
+            next_exit = self.slots.next_exit(n)
+            t = min(next_candidate, next_exit)
+            if t >= n:
+                break
+            if progress is not None and time.monotonic() >= next_report:
+                progress(int(t), n, len(self.ledger))
+                next_report = time.monotonic() + PROGRESS_INTERVAL
+
+            if next_exit == t:
+                for slot in self.slots.ordered(self.slots.exit_idx == t):
+                    self._close_slot(slot, t, self.slots.exit_price[slot],
+                                     int(self.slots.exit_reason[slot]))
+
+            if next_candidate == t:
+                ci += 1
+                if self.slots.count < p.max_positions:
+                    if buy_strength[t] >= p.min_signal_strength:
+                        self._try_entry(t, close, atr, LONG, buy_strength[t], high, low)
+                    elif sell_strength[t] >= p.min_signal_strength:
+                        self._try_entry(t, close, atr, SHORT, sell_strength[t], high, low)
+                if self.slots.count >= p.max_positions:
+                    # No entries possible until a slot frees up
+                    ci = max(ci, int(np.searchsorted(candidates, self.slots.next_exit(n), side='left')))
+
+        closed_in_loop = len(self.ledger)
+        equity = self.equity_curve(close, closed_in_loop, closed_before, start_capital)
+
+        # Close any remaining positions at the end
+        if final:
+            self.close_open_positions(n - 1, close[n - 1])
+        if progress is not None:
+            progress(n, n, len(self.ledger))
+        return equity
+
+    def state(self):
+        """
+        (arrays, scalars) with everything needed to continue the simulation
+        later: position slots, ledger, capital and counters (see restore).
+        """
+        s = self.slots
+        arrays = {f'slot_{name}': getattr(s, name) for name in PositionSlots.FIELDS}
+        arrays['ledger'] = self.ledger.records
+        scalars = {'capital': self.capital, 'seq': self._seq, 'offset': self.offset}
+        return arrays, scalars
+
+    def restore(self, arrays, scalars):
+        """Continue from a state() snapshot; later runs give the same results as without the break"""
+        for name in PositionSlots.FIELDS:
+            getattr(self.slots, name)[:] = arrays[f'slot_{name}']
+        self.ledger = TradeLedger.from_records(arrays['ledger'])
+        self.capital = scalars['capital']
+        self._seq = scalars['seq']
+        self.offset = scalars['offset']
+        return self
+
+    def close_open_positions(self, exit_idx, price):
+        """Final-close every open position at bar exit_idx of the current arrays"""
+        for slot in self.slots.ordered():
+            self._close_slot(slot, exit_idx, price, FINAL_CLOSE)
+
+    def equity_curve(self, close, closed_count, closed_from=0, start_capital=None):
+        """
+        Per-bar equity = capital after realized trades + unrealized PnL of open positions.
+        closed_from/start_capital: first ledger record and capital of the current chunk.
+        """
+        n = len(close)
+        closed = self.ledger.records[closed_from:closed_count]
+        s = self.slots
+        open_slots = s.ordered()
+
+        # Chunk-local bars; positions opened in an earlier chunk count from bar 0
+        unrealized = unrealized_pnl(
+            close,
+            np.maximum(np.concatenate([closed['entry_idx'], s.entry_idx[open_slots]]) - self.offset, 0),
+            np.concatenate([closed['exit_idx'] - self.offset, np.full(len(open_slots), n, dtype=np.int64)]),
+            np.concatenate([closed['direction'], s.direction[open_slots]]),
+            np.concatenate([closed['quantity'], s.quantity[open_slots]]),
+            np.concatenate([closed['entry_price'], s.entry_price[open_slots]])
+        )
+        if start_capital is None:
+            start_capital = self.params.initial_capital
+        capital_after = np.cumsum(np.concatenate([[start_capital], closed['profit']]))
+        closed_by_bar = np.searchsorted(closed['exit_idx'] - self.offset, np.arange(n), side='right')
+        return capital_after[closed_by_bar] + unrealized
+
+
+
+def first_touch(high, low, direction, stop_loss, take_profit, target_from, stop_from,
+                tie_break='stop_first'):
+    """
+    First bar whose high/low range touches a fixed stop (checked from bar
+    stop_from) or target (checked from bar target_from).
+
+    Returns (idx, price, reason); idx is len(high) when neither is touched.
+    """
+    n = len(high)
+    window = EXIT_SCAN_WINDOW
+    start = min(target_from, stop_from)
+    while start < n:
+        end = min(n, start + window)
+        bars = np.arange(start, end)
+        if direction == LONG:
+            hit_stop = (low[start:end] <= stop_loss) & (bars >= stop_from)
+            hit_target = (high[start:end] >= take_profit) & (bars >= target_from)
+        else:
+            hit_stop = (high[start:end] >= stop_loss) & (bars >= stop_from)
+            hit_target = (low[start:end] <= take_profit) & (bars >= target_from)
+
+        stop_at = int(np.argmax(hit_stop)) if hit_stop.any() else end - start
+        target_at = int(np.argmax(hit_target)) if hit_target.any() else end - start
+        if stop_at < end - start or target_at < end - start:
+            if stop_at < target_at or (stop_at == target_at and tie_break == 'stop_first'):
+                return start + stop_at, stop_loss, STOP_LOSS
+            return start + target_at, take_profit, TAKE_PROFIT
+        start = end
+        window *= 2
+    return n, np.nan, FINAL_CLOSE
+
+
+def ladder_levels(price, atr, direction, params):
+    """(limit, stop_loss, targets) of a ladder order placed at a signal close"""
+    near, far = params.entry_zone_atr
+    limit = price - direction * near * atr
+    stop_loss = price - direction * (far + params.stop_atr) * atr
+    risk = abs(limit - stop_loss)
+    targets = [limit + direction * ratio * risk for ratio in params.take_profit_ratios]
+    return limit, stop_loss, targets
+
+
+def limit_fill(high, low, start, end, direction, limit):
+    """First bar in [start, end) trading through a resting limit order, or None"""
+    touched = low[start:end] <= limit if direction == LONG else high[start:end] >= limit
+    return start + int(np.argmax(touched)) if touched.any() else None
+
+
+def ladder_exits(high, low, fill_idx, direction, entry_price, stop_loss, targets, quantity,
+                 fractions, tie_break='stop_first', stop_moves=True):
+    """
+    Exit legs of a filled ladder position, as an EXIT_DTYPE array in bar order.
+
+    Each target closes its fraction of the entry quantity (the last one the
+    remainder); a stop closes whatever is left. The fill bar can only stop
+    out; targets count from the next bar. After a target is hit the stop moves
+    to break-even (after TP1) or the previous target, checked from the next
+    bar, while further targets may still fill on the same bar. Legs past the
+    end of the data are left out: that quantity is still open.
+    """
+    legs = []
+    remaining = quantity
+    target_from, stop_from = fill_idx + 1, fill_idx
+    for k, (target, fraction) in enumerate(zip(targets, fractions)):
+        idx, price, reason = first_touch(high, low, direction, stop_loss, target, target_from,
+                                         stop_from, tie_break)
+        if idx >= len(high):
+            break
+        if reason == STOP_LOSS:
+            legs.append((idx, price, remaining, STOP_LOSS))
+            break
+        leg_quantity = remaining if k == len(targets) - 1 else min(quantity * fraction, remaining)
+        legs.append((idx, price, leg_quantity, TAKE_PROFIT))
+        remaining -= leg_quantity
+        if stop_moves:
+            stop_loss = entry_price if k == 0 else targets[k - 1]
+        target_from, stop_from = idx, idx + 1
+    return np.array(legs, dtype=EXIT_DTYPE)
+
+
+class LadderSimulator(ArraySimulator):
+    """
+    ArraySimulator with AISignals-style orders (order_model='ladder').
+
+    A signal places a limit order at the near edge of its entry zone; it fills
+    at the limit price on the first bar within entry_expiry_bars that trades
+    through it, or is cancelled without a trade. A pending order holds a
+    position slot. The filled position exits in legs at the take-profit
+    ladder with stop moves (ladder_exits); every leg is its own ledger record
+    with the position's seq, and a final close books what is left.
+
+    Fills and exits always use high/low; the trailing stop is not used.
+    Sizing uses the capital when the order is placed.
+    """
+
+    def __init__(self, params):
+        super().__init__(params)
+        capacity = len(self.slots.active)
+        self.filled = np.zeros(capacity, dtype=bool)
+        self.legs = [np.zeros(0, dtype=EXIT_DTYPE)] * capacity
+        self.next_leg = np.zeros(capacity, dtype=np.int64)
+        self.bars = 0
+
+    def run(self, close, atr, buy_strength, sell_strength, high=None, low=None, progress=None,
+            offset=0, final=True):
+        if high is None or low is None:
+            raise ValueError("The ladder order model needs high and low arrays")
+        if offset or not final:
+            raise ValueError("The ladder order model does not support chunked runs")
+        self.bars = len(close)
+        return super().run(close, atr, buy_strength, sell_strength, high, low, progress, offset, final)
+
+    def _try_entry(self, t, close, atr, direction, strength, high=None, low=None):
+        p = self.params
+        n = len(close)
+        limit, stop_loss, targets = ladder_levels(close[t], atr[t], direction, p)
+        quantity = self.position_size(limit, stop_loss, self.capital * p.risk_per_trade)
+        if not quantity > 0:
+            return
+
+        expiry = t + p.entry_expiry_bars
+        fill_idx = limit_fill(high, low, t + 1, min(expiry + 1, n), direction, limit)
+        self._seq += 1
+        s = self.slots
+        slot = self.slots.open(self._seq, direction, n if fill_idx is None else fill_idx, limit,
+                               stop_loss, targets[0], quantity, strength)
+        self.filled[slot] = fill_idx is not None
+        self.next_leg[slot] = 0
+        if fill_idx is None:
+            # Cancelled after its last bar; the slot frees up for signals on that bar
+            self.legs[slot] = np.zeros(0, dtype=EXIT_DTYPE)
+            s.exit_idx[slot], s.exit_price[slot], s.exit_reason[slot] = min(expiry, n), np.nan, FINAL_CLOSE
+            return
+
+        self.legs[slot] = ladder_exits(high, low, fill_idx, direction, limit, stop_loss, targets,
+                                       quantity, p.tp_fractions, p.tie_break, p.stop_moves)
+        self._schedule(slot)
+
+    def _schedule(self, slot):
+        """Point the slot's pending exit at its next leg (the bar count when none is left in the data)"""
+        s = self.slots
+        n = self.bars
+        legs = self.legs[slot]
+        if self.next_leg[slot] < len(legs):
+            leg = legs[self.next_leg[slot]]
+            s.exit_idx[slot], s.exit_price[slot], s.exit_reason[slot] = leg['idx'], leg['price'], leg['reason']
+        else:
+            s.exit_idx[slot], s.exit_price[slot], s.exit_reason[slot] = n, np.nan, FINAL_CLOSE
+
+    def _book(self, slot, exit_idx, exit_price, quantity, reason):
+        s = self.slots
+        direction = s.direction[slot]
+        profit = direction * (exit_price - s.entry_price[slot]) * quantity
+        self.capital += profit
+        self.ledger.append(s.seq[slot], direction, s.entry_idx[slot], self.offset + exit_idx,
+                           s.entry_price[slot], exit_price, quantity, profit, reason,
+                           s.signal_strength[slot])
+        s.quantity[slot] -= quantity
+
+    def _close_slot(self, slot, exit_idx, exit_price, reason):
+        s = self.slots
+        if not self.filled[slot]:
+            # Expired (or still pending at the end): no trade
+            s.active[slot] = False
+            return
+        if reason == FINAL_CLOSE:
+            self._book(slot, exit_idx, exit_price, s.quantity[slot], FINAL_CLOSE)
+            s.active[slot] = False
+        else:
+            legs = self.legs[slot]
+            while self.next_leg[slot] < len(legs) and legs[self.next_leg[slot]]['idx'] == exit_idx:
+                leg = legs[self.next_leg[slot]]
+                self._book(slot, exit_idx, leg['price'], leg['quantity'], int(leg['reason']))
+                self.next_leg[slot] += 1
+            if leg['reason'] == STOP_LOSS or self.next_leg[slot] == len(self.params.take_profit_ratios):
+                s.quantity[slot] = 0.0
+                s.active[slot] = False
+            else:
+                self._schedule(slot)
+
+
+def make_simulator(params):
+    """Simulator for the params' order model"""
+    if params.order_model == 'ladder':
+        return LadderSimulator(params)
+    return ArraySimulator(params)
+
+def unrealized_pnl(close, entries, exits, direction, quantity, entry_price):
+    """
+    Per-bar unrealized PnL of positions held on bars [entry, exit).
+
+    Built from step functions instead of a per-bar loop: each position adds
+    its signed quantity and entry cost from its entry bar until its exit bar,
+    so the open book at every bar is a cumulative sum over trade events.
+    """
+    n = len(close)
+    quantity = np.asarray(direction, dtype=float) * quantity
+    cost = quantity * entry_price
+
+    open_quantity = np.zeros(n + 1)
+    open_cost = np.zeros(n + 1)
+    open_count = np.zeros(n + 1, dtype=np.int64)
+    np.add.at(open_quantity, entries, quantity)
+    np.add.at(open_quantity, exits, -quantity)
+    np.add.at(open_cost, entries, cost)
+    np.add.at(open_cost, exits, -cost)
+    np.add.at(open_count, entries, 1)
+    np.add.at(open_count, exits, -1)
+    flat = np.cumsum(open_count)[:n] == 0
+    return np.where(flat, 0.0, close * np.cumsum(open_quantity)[:n] - np.cumsum(open_cost)[:n])
+
+
+class PortfolioSimulator:
+    """
+    Event-driven simulation of several symbols against one capital pool.
+
+    Every symbol keeps its own price and signal-strength arrays; their bars are
+    placed on a common timeline (the sorted union of all bar times) and entry
+    candidates and exits of all symbols are processed in time order. Position
+    sizing uses the shared capital and max_positions is a global limit.
+    Ledger indexes refer to the common timeline.
+    """
+
+    def __init__(self, params, max_positions_per_symbol=None):
+        self.params = params
+        self.max_positions_per_symbol = max_positions_per_symbol or params.max_positions
+        self.capital = params.initial_capital
+        self.slots = PositionSlots(params.max_positions)
+        self.slot_symbol = np.zeros(params.max_positions, dtype=np.int64)
+        self.ledger = TradeLedger()
+        self.times = None
+        self._seq = 0
+
+    def _close_slot(self, slot, exit_idx, exit_price, reason):
+        s = self.slots
+        if s.direction[slot] == LONG:
+            profit = (exit_price - s.entry_price[slot]) * s.quantity[slot]
+        else:
+            profit = (s.entry_price[slot] - exit_price) * s.quantity[slot]
+        self.capital += profit
+        self.ledger.append(s.seq[slot], s.direction[slot], s.entry_idx[slot], exit_idx,
+                           s.entry_price[slot], exit_price, s.quantity[slot], profit, reason,
+                           s.signal_strength[slot], self.slot_symbol[slot])
+        s.active[slot] = False
+
+    def _close_due(self, t, final):
+        s = self.slots
+        due = (s.exit_idx == t) & ((s.exit_reason == FINAL_CLOSE) == final)
+        for slot in s.ordered(due):
+            self._close_slot(slot, t, s.exit_price[slot], int(s.exit_reason[slot]))
+
+    def _try_entry(self, symbol, local, arrays, timeline_idx, direction, strength):
+        p = self.params
+        close = arrays['close']
+        price = close[local]
+        stop_loss, take_profit = entry_levels(price, arrays['atr'][local], direction,
+                                              p.take_profit_ratio)
+        quantity = position_size(self.capital, price, stop_loss, self.capital * p.risk_per_trade)
+        if not quantity > 0:
+            return
+
+        self._seq += 1
+        t = timeline_idx[local]
+        slot = self.slots.open(self._seq, direction, t, price, stop_loss, take_profit,
+                               quantity, strength)
+        self.slot_symbol[slot] = symbol
+        exit_local, exit_price, reason, _, _ = find_exit(
+            p, close, arrays.get('high'), arrays.get('low'), local + 1, direction,
+            stop_loss, take_profit, price)
+        if exit_local >= len(close):
+            # Still open at the symbol's last bar
+            exit_local, exit_price, reason = len(close) - 1, close[-1], FINAL_CLOSE
+        s = self.slots
+        s.exit_idx[slot], s.exit_price[slot], s.exit_reason[slot] = timeline_idx[exit_local], exit_price, reason
+
+    def run(self, symbol_arrays):
+        """
+        symbol_arrays: one dict per symbol with the ArraySimulator.run inputs plus
+        'times' (int64 bar times, ascending). Returns the equity on the common
+        timeline, available as self.times.
+        """
+        p = self.params
+        if p.fill_model == 'intrabar' and any('high' not in a or 'low' not in a for a in symbol_arrays):
+            raise ValueError("The intrabar fill model needs high and low arrays")
+        self.times = np.unique(np.concatenate([a['times'] for a in symbol_arrays]))
+        n = len(self.times)
+        timeline = [np.searchsorted(self.times, a['times']) for a in symbol_arrays]
+
+        # Merged entry candidates: time order, then strongest signal, then symbol order
+        cand_t, cand_symbol, cand_local, cand_direction, cand_strength = [], [], [], [], []
+        for k, a in enumerate(symbol_arrays):
+            buy = a['buy_strength'] >= p.min_signal_strength
+            sell = a['sell_strength'] >= p.min_signal_strength
+            local = np.flatnonzero(buy | sell)
+            cand_t.append(timeline[k][local])
+            cand_symbol.append(np.full(len(local), k))
+            cand_local.append(local)
+            cand_direction.append(np.where(buy[local], LONG, SHORT))
+            cand_strength.append(np.where(buy[local], a['buy_strength'][local], a['sell_strength'][local]))
+        cand_t, cand_symbol, cand_local, cand_direction, cand_strength = (
+            np.concatenate(c) for c in (cand_t, cand_symbol, cand_local, cand_direction, cand_strength))
+        order = np.lexsort((cand_symbol, -cand_strength, cand_t))
+        cand_t, cand_symbol, cand_local, cand_direction, cand_strength = (
+            c[order] for c in (cand_t, cand_symbol, cand_local, cand_direction, cand_strength))
+
+        ci = 0
+        while True:
+            next_candidate = cand_t[ci] if ci < len(cand_t) else n
+            t = min(next_candidate, self.slots.next_exit(n))
+            if t >= n:
+                break
+
+            self._close_due(t, final=False)
+            while ci < len(cand_t) and cand_t[ci] == t:
+                k = cand_symbol[ci]
+                if self.slots.count < p.max_positions and \
+                        np.sum(self.slots.active & (self.slot_symbol == k)) < self.max_positions_per_symbol:
+                    self._try_entry(k, cand_local[ci], symbol_arrays[k], timeline[k],
+                                    cand_direction[ci], cand_strength[ci])
+                ci += 1
+            # Positions still open at a symbol's last bar close after that bar's entries
+            self._close_due(t, final=True)
+
+            if self.slots.count >= p.max_positions:
+                # No entries possible until a slot frees up
+                ci = max(ci, int(np.searchsorted(cand_t, self.slots.next_exit(n), side='left')))
+
+        return self.equity_curve(symbol_arrays, timeline)
+
+    def equity_curve(self, symbol_arrays, timeline):
+        """Equity on the common timeline, marking each symbol at its last known close"""
+        n = len(self.times)
+        records = self.ledger.records
+        unrealized = np.zeros(n)
+        for k, a in enumerate(symbol_arrays):
+            mine = records[records['symbol'] == k]
+            if len(mine) == 0:
+                continue
+            last_bar = np.maximum(np.searchsorted(timeline[k], np.arange(n), side='right') - 1, 0)
+            unrealized += unrealized_pnl(a['close'][last_bar], mine['entry_idx'], mine['exit_idx'],
+                                         mine['direction'], mine['quantity'], mine['entry_price'])
+        capital_after = np.cumsum(np.concatenate([[self.params.initial_capital], records['profit']]))
+        closed_by_bar = np.searchsorted(records['exit_idx'], np.arange(n), side='right')
+        return capital_after[closed_by_bar] + unrealized
@@ -1,20 +1,93 @@
 # strategies.py - Advanced Multi-Indicator Trading Strategies
+import re
 import pandas as pd
 import numpy as np
+from strategy_expressions import ExpressionError, compile_expression
+
+# Overall consensus label for each signal_code in calculate_consensus_series
+CONSENSUS_LABELS = {
+    2: "STRONG BUY",
+    1: "BUY",
+    0: "NEUTRAL",
+    -1: "SELL",
+    -2: "STRONG SELL"
+}
+
+CONSENSUS_SERIES_COLUMNS = [
+    'buy_count', 'sell_count', 'buy_percentage', 'sell_percentage',
+    'neutral_percentage', 'signal_code'
+]
+
+class StrategyExpressions:
+    """Memoized shift/crossover primitives shared by all strategies in one run.
+
+    Operands are indicator column names or scalar thresholds; results are cached
+    per instance so an expression such as ``macd.shift(1)`` or a MACD/signal
+    crossover is only built once no matter how many strategies use it.
+    """
+
+    def __init__(self, indicators):
+        self.indicators = indicators
+        self._cache = {}
+
+    def _operand(self, x):
+        if isinstance(x, str):
+            return self.indicators[x]
+        return x
+
+    def _memo(self, key, build):
+        if key not in self._cache:
+            self._cache[key] = build()
+        return self._cache[key]
+
+    def shifted(self, x, n=1):
+        """``x`` shifted forward by ``n`` bars (scalars pass through unchanged)"""
+        if not isinstance(x, str):
+            return x
+        return self._memo(('shift', x, n), lambda: self.indicators[x].shift(n))
+
+    def rising(self, x, n=1):
+        """``x`` is above its value ``n`` bars ago"""
+        return self._memo(('rising', x, n), lambda: self._operand(x) > self.shifted(x, n))
+
+    def falling(self, x, n=1):
+        """``x`` is below its value ``n`` bars ago"""
+        return self._memo(('falling', x, n), lambda: self._operand(x) < self.shifted(x, n))
+
+    def cross_above(self, a, b):
+        """``a`` closes above ``b`` after being at or below it on the previous bar"""
+        return self._memo(('cross_above', a, b), lambda: (self._operand(a) > self._operand(b)) &
+                          (self.shifted(a, 1) <= self.shifted(b, 1)))
+
+    def cross_below(self, a, b):
+        """``a`` closes below ``b`` after being at or above it on the previous bar"""
+        return self._memo(('cross_below', a, b), lambda: (self._operand(a) < self._operand(b)) &
+                          (self.shifted(a, 1) >= self.shifted(b, 1)))
+
+    def rolling_mean(self, x, window):
+        """Rolling mean of column ``x`` over ``window`` bars"""
+        return self._memo(('rolling_mean', x, window), lambda: self.indicators[x].rolling(window).mean())
+
+    def clear(self):
+        """Drop all memoized expressions"""
+        self._cache.clear()
+
+CUSTOM_STRATEGY_NAME = re.compile(r'^[a-z][a-z0-9_]{0,31}$')
 
 class TradingStrategies:
-    def __init__(self, df, indicators_df):
+    def __init__(self, df, indicators_df, custom_strategies=None):
         self.df = df.copy()
         self.indicators = indicators_df.copy()
         self.signals = pd.DataFrame(index=self.indicators.index)
+        self.expr = StrategyExpressions(self.indicators)
+        # [{'name': ..., 'buy': expression, 'sell': expression (optional)}]
+        self.custom_strategies = custom_strategies or []
 
     def scalping_ema_strategy(self):
         """High-frequency EMA crossover strategy for more trades"""
         # Fast EMA crossovers for more signals
-        ema_5_8_bull = (self.indicators['ema_5'] > self.indicators['ema_8']) & \
-                       (self.indicators['ema_5'].shift(1) <= self.indicators['ema_8'].shift(1))
-        ema_5_8_bear = (self.indicators['ema_5'] < self.indicators['ema_8']) & \
-                       (self.indicators['ema_5'].shift(1) >= self.indicators['ema_8'].shift(1))
+        ema_5_8_bull = self.expr.cross_above('ema_5', 'ema_8')
+        ema_5_8_bear = self.expr.cross_below('ema_5', 'ema_8')
         
         # Trend filter using longer EMA
         uptrend = self.indicators['ema_21'] > self.indicators['ema_50']
@@ -45,13 +118,13 @@ class TradingStrategies:
         
         # Multiple RSI levels for more opportunities
         rsi_oversold_30 = rsi < 30
-        rsi_oversold_35 = (rsi >= 30) & (rsi < 35) & (rsi.shift(1) < 30)
+        rsi_oversold_35 = (rsi >= 30) & (rsi < 35) & (self.expr.shifted('rsi_14', 1) < 30)
         rsi_overbought_70 = rsi > 70
-        rsi_overbought_65 = (rsi <= 70) & (rsi > 65) & (rsi.shift(1) > 70)
+        rsi_overbought_65 = (rsi <= 70) & (rsi > 65) & (self.expr.shifted('rsi_14', 1) > 70)
         
         # RSI momentum
-        rsi_rising = rsi > rsi.shift(1)
-        rsi_falling = rsi < rsi.shift(1)
+        rsi_rising = self.expr.rising('rsi_14')
+        rsi_falling = self.expr.falling('rsi_14')
         
         # Support/resistance confirmation
         near_support = abs(self.indicators['close'] - self.indicators['support']) / self.indicators['close'] < 0.02
@@ -124,8 +197,8 @@ class TradingStrategies:
         close = self.indicators['close']
         
         # Stochastic crossovers
-        stoch_bull_cross = (stoch_k > stoch_d) & (stoch_k.shift(1) <= stoch_d.shift(1))
-        stoch_bear_cross = (stoch_k < stoch_d) & (stoch_k.shift(1) >= stoch_d.shift(1))
+        stoch_bull_cross = self.expr.cross_above('stoch_k', 'stoch_d')
+        stoch_bear_cross = self.expr.cross_below('stoch_k', 'stoch_d')
         
         # Stochastic levels
         stoch_oversold = (stoch_k < 25) & (stoch_d < 25)
@@ -134,10 +207,10 @@ class TradingStrategies:
         stoch_mid_bear = (stoch_k > 40) & (stoch_k < 60) & stoch_bear_cross
         
         # Simple divergence approximation
-        price_higher = close > close.shift(5)
-        price_lower = close < close.shift(5)
-        stoch_lower = stoch_k < stoch_k.shift(5)
-        stoch_higher = stoch_k > stoch_k.shift(5)
+        price_higher = self.expr.rising('close', 5)
+        price_lower = self.expr.falling('close', 5)
+        stoch_lower = self.expr.falling('stoch_k', 5)
+        stoch_higher = self.expr.rising('stoch_k', 5)
         
         bullish_divergence = price_lower & stoch_higher & stoch_oversold
         bearish_divergence = price_higher & stoch_lower & stoch_overbought
@@ -179,8 +252,8 @@ class TradingStrategies:
         multi_overbought = (rsi_14 > 65) | ((rsi_14 > 60) & (rsi_21 > 60))
         
         # RSI momentum
-        rsi_14_rising = rsi_14 > rsi_14.shift(1)
-        rsi_14_falling = rsi_14 < rsi_14.shift(1)
+        rsi_14_rising = self.expr.rising('rsi_14')
+        rsi_14_falling = self.expr.falling('rsi_14')
         
         # Price action confirmation
         price_above_ema8 = self.indicators['close'] > self.indicators['ema_8']
@@ -190,10 +263,10 @@ class TradingStrategies:
         volume_ok = self.indicators['volume_momentum'] > 0.9
         
         buy_signal = ((multi_oversold & rsi_14_rising & price_above_ema8) | 
-                     (all_rsi_bullish & price_above_ema8 & (rsi_14 > rsi_14.shift(2)))) & volume_ok
+                     (all_rsi_bullish & price_above_ema8 & self.expr.rising('rsi_14', 2))) & volume_ok
         
         sell_signal = ((multi_overbought & rsi_14_falling & price_below_ema8) | 
-                      (all_rsi_bearish & price_below_ema8 & (rsi_14 < rsi_14.shift(2)))) & volume_ok
+                      (all_rsi_bearish & price_below_ema8 & self.expr.falling('rsi_14', 2))) & volume_ok
         
         self.signals['multi_rsi_buy'] = buy_signal
         self.signals['multi_rsi_sell'] = sell_signal
@@ -208,7 +281,6 @@ class TradingStrategies:
     def williams_r_pullback_strategy(self):
         """Williams %R pullback strategy for trend continuation"""
         wr = self.indicators['williams_r']
-        close = self.indicators['close']
         
         # Trend identification
         uptrend = (self.indicators['ema_21'] > self.indicators['ema_50']) & \
@@ -217,12 +289,12 @@ class TradingStrategies:
                    (self.indicators['close'] < self.indicators['ema_21'])
         
         # Williams %R pullback signals
-        wr_pullback_buy = (wr < -50) & (wr > -85) & (wr > wr.shift(1)) & uptrend
-        wr_pullback_sell = (wr > -50) & (wr < -15) & (wr < wr.shift(1)) & downtrend
+        wr_pullback_buy = (wr < -50) & (wr > -85) & self.expr.rising('williams_r') & uptrend
+        wr_pullback_sell = (wr > -50) & (wr < -15) & self.expr.falling('williams_r') & downtrend
         
         # Additional Williams %R patterns
-        wr_oversold_exit = (wr > -80) & (wr.shift(1) <= -80) & uptrend
-        wr_overbought_exit = (wr < -20) & (wr.shift(1) >= -20) & downtrend
+        wr_oversold_exit = self.expr.cross_above('williams_r', -80) & uptrend
+        wr_overbought_exit = self.expr.cross_below('williams_r', -20) & downtrend
         
         # CCI confirmation
         cci_neutral = (self.indicators['cci'] > -150) & (self.indicators['cci'] < 150)
@@ -256,16 +328,16 @@ class TradingStrategies:
         bb_position = (close - bb_lower) / (bb_upper - bb_lower)
         
         # Squeeze detection
-        bb_squeeze = bb_width < bb_width.rolling(20).mean() * 0.8
-        bb_expansion = bb_width > bb_width.shift(1) * 1.1
+        bb_squeeze = bb_width < self.expr.rolling_mean('bb_width_20', 20) * 0.8
+        bb_expansion = bb_width > self.expr.shifted('bb_width_20', 1) * 1.1
         
         # Mean reversion signals
         bb_oversold = bb_position < 0.1
         bb_overbought = bb_position > 0.9
         
         # Trend following signals
-        bb_uptrend = (close > bb_middle) & (bb_middle > bb_middle.shift(5))
-        bb_downtrend = (close < bb_middle) & (bb_middle < bb_middle.shift(5))
+        bb_uptrend = (close > bb_middle) & self.expr.rising('bb_middle_20', 5)
+        bb_downtrend = (close < bb_middle) & self.expr.falling('bb_middle_20', 5)
         
         # Volume confirmation
         volume_confirm = self.indicators['volume_momentum'] > 1.1
@@ -274,10 +346,10 @@ class TradingStrategies:
         rsi_not_extreme = (self.indicators['rsi_14'] > 25) & (self.indicators['rsi_14'] < 75)
         
         # Combined signals
-        buy_signal = ((bb_oversold & (close > close.shift(1))) |  # Mean reversion
+        buy_signal = ((bb_oversold & self.expr.rising('close')) |  # Mean reversion
                      (bb_squeeze & bb_expansion & bb_uptrend & volume_confirm)) & rsi_not_extreme  # Breakout
         
-        sell_signal = ((bb_overbought & (close < close.shift(1))) |  # Mean reversion
+        sell_signal = ((bb_overbought & self.expr.falling('close')) |  # Mean reversion
                       (bb_squeeze & bb_expansion & bb_downtrend & volume_confirm)) & rsi_not_extreme  # Breakdown
         
         self.signals['adaptive_bb_buy'] = buy_signal
@@ -293,20 +365,19 @@ class TradingStrategies:
     def macd_histogram_strategy(self):
         """MACD histogram momentum strategy"""
         macd = self.indicators['macd']
-        macd_signal = self.indicators['macd_signal']
         macd_histogram = self.indicators['macd_diff']
         
         # MACD histogram momentum
-        histogram_rising = macd_histogram > macd_histogram.shift(1)
-        histogram_falling = macd_histogram < macd_histogram.shift(1)
+        histogram_rising = self.expr.rising('macd_diff')
+        histogram_falling = self.expr.falling('macd_diff')
         
         # MACD line momentum
-        macd_rising = macd > macd.shift(1)
-        macd_falling = macd < macd.shift(1)
+        macd_rising = self.expr.rising('macd')
+        macd_falling = self.expr.falling('macd')
         
         # MACD crossovers
-        macd_bull_cross = (macd > macd_signal) & (macd.shift(1) <= macd_signal.shift(1))
-        macd_bear_cross = (macd < macd_signal) & (macd.shift(1) >= macd_signal.shift(1))
+        macd_bull_cross = self.expr.cross_above('macd', 'macd_signal')
+        macd_bear_cross = self.expr.cross_below('macd', 'macd_signal')
         
         # Zero line crosses
         macd_above_zero = macd > 0
@@ -353,16 +424,16 @@ class TradingStrategies:
         strong_red_candle = (self.indicators['open'] - close) / close > 0.01
         
         # OBV momentum
-        obv_rising = self.indicators['obv'] > self.indicators['obv'].shift(3)
-        obv_falling = self.indicators['obv'] < self.indicators['obv'].shift(3)
+        obv_rising = self.expr.rising('obv', 3)
+        obv_falling = self.expr.falling('obv', 3)
         
         # CMF (Chaikin Money Flow)
         cmf_bullish = self.indicators['cmf'] > 0.1
         cmf_bearish = self.indicators['cmf'] < -0.1
         
         # Price vs Volume analysis
-        price_up_volume_up = (close > close.shift(1)) & (volume_momentum > 1.2)
-        price_down_volume_up = (close < close.shift(1)) & (volume_momentum > 1.2)
+        price_up_volume_up = self.expr.rising('close') & (volume_momentum > 1.2)
+        price_down_volume_up = self.expr.falling('close') & (volume_momentum > 1.2)
         
         # Support/Resistance with volume
         near_support_volume = (abs(close - self.indicators['support']) / close < 0.015) & volume_high
@@ -389,10 +460,8 @@ class TradingStrategies:
     def macd_rsi_strategy(self):
         """MACD + RSI Crossover Strategy"""
         # MACD signals
-        macd_bullish = (self.indicators['macd'] > self.indicators['macd_signal']) & \
-                      (self.indicators['macd'].shift(1) <= self.indicators['macd_signal'].shift(1))
-        macd_bearish = (self.indicators['macd'] < self.indicators['macd_signal']) & \
-                      (self.indicators['macd'].shift(1) >= self.indicators['macd_signal'].shift(1))
+        macd_bullish = self.expr.cross_above('macd', 'macd_signal')
+        macd_bearish = self.expr.cross_below('macd', 'macd_signal')
         
         # RSI conditions
         rsi_oversold = self.indicators['rsi_14'] < 30
@@ -451,15 +520,13 @@ class TradingStrategies:
         # Bollinger Bands signals
         bb_oversold = close <= self.indicators['bb_lower_20']
         bb_overbought = close >= self.indicators['bb_upper_20']
-        bb_squeeze = self.indicators['bb_width_20'] < self.indicators['bb_width_20'].rolling(20).mean() * 0.8
+        bb_squeeze = self.indicators['bb_width_20'] < self.expr.rolling_mean('bb_width_20', 20) * 0.8
         
         # Stochastic signals
         stoch_oversold = (self.indicators['stoch_k'] < 20) & (self.indicators['stoch_d'] < 20)
         stoch_overbought = (self.indicators['stoch_k'] > 80) & (self.indicators['stoch_d'] > 80)
-        stoch_k_cross_up = (self.indicators['stoch_k'] > self.indicators['stoch_d']) & \
-                          (self.indicators['stoch_k'].shift(1) <= self.indicators['stoch_d'].shift(1))
-        stoch_k_cross_down = (self.indicators['stoch_k'] < self.indicators['stoch_d']) & \
-                           (self.indicators['stoch_k'].shift(1) >= self.indicators['stoch_d'].shift(1))
+        stoch_k_cross_up = self.expr.cross_above('stoch_k', 'stoch_d')
+        stoch_k_cross_down = self.expr.cross_below('stoch_k', 'stoch_d')
         
         # Combined signals
         buy_signal = bb_oversold & stoch_oversold & stoch_k_cross_up
@@ -494,8 +561,9 @@ class TradingStrategies:
         price_below_all_emas = self.indicators['close'] < self.indicators['ema_8']
         
         # ATR volatility filter
-        high_volatility = self.indicators['atr_14'] > self.indicators['atr_14'].rolling(20).mean() * 1.2
-        normal_volatility = self.indicators['atr_14'] <= self.indicators['atr_14'].rolling(20).mean() * 1.5
+        atr_mean_20 = self.expr.rolling_mean('atr_14', 20)
+        high_volatility = self.indicators['atr_14'] > atr_mean_20 * 1.2
+        normal_volatility = self.indicators['atr_14'] <= atr_mean_20 * 1.5
         
         # Volume confirmation
         volume_confirmation = self.indicators['volume_momentum'] > 1.1
@@ -519,14 +587,14 @@ class TradingStrategies:
         # Williams %R signals
         wr_oversold = self.indicators['williams_r'] < -80
         wr_overbought = self.indicators['williams_r'] > -20
-        wr_bullish_exit = (self.indicators['williams_r'] > -80) & (self.indicators['williams_r'].shift(1) <= -80)
-        wr_bearish_exit = (self.indicators['williams_r'] < -20) & (self.indicators['williams_r'].shift(1) >= -20)
+        wr_bullish_exit = self.expr.cross_above('williams_r', -80)
+        wr_bearish_exit = self.expr.cross_below('williams_r', -20)
         
         # CCI signals
         cci_oversold = self.indicators['cci'] < -100
         cci_overbought = self.indicators['cci'] > 100
-        cci_bullish_cross = (self.indicators['cci'] > -100) & (self.indicators['cci'].shift(1) <= -100)
-        cci_bearish_cross = (self.indicators['cci'] < 100) & (self.indicators['cci'].shift(1) >= 100)
+        cci_bullish_cross = self.expr.cross_above('cci', -100)
+        cci_bearish_cross = self.expr.cross_below('cci', 100)
         
         # Combined signals
         buy_signal = (wr_oversold & cci_oversold) | (wr_bullish_exit & cci_bullish_cross)
@@ -596,8 +664,8 @@ class TradingStrategies:
         rsi_21_bearish = (self.indicators['rsi_21'] > 25) & (self.indicators['rsi_21'] < 55)
         
         # OBV trend (simplified - would need proper calculation)
-        obv_rising = self.indicators['obv'] > self.indicators['obv'].shift(5)
-        obv_falling = self.indicators['obv'] < self.indicators['obv'].shift(5)
+        obv_rising = self.expr.rising('obv', 5)
+        obv_falling = self.expr.falling('obv', 5)
         
         # Combined signals
         buy_signal = strong_upward_momentum & high_volume & rsi_14_bullish & rsi_21_bullish & obv_rising
@@ -626,8 +694,8 @@ class TradingStrategies:
         near_resistance = abs(close - self.indicators['resistance']) / close < 0.01
         
         # Momentum confirmation at key levels
-        rsi_bounce_from_oversold = (self.indicators['rsi_14'] > 35) & (self.indicators['rsi_14'].shift(1) <= 30)
-        rsi_reject_from_overbought = (self.indicators['rsi_14'] < 65) & (self.indicators['rsi_14'].shift(1) >= 70)
+        rsi_bounce_from_oversold = (self.indicators['rsi_14'] > 35) & (self.expr.shifted('rsi_14', 1) <= 30)
+        rsi_reject_from_overbought = (self.indicators['rsi_14'] < 65) & (self.expr.shifted('rsi_14', 1) >= 70)
         
         # Volume spike for breakouts
         volume_spike = self.indicators['volume_momentum'] > 2.0
@@ -650,6 +718,32 @@ class TradingStrategies:
             'description': 'Trades bounces from key levels and breakouts with volume confirmation'
         }
     
+    def custom_expression_strategy(self, name, buy, sell=None, description=None):
+        """User-defined strategy from compiled buy/sell expressions over indicator columns"""
+        if not isinstance(name, str) or not CUSTOM_STRATEGY_NAME.match(name) or \
+                any(word in name for word in ('buy', 'sell', 'exit')):
+            raise ExpressionError(f"Invalid custom strategy name '{name}'")
+        if f'{name}_buy' in self.signals.columns:
+            raise ExpressionError(f"Strategy '{name}' already exists")
+        
+        buy_signal = pd.Series(compile_expression(buy).evaluate(self.indicators, self.expr),
+                               index=self.indicators.index)
+        if sell:
+            sell_signal = pd.Series(compile_expression(sell).evaluate(self.indicators, self.expr),
+                                    index=self.indicators.index)
+        else:
+            sell_signal = pd.Series(False, index=self.indicators.index)
+        
+        self.signals[f'{name}_buy'] = buy_signal
+        self.signals[f'{name}_sell'] = sell_signal
+        
+        return {
+            'name': name,
+            'buy_signals': buy_signal.sum(),
+            'sell_signals': sell_signal.sum(),
+            'description': description or f'Custom: {buy}'
+        }
+    
     def run_all_strategies(self):
         """Run all trading strategies and return comprehensive analysis"""
         strategies_results = []
@@ -672,16 +766,23 @@ class TradingStrategies:
         strategies_results.append(self.volume_price_momentum_strategy())
         strategies_results.append(self.fibonacci_support_resistance_strategy())
         
+        for custom in self.custom_strategies:
+            strategies_results.append(self.custom_expression_strategy(
+                custom.get('name'), custom.get('buy'), custom.get('sell'), custom.get('description')
+            ))
+        
         # Get current signals
         current_signals = self.get_current_signals()
         
-        # Calculate strategy consensus
-        consensus = self.calculate_consensus()
+        # Calculate strategy consensus for every bar, then summarize the latest one
+        consensus_series = self.calculate_consensus_series()
+        consensus = self.calculate_consensus(consensus_series)
         
         return {
             'strategies_results': strategies_results,
             'current_signals': current_signals,
             'consensus': consensus,
+            'consensus_df': consensus_series,
             'signals_df': self.signals
         }
     
@@ -711,45 +812,63 @@ class TradingStrategies:
         
         return active_signals
     
-    def calculate_consensus(self):
-        """Calculate consensus across all strategies"""
-        if len(self.signals) == 0:
-            return {}
-        
-        latest_signals = self.signals.iloc[-1]
-        
-        # Count buy and sell signals
+    def _consensus_columns(self):
+        """Buy and sell columns that take part in the strategy vote"""
         buy_columns = [col for col in self.signals.columns if 'buy' in col]
         sell_columns = [col for col in self.signals.columns if 'sell' in col and 'exit' not in col]
-        
-        buy_count = latest_signals[buy_columns].sum()
-        sell_count = latest_signals[sell_columns].sum()
+        return buy_columns, sell_columns
+
+    def calculate_consensus_series(self):
+        """Vectorized consensus for every bar, computed from the signal matrix in one pass"""
+        buy_columns, sell_columns = self._consensus_columns()
         total_strategies = len(buy_columns)
+        index = self.signals.index
+        
+        buy_count = self.signals[buy_columns].to_numpy(dtype=bool).sum(axis=1)
+        sell_count = self.signals[sell_columns].to_numpy(dtype=bool).sum(axis=1)
         
-        # Calculate percentages
-        buy_percentage = (buy_count / total_strategies) * 100
-        sell_percentage = (sell_count / total_strategies) * 100
+        # No strategy columns: NaN percentages and a NEUTRAL label, as the per-bar version gave
+        with np.errstate(divide='ignore', invalid='ignore'):
+            buy_percentage = (buy_count / total_strategies) * 100
+            sell_percentage = (sell_count / total_strategies) * 100
         neutral_percentage = 100 - buy_percentage - sell_percentage
         
-        # Determine overall signal
-        if buy_percentage >= 60:
-            overall_signal = "STRONG BUY"
-        elif buy_percentage >= 40:
-            overall_signal = "BUY"
-        elif sell_percentage >= 60:
-            overall_signal = "STRONG SELL"
-        elif sell_percentage >= 40:
-            overall_signal = "SELL"
-        else:
-            overall_signal = "NEUTRAL"
+        # Same precedence as the single-bar label: buy thresholds win over sell
+        signal_code = np.select(
+            [buy_percentage >= 60, buy_percentage >= 40, sell_percentage >= 60, sell_percentage >= 40],
+            [2, 1, -2, -1],
+            default=0
+        ).astype(np.int8)
         
-        return {
-            'overall_signal': overall_signal,
+        return pd.DataFrame({
+            'buy_count': buy_count,
+            'sell_count': sell_count,
             'buy_percentage': buy_percentage,
             'sell_percentage': sell_percentage,
             'neutral_percentage': neutral_percentage,
-            'buy_count': int(buy_count),
-            'sell_count': int(sell_count),
+            'signal_code': signal_code
+        }, index=index, columns=CONSENSUS_SERIES_COLUMNS)
+
+    def calculate_consensus(self, consensus_series=None):
+        """Calculate consensus across all strategies"""
+        if len(self.signals) == 0:
+            return {}
+        
+        if consensus_series is None:
+            consensus_series = self.calculate_consensus_series()
+        total_strategies = len(self._consensus_columns()[0])
+        latest = consensus_series.iloc[-1]
+        
+        buy_percentage = latest['buy_percentage']
+        sell_percentage = latest['sell_percentage']
+        
+        return {
+            'overall_signal': CONSENSUS_LABELS[int(latest['signal_code'])],
+            'buy_percentage': buy_percentage,
+            'sell_percentage': sell_percentage,
+            'neutral_percentage': latest['neutral_percentage'],
+            'buy_count': int(latest['buy_count']),
+            'sell_count': int(latest['sell_count']),
             'total_strategies': total_strategies,
             'confidence': max(buy_percentage, sell_percentage)
         }
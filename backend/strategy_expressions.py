@@ -0,0 +1,307 @@
+# strategy_expressions.py - Safe, compiled user-defined strategy expressions
+#
+# Expressions are written over indicator columns, e.g.
+#     cross_above(ema_5, ema_8) and volume_momentum > 0.8
+# They are parsed with the `ast` module against a small whitelist, compiled once
+# into a flat evaluation plan over NumPy arrays and cached by expression hash.
+# No user code is ever executed.
+import ast
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+MAX_EXPRESSION_LENGTH = 1000
+MAX_PLAN_STEPS = 200
+MAX_LOOKBACK = 500
+PLAN_CACHE_SIZE = 256
+
+# name: (argument types, result type); 'int' arguments must be integer literals
+FUNCTIONS = {
+    'cross_above': (('num', 'num'), 'bool'),
+    'cross_below': (('num', 'num'), 'bool'),
+    'rising': (('num', 'int?'), 'bool'),
+    'falling': (('num', 'int?'), 'bool'),
+    'shifted': (('num', 'int?'), 'num'),
+    'rolling_mean': (('num', 'int'), 'num'),
+    'abs': (('num',), 'num'),
+    'min': (('num', 'num'), 'num'),
+    'max': (('num', 'num'), 'num'),
+}
+
+_COMPARE_OPS = {ast.Gt: 'gt', ast.GtE: 'ge', ast.Lt: 'lt', ast.LtE: 'le', ast.Eq: 'eq', ast.NotEq: 'ne'}
+_ARITH_OPS = {ast.Add: 'add', ast.Sub: 'sub', ast.Mult: 'mul', ast.Div: 'div'}
+
+
+class ExpressionError(ValueError):
+    """Raised when a strategy expression cannot be parsed, compiled or evaluated"""
+
+
+class CompiledExpression:
+    """
+    Flat evaluation plan for one expression.
+
+    steps: list of (op, args) tuples; args reference earlier steps by index.
+    result: index of the (boolean) step holding the final value.
+    """
+
+    def __init__(self, source, key, steps, result, columns):
+        self.source = source
+        self.key = key
+        self.steps = steps
+        self.result = result
+        self.columns = columns
+
+    def evaluate(self, columns, primitives=None):
+        """
+        Evaluate the plan against a column mapping (DataFrame or dict of arrays).
+
+        primitives: optional strategies.StrategyExpressions; calls whose operands
+        are plain columns are served from its memo cache so built-in and custom
+        strategies share the same crossover/shift results.
+        Returns a boolean NumPy array.
+        """
+        missing = [name for name in self.columns if name not in columns]
+        if missing:
+            raise ExpressionError(f"Unknown indicator column(s): {', '.join(missing)}")
+
+        values = []
+        for op, args in self.steps:
+            values.append(self._run_step(op, args, values, columns, primitives))
+        return np.asarray(values[self.result], dtype=bool)
+
+    def _run_step(self, op, args, values, columns, primitives):
+        if op == 'col':
+            return np.asarray(columns[args[0]], dtype=float)
+        if op == 'const':
+            return args[0]
+        if op == 'cmp':
+            cmp, a, b = args
+            return _COMPARE_FUNCS[cmp](values[a], values[b])
+        if op == 'and':
+            return np.logical_and.reduce([values[i] for i in args])
+        if op == 'or':
+            return np.logical_or.reduce([values[i] for i in args])
+        if op == 'not':
+            return np.logical_not(values[args[0]])
+        if op == 'neg':
+            return -values[args[0]]
+        if op == 'arith':
+            arith, a, b = args
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return _ARITH_FUNCS[arith](values[a], values[b])
+        if op == 'call':
+            return self._run_call(args, values, primitives)
+        raise ExpressionError(f"Unknown plan step '{op}'")
+
+    def _run_call(self, args, values, primitives):
+        name, operands, params, sources = args
+        if primitives is not None and sources is not None and hasattr(primitives, name):
+            result = getattr(primitives, name)(*sources, *params)
+            if hasattr(result, 'to_numpy'):
+                return result.to_numpy(dtype=bool if FUNCTIONS[name][1] == 'bool' else float)
+            return result
+
+        operands = [values[i] for i in operands]
+        if name == 'shifted':
+            return _shift(operands[0], params[0])
+        if name == 'rising':
+            return operands[0] > _shift(operands[0], params[0])
+        if name == 'falling':
+            return operands[0] < _shift(operands[0], params[0])
+        if name == 'cross_above':
+            a, b = operands
+            return (a > b) & (_shift(a, 1) <= _shift(b, 1))
+        if name == 'cross_below':
+            a, b = operands
+            return (a < b) & (_shift(a, 1) >= _shift(b, 1))
+        if name == 'rolling_mean':
+            return _rolling_mean(operands[0], params[0])
+        if name == 'abs':
+            return np.abs(operands[0])
+        if name == 'min':
+            return np.minimum(operands[0], operands[1])
+        if name == 'max':
+            return np.maximum(operands[0], operands[1])
+        raise ExpressionError(f"Unknown function '{name}'")
+
+
+_COMPARE_FUNCS = {
+    'gt': np.greater, 'ge': np.greater_equal, 'lt': np.less,
+    'le': np.less_equal, 'eq': np.equal, 'ne': np.not_equal
+}
+_ARITH_FUNCS = {'add': np.add, 'sub': np.subtract, 'mul': np.multiply, 'div': np.divide}
+
+
+def _shift(x, n):
+    """NumPy equivalent of Series.shift(n) for n >= 1 (scalars pass through)"""
+    if np.ndim(x) == 0:
+        return x
+    out = np.full(len(x), np.nan)
+    if n < len(x):
+        out[n:] = x[:len(x) - n]
+    return out
+
+
+def _rolling_mean(x, window):
+    """NumPy equivalent of Series.rolling(window).mean() (NaN until the window is full)"""
+    if np.ndim(x) == 0:
+        return x
+    valid = np.isfinite(x)
+    sums = np.concatenate([[0.0], np.cumsum(np.where(valid, x, 0.0))])
+    counts = np.concatenate([[0], np.cumsum(valid)])
+    out = np.full(len(x), np.nan)
+    if window <= len(x):
+        full = counts[window:] - counts[:-window] == window
+        means = (sums[window:] - sums[:-window]) / window
+        out[window - 1:] = np.where(full, means, np.nan)
+    return out
+
+
+class _Compiler:
+    """Walks a parsed expression and emits a common-subexpression-free plan"""
+
+    def __init__(self):
+        self.steps = []
+        self.types = []
+        self.sources = []
+        self.seen = {}
+        self.columns = []
+
+    def emit(self, op, args, result_type, source=None):
+        key = (op, args)
+        if key in self.seen:
+            return self.seen[key]
+        if len(self.steps) >= MAX_PLAN_STEPS:
+            raise ExpressionError("Expression is too complex")
+        self.steps.append((op, args))
+        self.types.append(result_type)
+        self.sources.append(source)
+        self.seen[key] = len(self.steps) - 1
+        return self.seen[key]
+
+    def expect(self, index, expected, node):
+        if self.types[index] != expected:
+            kind = 'a condition' if expected == 'bool' else 'a number'
+            raise ExpressionError(f"Expected {kind} at column {node.col_offset + 1}")
+        return index
+
+    def visit(self, node):
+        if isinstance(node, ast.Expression):
+            return self.visit(node.body)
+        if isinstance(node, ast.Name):
+            if node.id in FUNCTIONS:
+                raise ExpressionError(f"'{node.id}' is a function and must be called")
+            if node.id not in self.columns:
+                self.columns.append(node.id)
+            return self.emit('col', (node.id,), 'num', source=node.id)
+        if isinstance(node, ast.Constant):
+            if isinstance(node.value, bool) or not isinstance(node.value, (int, float)):
+                raise ExpressionError(f"Unsupported literal {node.value!r}")
+            return self.emit('const', (float(node.value),), 'num', source=float(node.value))
+        if isinstance(node, ast.UnaryOp):
+            operand = self.visit(node.operand)
+            if isinstance(node.op, ast.Not):
+                return self.emit('not', (self.expect(operand, 'bool', node),), 'bool')
+            if isinstance(node.op, ast.USub):
+                if self.steps[operand][0] == 'const':
+                    value = -self.steps[operand][1][0]
+                    return self.emit('const', (value,), 'num', source=value)
+                return self.emit('neg', (self.expect(operand, 'num', node),), 'num')
+            if isinstance(node.op, ast.UAdd):
+                return self.expect(operand, 'num', node)
+        if isinstance(node, ast.BoolOp):
+            operands = tuple(self.expect(self.visit(v), 'bool', v) for v in node.values)
+            return self.emit('and' if isinstance(node.op, ast.And) else 'or', operands, 'bool')
+        if isinstance(node, ast.BinOp) and type(node.op) in _ARITH_OPS:
+            left = self.expect(self.visit(node.left), 'num', node.left)
+            right = self.expect(self.visit(node.right), 'num', node.right)
+            return self.emit('arith', (_ARITH_OPS[type(node.op)], left, right), 'num')
+        if isinstance(node, ast.Compare):
+            return self.visit_compare(node)
+        if isinstance(node, ast.Call):
+            return self.visit_call(node)
+        raise ExpressionError(f"Unsupported syntax '{type(node).__name__}' at column {getattr(node, 'col_offset', 0) + 1}")
+
+    def visit_compare(self, node):
+        # Chained comparisons (25 < rsi_14 < 75) become a conjunction of pairs
+        operands = [node.left] + list(node.comparators)
+        indices = [self.expect(self.visit(o), 'num', o) for o in operands]
+        parts = []
+        for op, left, right in zip(node.ops, indices, indices[1:]):
+            if type(op) not in _COMPARE_OPS:
+                raise ExpressionError(f"Unsupported comparison at column {node.col_offset + 1}")
+            parts.append(self.emit('cmp', (_COMPARE_OPS[type(op)], left, right), 'bool'))
+        return parts[0] if len(parts) == 1 else self.emit('and', tuple(parts), 'bool')
+
+    def visit_call(self, node):
+        if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS:
+            raise ExpressionError(f"Unknown function at column {node.col_offset + 1}")
+        if node.keywords:
+            raise ExpressionError(f"{node.func.id}() does not take keyword arguments")
+        name = node.func.id
+        signature, result_type = FUNCTIONS[name]
+        required = [t for t in signature if not t.endswith('?')]
+        if not len(required) <= len(node.args) <= len(signature):
+            raise ExpressionError(f"{name}() takes {len(signature)} argument(s)")
+
+        operands, params, sources = [], [], []
+        for arg_type, arg in zip(signature, node.args):
+            if arg_type.startswith('int'):
+                if not (isinstance(arg, ast.Constant) and type(arg.value) is int and 1 <= arg.value <= MAX_LOOKBACK):
+                    raise ExpressionError(f"{name}() lookback must be an integer between 1 and {MAX_LOOKBACK}")
+                params.append(arg.value)
+            else:
+                index = self.expect(self.visit(arg), 'num', arg)
+                operands.append(index)
+                sources.append(self.sources[index])
+        if len(params) < sum(1 for t in signature if t.startswith('int')):
+            params.append(1)
+
+        shareable = all(s is not None for s in sources) and isinstance(sources[0], str)
+        args = (name, tuple(operands), tuple(params), tuple(sources) if shareable else None)
+        return self.emit('call', args, result_type)
+
+
+_plan_cache = OrderedDict()
+_plan_cache_lock = threading.Lock()
+
+
+def compile_expression(source):
+    """Parse and compile an expression, returning a cached CompiledExpression"""
+    if not isinstance(source, str) or not source.strip():
+        raise ExpressionError("Expression must be a non-empty string")
+    if len(source) > MAX_EXPRESSION_LENGTH:
+        raise ExpressionError(f"Expression longer than {MAX_EXPRESSION_LENGTH} characters")
+    try:
+        tree = ast.parse(source.strip(), mode='eval')
+        # The normalized AST ignores whitespace/formatting differences
+        key = hashlib.sha256(ast.dump(tree).encode()).hexdigest()
+    except SyntaxError as e:
+        raise ExpressionError(f"Invalid expression: {e.msg}") from None
+    except (RecursionError, MemoryError):
+        raise ExpressionError("Expression is too deeply nested") from None
+    with _plan_cache_lock:
+        if key in _plan_cache:
+            _plan_cache.move_to_end(key)
+            return _plan_cache[key]
+
+    compiler = _Compiler()
+    try:
+        result = compiler.visit(tree)
+    except RecursionError:
+        raise ExpressionError("Expression is too deeply nested") from None
+    compiler.expect(result, 'bool', tree.body)
+    compiled = CompiledExpression(source, key, compiler.steps, result, compiler.columns)
+
+    with _plan_cache_lock:
+        _plan_cache[key] = compiled
+        while len(_plan_cache) > PLAN_CACHE_SIZE:
+            _plan_cache.popitem(last=False)
+    return compiled
+
+
+def evaluate_expression(source, columns, primitives=None):
+    """Compile (or fetch from cache) and evaluate an expression in one call"""
+    return compile_expression(source).evaluate(columns, primitives)
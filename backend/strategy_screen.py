@@ -0,0 +1,172 @@
+# strategy_screen.py - Signal-only fast screening of strategies
+#
+# Before any position simulation, each strategy's buy and sell columns are
+# scored against forward returns at a few horizons: how often the price
+# moved the signalled way (hit rate), the mean signed return and its t-stat.
+# Signals and forward returns are matrices, so the per-(strategy, side,
+# horizon) sums come from three matrix products:
+#   count = M.T @ valid   sum = M.T @ R   sum of squares = M.T @ R**2
+# with M the (bars x 2*strategies) buy|sell masks and R the (bars x horizons)
+# forward returns. Sums from several symbols add up, so a whole universe is
+# pooled exactly without concatenating bars.
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from backtester import compute_signals, fetch_klines, strategy_signal_matrix
+
+SCREEN_HORIZONS = (1, 5, 20)
+SIDES = ['buy', 'sell']
+
+
+def forward_returns(close, horizons=SCREEN_HORIZONS):
+    """(bars x horizons) simple return from each close to the close h bars later; NaN past the end"""
+    close = np.asarray(close, dtype=float)
+    returns = np.full((len(close), len(horizons)), np.nan)
+    for j, h in enumerate(horizons):
+        if len(close) > h:
+            returns[:-h, j] = close[h:] / close[:-h] - 1
+    return returns
+
+
+def signal_moments(signals_df, close, horizons=SCREEN_HORIZONS):
+    """
+    Per (strategy x side, horizon) sums over the bars where the signal is on
+    and the forward return is known: count, sum and sum of squares of the
+    signed return (negated for sell signals) and the number of hits (> 0).
+
+    Returns (strategies, moments) with moments a dict of (2 * strategies x
+    horizons) arrays, rows ordered as all buys then all sells.
+    """
+    strategies, buy, sell = strategy_signal_matrix(signals_df)
+    returns = forward_returns(close, horizons)
+    valid = np.isfinite(returns)
+    returns = np.where(valid, returns, 0.0)
+
+    masks = np.concatenate([buy, sell], axis=1).T.astype(float)  # (2S x bars)
+    sign = np.concatenate([np.ones(len(strategies)), -np.ones(len(strategies))])[:, None]
+    buy_hits = masks[:len(strategies)] @ (returns > 0)
+    sell_hits = masks[len(strategies):] @ ((returns < 0) & valid)
+    moments = {
+        'count': masks @ valid,
+        'sum': sign * (masks @ returns),
+        'sum_sq': masks @ returns ** 2,
+        'hits': np.concatenate([buy_hits, sell_hits]),
+        # Unconditional moments, for the edge over simply holding
+        'bars': valid.sum(axis=0),
+        'bars_sum': returns.sum(axis=0)
+    }
+    return strategies, moments
+
+
+def screen_table(strategies, moments, horizons=SCREEN_HORIZONS):
+    """
+    Statistics table from (pooled) signal_moments, indexed by (strategy, side,
+    horizon): signals, hit_rate (%), avg_return (%), t_stat and edge (avg
+    return minus the signed unconditional mean return, %).
+
+    Forward returns of overlapping horizons are autocorrelated, so t-stats
+    at long horizons overstate significance; use them to rank, not as p-values.
+    """
+    count, total, sum_sq = moments['count'], moments['sum'], moments['sum_sq']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.where(count > 0, total / count, 0.0)
+        variance = np.where(count > 1, (sum_sq - count * mean ** 2) / (count - 1), 0.0)
+        std_error = np.sqrt(np.maximum(variance, 0.0) / np.maximum(count, 1))
+        t_stat = np.where(std_error > 0, mean / std_error, 0.0)
+        hit_rate = np.where(count > 0, moments['hits'] / count * 100, 0.0)
+        base = np.where(moments['bars'] > 0, moments['bars_sum'] / moments['bars'], 0.0)
+    sign = np.concatenate([np.ones(len(strategies)), -np.ones(len(strategies))])[:, None]
+    edge = np.where(count > 0, mean - sign * base, 0.0)
+
+    index = pd.MultiIndex.from_product([SIDES, strategies, list(horizons)], names=['side', 'strategy', 'horizon'])
+    table = pd.DataFrame({
+        'signals': count.ravel().astype(np.int64),
+        'hit_rate': hit_rate.ravel(),
+        'avg_return': mean.ravel() * 100,
+        't_stat': t_stat.ravel(),
+        'edge': edge.ravel() * 100
+    }, index=index)
+    return table.reorder_levels(['strategy', 'side', 'horizon']).sort_index()
+
+
+def screen_signals(signals_df, close, horizons=SCREEN_HORIZONS):
+    """Screen one symbol's signal frame against its closes (aligned on the same bars)"""
+    strategies, moments = signal_moments(signals_df, close, horizons)
+    return screen_table(strategies, moments, horizons)
+
+
+def pool_moments(results):
+    """Sum signal_moments of several symbols, aligning strategies by name"""
+    strategies = list(dict.fromkeys(name for names, _ in results for name in names))
+    pooled = None
+    for names, moments in results:
+        rows = [strategies.index(name) for name in names]
+        rows = np.concatenate([rows, np.array(rows) + len(strategies)]).astype(int)
+        if pooled is None:
+            pooled = {key: np.zeros((2 * len(strategies),) + value.shape[1:]) if value.ndim == 2 else
+                      np.zeros_like(value, dtype=float) for key, value in moments.items()}
+        for key, value in moments.items():
+            if value.ndim == 2:
+                pooled[key][rows] += value
+            else:
+                pooled[key] += value
+    return strategies, pooled
+
+
+def _symbol_moments(symbol, df, btc_df, horizons, custom_strategies):
+    """compute_signals + signal_moments for one symbol; runs in a worker process"""
+    try:
+        _, results = compute_signals(df, btc_df, custom_strategies)
+    except Exception as e:
+        print(f"Screening {symbol} failed: {e}")
+        return None
+    signals_df = results['signals_df']
+    close = df['close'].reindex(signals_df.index)
+    return signal_moments(signals_df, close, horizons)
+
+
+def screen_universe(symbols, timeframe, start_date, end_date=None, client=None, store=None,
+                    horizons=SCREEN_HORIZONS, max_workers=None, custom_strategies=None):
+    """
+    Screen every strategy over many symbols. Klines come from fetch_klines
+    (client/store as for a Backtester), signals are computed in parallel.
+
+    Returns {'pooled': table over all symbols, 'symbols': {symbol: table}}.
+    """
+    if client is None:
+        from kline_downloader import kline_downloader as client
+    frames = {}
+    for symbol in symbols:
+        try:
+            frames[symbol] = fetch_klines(client, symbol, timeframe, start_date, end_date, store)
+        except Exception as e:
+            print(f"Failed to fetch {symbol}: {e}")
+
+    jobs = [(symbol, df, None, horizons, custom_strategies) for symbol, df in frames.items() if len(df)]
+    workers = min(max_workers or os.cpu_count() or 1, len(jobs))
+    if workers <= 1:
+        outputs = [_symbol_moments(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            outputs = list(pool.map(_symbol_moments, *zip(*jobs)))
+
+    results = {job[0]: output for job, output in zip(jobs, outputs) if output is not None}
+    if not results:
+        raise ValueError("No symbol could be screened")
+    return {
+        'pooled': screen_table(*pool_moments(list(results.values())), horizons),
+        'symbols': {symbol: screen_table(*output, horizons) for symbol, output in results.items()}
+    }
+
+
+def promising_strategies(table, min_t_stat=2.0, min_signals=30):
+    """
+    Strategies with at least one side and horizon whose t-stat (of the signed
+    return, so positive means the signal called the direction) and signal
+    count reach the thresholds.
+    """
+    passing = table[(table['t_stat'] >= min_t_stat) & (table['signals'] >= min_signals)]
+    return sorted(passing.index.get_level_values('strategy').unique())
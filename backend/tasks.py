@@ -5,7 +5,14 @@ from models import db, AISignals
 import json
 from datetime import datetime
 import pytz
-from celery import chain
+from celery import chain, chord, group
+from celery.exceptions import Ignore
+import os
+import redis
+from backtester import Backtester, BacktestCancelled, serialize_backtest
+from checkpoint import checkpoint_path, remove_checkpoint
+from multi_timeframe import frame_payload, payload_frame, run_timeframe, timeframe_jobs
+from simulation_engine import SimulationParams
 
 lebanon_tz = pytz.timezone("Asia/Beirut")
 
@@ -188,3 +195,146 @@ def run_ai_and_save_results(previous_task_result):
     }
     
     return response
+
+
+# Set by DELETE /api/backtest/jobs/<id>; checked by the running job at each progress report
+BACKTEST_CANCEL_KEY = 'backtest:cancel:{}'
+_cancel_redis = None
+
+
+def _backtest_redis():
+    global _cancel_redis
+    if _cancel_redis is None:
+        _cancel_redis = redis.StrictRedis.from_url(celery.conf.broker_url)
+    return _cancel_redis
+
+
+def request_backtest_cancel(job_id):
+    """Ask a running backtest job to stop and drop it if it has not started yet"""
+    _backtest_redis().setex(BACKTEST_CANCEL_KEY.format(job_id), celery.conf.result_expires or 3600, 1)
+    celery.control.revoke(job_id)
+
+
+def backtest_cancel_requested(job_id):
+    try:
+        return bool(_backtest_redis().exists(BACKTEST_CANCEL_KEY.format(job_id)))
+    except redis.RedisError as e:
+        print(f"Cannot check cancellation for backtest {job_id}: {e}")
+        return False
+
+
+BACKTEST_OWNER_KEY = 'backtest:owner:{}'
+
+
+def remember_backtest_owner(job_id, user_id):
+    """Record who submitted a job so only they can poll or cancel it"""
+    _backtest_redis().setex(BACKTEST_OWNER_KEY.format(job_id), celery.conf.result_expires or 86400, str(user_id))
+
+
+def backtest_owner(job_id):
+    owner = _backtest_redis().get(BACKTEST_OWNER_KEY.format(job_id))
+    return owner.decode() if owner is not None else None
+
+
+# acks_late + reject_on_worker_lost: a job whose worker is recycled or killed
+# is redelivered with the same id and resumes from its checkpoint
+@celery.task(bind=True, name='tasks.run_backtest_job', acks_late=True, reject_on_worker_lost=True)
+def run_backtest_job(self, config):
+    """
+    Run a backtest in the worker.
+
+    config: Backtester keyword arguments plus 'use_cache' and an optional
+    'chunk_bars' that runs a memory-bounded chunked backtest (for long
+    ranges on small timeframes); chunked jobs checkpoint between chunks and
+    resume when redelivered after a worker loss. An optional 'monte_carlo'
+    dict of run_monte_carlo arguments adds a Monte Carlo resampling of the
+    trades to the result. Progress is published
+    as state PROGRESS with meta {stage, bars_processed, total_bars, trades};
+    a cancelled job ends in state CANCELLED.
+    """
+    job_id = self.request.id
+    config = dict(config)
+    use_cache = config.pop('use_cache', True)
+    chunk_bars = config.pop('chunk_bars', None)
+    monte_carlo = config.pop('monte_carlo', None)
+    print(f"Backtest job {job_id}: {config.get('symbol')} {config.get('timeframe')}")
+
+    def report(stage, info):
+        if backtest_cancel_requested(job_id):
+            raise BacktestCancelled(job_id)
+        self.update_state(state='PROGRESS', meta={'stage': stage, **info})
+
+    tester = Backtester(**config, api_key=os.getenv('BINANCE_API_KEY'),
+                        api_secret=os.getenv('BINANCE_API_SECRET'))
+    tester.progress_callback = report
+    checkpoint = checkpoint_path('backtest', job_id)
+    try:
+        if chunk_bars:
+            metrics, trades, portfolio = tester.run_chunked(chunk_bars=int(chunk_bars), checkpoint=checkpoint)
+        else:
+            metrics, trades, portfolio = tester.run_backtest(use_cache=use_cache)
+        result = serialize_backtest(metrics, trades, portfolio)
+        if monte_carlo:
+            report('monte_carlo', {'n_paths': monte_carlo.get('n_paths')})
+            result['monte_carlo'] = tester.run_monte_carlo(**monte_carlo)
+    except BacktestCancelled:
+        print(f"Backtest job {job_id} cancelled")
+        remove_checkpoint(checkpoint)
+        self.update_state(state='CANCELLED', meta={'stage': 'cancelled'})
+        raise Ignore()
+    except Exception:
+        remove_checkpoint(checkpoint)
+        raise
+    return result
+
+
+@celery.task(bind=True, name='tasks.run_timeframe_comparison_job')
+def run_timeframe_comparison_job(self, config, timeframes):
+    """
+    Backtest the same settings on several timeframes (see
+    Backtester.compare_timeframes). config: Backtester keyword arguments.
+
+    The finest timeframe is downloaded once here; the job is then replaced by
+    a chord of one run_timeframe_task per timeframe, which run in parallel on
+    the workers, and collect_timeframe_comparison, whose result becomes the
+    job's: {base_timeframe, metrics: {timeframe: metrics},
+    equity_curves: {timeframe: [equity]}}.
+    """
+    job_id = self.request.id
+    if backtest_cancel_requested(job_id):
+        raise Ignore()
+    print(f"Timeframe comparison job {job_id}: {config.get('symbol')} {timeframes}")
+    self.update_state(state='PROGRESS', meta={'stage': 'fetching', 'timeframes': timeframes})
+
+    tester = Backtester(**config, api_key=os.getenv('BINANCE_API_KEY'),
+                        api_secret=os.getenv('BINANCE_API_SECRET'))
+    base_timeframe, jobs = timeframe_jobs(tester, timeframes)
+    if backtest_cancel_requested(job_id):
+        self.update_state(state='CANCELLED', meta={'stage': 'cancelled'})
+        raise Ignore()
+    header = group(run_timeframe_task.s(job_id, tf, frame_payload(df), frame_payload(btc_df), vars(params), custom)
+                   for tf, df, btc_df, params, custom in jobs)
+    return self.replace(chord(header, collect_timeframe_comparison.s(base_timeframe)))
+
+
+@celery.task(bind=True, name='tasks.run_timeframe_task')
+def run_timeframe_task(self, job_id, timeframe, df, btc_df, params, custom_strategies=None):
+    """One timeframe of a comparison job; df/btc_df are multi_timeframe.frame_payload dicts"""
+    if backtest_cancel_requested(job_id):
+        print(f"Timeframe comparison job {job_id} cancelled before {timeframe}")
+        self.update_state(task_id=job_id, state='CANCELLED', meta={'stage': 'cancelled'})
+        raise Ignore()
+    self.update_state(task_id=job_id, state='PROGRESS', meta={'stage': 'simulating', 'timeframe': timeframe})
+    result = run_timeframe(timeframe, payload_frame(df), payload_frame(btc_df), SimulationParams(**params),
+                           custom_strategies)
+    return {'timeframe': timeframe, 'metrics': result['metrics'], 'equity': result['equity'].tolist()}
+
+
+@celery.task(name='tasks.collect_timeframe_comparison')
+def collect_timeframe_comparison(results, base_timeframe):
+    """Chord body of a comparison job: merge the per-timeframe results"""
+    return {
+        'base_timeframe': base_timeframe,
+        'metrics': {result['timeframe']: result['metrics'] for result in results},
+        'equity_curves': {result['timeframe']: result['equity'] for result in results}
+    }
@@ -0,0 +1,86 @@
+# test_kline_downloader.py - Offline downloads through LocalKlineServer into a KlineStore
+import time
+
+import numpy as np
+import pytest
+import requests
+
+from kline_downloader import MAX_RETRIES, PAGE_LIMIT, PAGE_WEIGHT, KlineDownloader, LocalKlineServer
+from kline_store import KlineStore, LocalKlineClient, klines_to_records
+
+NOW = 1_700_000_000_000
+MINUTE = 60_000
+END = NOW - NOW % MINUTE - MINUTE
+START = END - 3_500 * MINUTE
+
+
+@pytest.fixture
+def client():
+    return LocalKlineClient(now_ms=NOW)
+
+
+def test_download_fills_and_tops_up_store(client, tmp_path):
+    store = KlineStore(str(tmp_path))
+    with LocalKlineServer(client=LocalKlineClient(now_ms=NOW)) as server:
+        downloader = KlineDownloader(base_url=server.url, max_workers=4)
+        report = downloader.download('ETHUSDT', '1m', START, END, store=store)
+        assert report['candles_added'] == 3_501
+        assert report['pages'] == 4
+        assert report['duplicates'] == 0 and report['gaps'] == []
+
+        # Only the missing head is fetched
+        requests_before = server.requests
+        report = downloader.download('ETHUSDT', '1m', START - 1_500 * MINUTE, END, store=store)
+        assert report['candles_added'] == 1_500
+        assert server.requests - requests_before == 2
+
+    stored = store.load('ETHUSDT', '1m')
+    expected = klines_to_records(client.get_historical_klines('ETHUSDT', '1m', START - 1_500 * MINUTE, END))
+    assert np.array_equal(np.asarray(stored), expected)
+
+
+def test_fetch_reports_gaps_and_drops_duplicates(client):
+    missing = {START + 10 * MINUTE, START + 11 * MINUTE, START + 2_000 * MINUTE}
+    # Open times at page edges and inside a page, sent twice by the server
+    duplicate = {START, START + PAGE_LIMIT * MINUTE, START + 1_234 * MINUTE}
+    with LocalKlineServer(client=LocalKlineClient(now_ms=NOW), missing=missing, duplicate=duplicate) as server:
+        rows, report = KlineDownloader(base_url=server.url, max_workers=4).fetch('ETHUSDT', '1m', START, END)
+
+    open_times = [row[0] for row in rows]
+    assert open_times == sorted(set(open_times))
+    assert report['duplicates'] == len(duplicate)
+    assert report['gaps'] == [(START + 10 * MINUTE, START + 11 * MINUTE),
+                              (START + 2_000 * MINUTE, START + 2_000 * MINUTE)]
+    expected = [row for row in client.get_historical_klines('ETHUSDT', '1m', START, END) if row[0] not in missing]
+    assert rows == expected
+
+
+def test_rate_limited_requests_back_off_and_retry(client):
+    # Three pages per one-second window; the fourth request is told to wait for the next window
+    with LocalKlineServer(client=LocalKlineClient(now_ms=NOW), weight_limit=3 * PAGE_WEIGHT,
+                          window_seconds=1) as server:
+        rows, report = KlineDownloader(base_url=server.url, max_workers=1).fetch('ETHUSDT', '1m', START, END)
+        assert server.requests > report['pages']
+    assert rows == client.get_historical_klines('ETHUSDT', '1m', START, END)
+
+
+def test_rate_limit_retries_are_capped():
+    with LocalKlineServer(weight_limit=0, window_seconds=1) as server:
+        downloader = KlineDownloader(base_url=server.url, max_workers=1)
+        with pytest.raises(requests.HTTPError):
+            downloader.get_klines('ETHUSDT', '1m', startTime=START)
+        assert server.requests == MAX_RETRIES + 1
+
+
+def test_long_retry_after_raises_without_waiting():
+    # Retry-After is at least a second, past max_retry_after=0 (like a 418 IP ban past any ceiling)
+    with LocalKlineServer(weight_limit=0, window_seconds=3600) as server:
+        downloader = KlineDownloader(base_url=server.url, max_workers=1, max_retry_after=0)
+        started = time.monotonic()
+        with pytest.raises(requests.HTTPError):
+            downloader.get_klines('ETHUSDT', '1m', startTime=START)
+        # Later requests fail fast while the back-off lasts, without hitting the server
+        with pytest.raises(requests.HTTPError):
+            downloader.get_klines('ETHUSDT', '1m', startTime=START)
+        assert server.requests == 1
+        assert time.monotonic() - started < 5
@@ -0,0 +1,143 @@
+# walk_forward.py - Walk-forward optimization for the backtester
+#
+# Rolling windows: optimize the parameter grid on `train_days`, trade the
+# best combination on the following `test_days`, step forward and repeat.
+# Indicators and signal strengths are computed once over the full span and
+# every window is a slice of the same shared-memory arrays; all training
+# runs (windows x combinations) and then all test runs go through one pool.
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from backtester import performance_metrics
+from parameter_sweep import (ParameterSweep, SharedArrays, SWEEP_METRICS, parameter_grid,
+                             run_combo, simulate_slice, _init_worker, _run_combo_worker)
+import parameter_sweep
+
+# Test-period metrics reported per window
+WINDOW_TEST_METRICS = ['return_pct', 'sharpe_ratio', 'max_drawdown', 'win_rate', 'num_trades']
+
+
+def walk_forward_windows(index, train_days, test_days, step_days=None):
+    """
+    Bar bounds (train_lo, train_hi, test_lo, test_hi) of each window over a DatetimeIndex.
+
+    Every window has a full training period; the last test period may be
+    shorter. Test periods are cut at the next window's test start so the
+    stitched out-of-sample curve never counts a bar twice.
+    """
+    train = pd.Timedelta(days=train_days)
+    test = pd.Timedelta(days=test_days)
+    step = pd.Timedelta(days=step_days or test_days)
+    if min(train, test, step) <= pd.Timedelta(0):
+        raise ValueError("train_days, test_days and step_days must be positive")
+
+    times = index.values
+    locate = lambda t: int(np.searchsorted(times, np.datetime64(t), side='left'))
+    windows = []
+    start = index[0]
+    while start + train <= index[-1]:
+        train_lo, test_lo = locate(start), locate(start + train)
+        test_hi = min(locate(start + train + test), locate(start + step + train))
+        if test_lo > train_lo and test_hi > test_lo:
+            windows.append((train_lo, test_lo, test_lo, test_hi))
+        start += step
+    return windows
+
+
+def _run_test_worker(params, bounds):
+    simulator, equity = simulate_slice(parameter_sweep._worker_arrays, params, bounds)
+    return simulator.ledger.records.copy(), equity
+
+
+def _run_test(arrays, params, bounds):
+    simulator, equity = simulate_slice(arrays, params, bounds)
+    return simulator.ledger.records.copy(), equity
+
+
+def run_walk_forward(backtester, grid, train_days=90, test_days=30, step_days=None,
+                     metric='sharpe_ratio', max_workers=None, fetch_btc=True):
+    """
+    Walk-forward analysis of `grid` (see parameter_sweep.parameter_grid).
+
+    Returns a dict with:
+    - windows: one row per window with its dates, chosen parameters, the
+      training score and the out-of-sample test metrics
+    - equity: stitched out-of-sample equity curve (pd.Series)
+    - metrics: performance metrics of the stitched out-of-sample run
+    """
+    if metric not in SWEEP_METRICS:
+        raise ValueError(f"Unknown metric '{metric}', expected one of {SWEEP_METRICS}")
+    sweep = ParameterSweep(backtester, max_workers).prepare(fetch_btc)
+    index, arrays = sweep.index, sweep.arrays
+    combos = grid if isinstance(grid, list) else parameter_grid(grid)
+    params = sweep.combination_params(combos)
+    periods_per_year = backtester._periods_per_year()
+
+    windows = walk_forward_windows(index, train_days, test_days, step_days)
+    if not windows:
+        raise ValueError(f"Not enough data for a {train_days}-day training window")
+
+    train_jobs = [(p, (lo, hi)) for lo, hi, _, _ in windows for p in params]
+    workers = min(sweep.max_workers, len(train_jobs))
+    if workers <= 1:
+        train_results = [run_combo(arrays, p, periods_per_year, bounds) for p, bounds in train_jobs]
+        best = _best_params(train_results, params, len(windows), metric)
+        tests = [_run_test(arrays, params[k], (lo, hi))
+                 for k, (_, _, lo, hi) in zip(best, windows)]
+    else:
+        with SharedArrays(arrays) as shared, ProcessPoolExecutor(
+                max_workers=workers, initializer=_init_worker, initargs=(shared.spec,)) as pool:
+            chunksize = max(1, len(train_jobs) // (workers * 4))
+            train_results = list(pool.map(_run_combo_worker, [p for p, _ in train_jobs],
+                                          itertools.repeat(periods_per_year),
+                                          [bounds for _, bounds in train_jobs], chunksize=chunksize))
+            best = _best_params(train_results, params, len(windows), metric)
+            tests = list(pool.map(_run_test_worker, [params[k] for k in best],
+                                  [(lo, hi) for _, _, lo, hi in windows]))
+
+    # Position sizes are proportional to capital, so a test run started with
+    # the base capital scales exactly to the capital carried from the last one
+    initial_capital = sweep.base_params()['initial_capital']
+    capital = initial_capital
+    equity_parts, index_parts, records_parts, rows = [], [], [], []
+    for w, ((train_lo, train_hi, test_lo, test_hi), k, (records, equity)) in enumerate(zip(windows, best, tests)):
+        scale = capital / initial_capital
+        records['profit'] *= scale
+        records['quantity'] *= scale
+        # Bars of the stitched run, so positions of different windows stay distinct
+        records['entry_idx'] += test_lo
+        records['exit_idx'] += test_lo
+        equity_parts.append(equity[1:] * scale)
+        index_parts.append(index[test_lo:test_hi])
+        records_parts.append(records)
+        test_metrics = performance_metrics(records, equity * scale, capital, periods_per_year)
+        capital = equity_parts[-1][-1]
+
+        rows.append({
+            'train_start': index[train_lo], 'train_end': index[train_hi - 1],
+            'test_start': index[test_lo], 'test_end': index[test_hi - 1],
+            **combos[k],
+            f'train_{metric}': train_results[w * len(params) + k][metric],
+            **{f'test_{name}': test_metrics[name] for name in WINDOW_TEST_METRICS}
+        })
+
+    equity = np.concatenate([[initial_capital]] + equity_parts)
+    equity_index = pd.DatetimeIndex([index[windows[0][2]] - (index[1] - index[0])])
+    for part in index_parts:
+        equity_index = equity_index.append(part)
+    records = np.concatenate(records_parts)
+
+    return {
+        'windows': pd.DataFrame(rows),
+        'equity': pd.Series(equity, index=equity_index, name='equity'),
+        'metrics': performance_metrics(records, equity, initial_capital, periods_per_year)
+    }
+
+
+def _best_params(train_results, params, num_windows, metric):
+    """Index of the best combination for each window (first one on ties)"""
+    scores = np.array([r[metric] for r in train_results], dtype=float).reshape(num_windows, len(params))
+    return [int(k) for k in np.argmax(np.nan_to_num(scores, nan=-np.inf), axis=1)]